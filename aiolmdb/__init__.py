@@ -1,7 +1,26 @@
 import asyncio
+import base64
+import binascii
+import builtins
+import collections
+import functools
+import itertools
 import lmdb
+import logging
 import multiprocessing
+import operator
+import os
+import shutil
+import struct
+import sys
+import threading
+import time
+from .blobs import BlobReader, _abort_stream, _commit_stream, \
+    _delete_chunks, _new_generation, _read_manifest, _remove_stream, \
+    _write_chunks
+from .bloom import BloomFilter
 from .coders import IdentityCoder
+from .tracing import FlightRecorder, Operation, _capture_stack
 from concurrent.futures import ThreadPoolExecutor
 
 __WRAPPED_ATTRS__ = [
@@ -17,45 +36,871 @@ __WRAPPED_ATTRS__ = [
 ]
 
 
-def open(*args, **kwargs):
+logger = logging.getLogger(__name__)
+
+
+def open(*args, executor=None, **kwargs):
     """
-    Creates a new async lmdb enviroment. All arguments are passed to lmdb.open
-    to create the enviroment.
+    Creates a new async lmdb enviroment. All other arguments are passed to
+    lmdb.open to create the enviroment.
+
+    `executor`:
+        The executor to run transactions in, i.e. an
+        `aiolmdb.pool.WorkerPool`. Defaults to a new `ThreadPoolExecutor`
+        with a thread per CPU.
+
+    If the path is missing but ``<path>.old`` exists, left by a
+    :py:meth:`Compaction.switch` interrupted midway, it is moved back first.
     """
+    path = args[0] if args else kwargs.get('path')
+    if path is not None:
+        _recover_switch(path)
     lmdb_env = lmdb.open(*args, **kwargs)
-    return AsyncEnviroment(lmdb_env)
+    async_env = AsyncEnviroment(lmdb_env, executor=executor)
+    # Remembered so the enviroment can be reopened after compaction.
+    async_env._open_args = (args[1:], {key: value
+                                       for key, value in kwargs.items()
+                                       if key != 'path'})
+    return async_env
+
+
+def _recover_switch(path):
+    backup = path.rstrip(os.sep) + '.old'
+    if not os.path.exists(path) and os.path.exists(backup):
+        os.rename(backup, path)
 
 
 def version():
     return lmdb.version()
 
 
-def _action(env, async_db, action, write):
+class ChangeEvent(collections.namedtuple(
+        'ChangeEvent', ['sequence', 'op', 'key', 'value'])):
+    """
+    A committed write to a watched database.
+
+    `sequence`:
+        The position of the change in the database's change log, or ``None``
+        if the database has no change log.
+
+    `op`:
+        Either ``'put'`` or ``'delete'``.
+
+    `key`:
+        The decoded key that was written.
+
+    `value`:
+        The decoded value that was written, or for deletes, the duplicate
+        value that was deleted from a `dupsort=True` database, if any.
+    """
+
+
+class WatchOverflowError(Exception):
+    """
+    Raised by a watch iterator once its queue has overflowed and events have
+    been dropped. Remaining queued events are delivered first.
+    """
+
+
+class TransactionTooOldError(Exception):
+    """
+    Raised from within a read transaction that has outlived the enviroment's
+    `max_read_age`. See :py:meth:`AsyncTransaction.check_age`.
+    """
+
+
+def _action(env, async_db, action, write, max_age=None):
     with env.begin(write=write, db=async_db.db_handle, buffers=True) as txn:
-        async_txn = AsyncTransaction(async_db, txn)
-        return action(async_txn)
+        async_txn = AsyncTransaction(async_db, txn, max_age=max_age)
+        result = action(async_txn)
+        if async_txn.changes or async_txn.encoded_changes:
+            events = async_db._log_changes(txn, async_txn.changes or (),
+                                           async_txn.encoded_changes)
+    if async_txn.changes:
+        async_db._publish_threadsafe(events)
+    return result
+
+
+def _encode_change(op, key, value):
+    header = struct.pack('>cI?', op[0].encode(), len(key), value is not None)
+    return header + bytes(key) + (b'' if value is None else bytes(value))
+
+
+def _decode_change(buf):
+    op, key_len, has_value = struct.unpack('>cI?', buf[:6])
+    key = buf[6:6 + key_len]
+    value = buf[6 + key_len:] if has_value else None
+    return 'put' if op == b'p' else 'delete', key, value
+
+
+# Flags of the default database, which aiolmdb always opens without flags.
+_DEFAULT_FLAGS = {'reverse_key': False, 'dupsort': False, 'integerkey': False,
+                  'integerdup': False, 'dupfixed': False}
+
+
+# Replication log records are a commit timestamp followed by the encoded
+# operations of one transaction. Shipped frames are prefixed by the record's
+# sequence number, timestamp and operations length. Frames with no
+# operations are heartbeats carrying the leader's last sequence number.
+# Each operation carries the flags of its database, so that followers can
+# create databases they have not seen yet.
+_REPLICATION_RECORD = struct.Struct('>d')
+_REPLICATION_FRAME = struct.Struct('>QdI')
+_REPLICATION_OP = struct.Struct('>?HIB')
+_REPLICATED_FLAGS = ('reverse_key', 'dupsort', 'integerkey', 'integerdup',
+                     'dupfixed')
+
+
+def _encode_ops(ops, flags=None):
+    """
+    Encodes a list of (database name, op, key, value) operations with
+    encoded keys and values, where the default database is named ``None``.
+    `flags` maps database names to their flags, as returned by
+    `lmdb._Database.flags`.
+    """
+    bits = {name: sum(1 << i for i, flag in enumerate(_REPLICATED_FLAGS)
+                      if db_flags.get(flag))
+            for name, db_flags in (flags or {}).items()}
+    parts = []
+    for name, op, key, value in ops:
+        change = _encode_change(op, key, value)
+        parts.append(_REPLICATION_OP.pack(name is None, len(name or b''),
+                                          len(change), bits.get(name, 0)))
+        parts.append(name or b'')
+        parts.append(change)
+    return b''.join(parts)
+
+
+def _decode_ops(buf, flags=None):
+    """
+    Decodes operations encoded by `_encode_ops`. If `flags` is not ``None``,
+    it is updated with the flags of each database named.
+    """
+    ops = []
+    offset = 0
+    while offset < len(buf):
+        default, name_len, change_len, bits = _REPLICATION_OP.unpack_from(
+            buf, offset)
+        offset += _REPLICATION_OP.size
+        name = None if default else bytes(buf[offset:offset + name_len])
+        if flags is not None:
+            flags[name] = {flag: bool(bits & 1 << i)
+                           for i, flag in enumerate(_REPLICATED_FLAGS)}
+        offset += name_len
+        op, key, value = _decode_change(buf[offset:offset + change_len])
+        offset += change_len
+        ops.append((name, op, key, value))
+    return ops
+
+
+def _key_order(flags):
+    """
+    Returns a function mapping encoded keys to objects that sort the same way
+    LMDB sorts keys in a database with the given `flags`.
+    """
+    if flags['integerkey']:
+        return lambda key: int.from_bytes(key, sys.byteorder)
+    if flags['reverse_key']:
+        return lambda key: bytes(key)[::-1]
+    return bytes
+
+
+def _seek_after(cursor, after, reverse=False, dupsort=False):
+    """
+    Positions `cursor` on the first record following the raw (key, value)
+    pair `after` in iteration order, whether or not `after` still exists.
+    Values are only compared in `dupsort` databases. Returns ``True`` if the
+    cursor was positioned.
+    """
+    key, value = after
+    if not reverse:
+        if dupsort and cursor.set_range_dup(key, value):
+            return cursor.next() if cursor.value() == value else True
+        if cursor.set_range(key):
+            return cursor.next_nodup() if cursor.key() == key else True
+        return False
+    if dupsort and cursor.set_range_dup(key, value):
+        return cursor.prev()
+    if dupsort and cursor.set_key(key):
+        return cursor.last_dup()
+    if cursor.set_range(key):
+        return cursor.prev_nodup() if cursor.key() == key else cursor.prev()
+    return cursor.last()
+
+
+def _iter_range(cursor, start=None, stop=None, reverse=False, order=bytes,
+                after=None, dupsort=False):
+    """
+    Yields raw (key, value) buffers from `cursor` for encoded keys in the
+    range [`start`, `stop`), in descending order if `reverse` is ``True``.
+    Bounds are compared after mapping keys with `order`, see `_key_order`.
+    If `after` is not ``None``, iteration resumes after that raw (key, value)
+    pair, see `_seek_after`.
+    """
+    lower = None if start is None else order(start)
+    upper = None if stop is None else order(stop)
+    if not reverse:
+        if after is not None:
+            positioned = _seek_after(cursor, after, dupsort=dupsort)
+        elif start is None:
+            positioned = cursor.first()
+        else:
+            positioned = cursor.set_range(start)
+        while positioned:
+            key = cursor.key()
+            if upper is not None and order(key) >= upper:
+                return
+            yield key, cursor.value()
+            positioned = cursor.next()
+    else:
+        if after is not None:
+            positioned = _seek_after(cursor, after, reverse=True,
+                                     dupsort=dupsort)
+        elif stop is None:
+            positioned = cursor.last()
+        elif cursor.set_range(stop):
+            positioned = cursor.prev()
+        else:
+            positioned = cursor.last()
+        while positioned:
+            key = cursor.key()
+            if lower is not None and order(key) < lower:
+                return
+            yield key, cursor.value()
+            positioned = cursor.prev()
+
+
+def _parse_readers(readers):
+    """
+    Parses the reader lock table dump returned by `Environment.readers()`
+    into a list of (pid, thread, txnid) tuples for active readers.
+    """
+    entries = []
+    for line in readers.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) != 3 or not fields[2].isdigit():
+            continue
+        entries.append((int(fields[0]), fields[1], int(fields[2])))
+    return entries
+
+
+def _used_pages(stat):
+    return stat['branch_pages'] + stat['leaf_pages'] + stat['overflow_pages']
+
+
+def _read_dups(txn, key_enc, after, limit):
+    """
+    Reads up to `limit` raw duplicate values of the encoded key `key_enc`,
+    following the raw value `after`, or from the first duplicate if `after` is
+    ``None``. Returns (values, done).
+    """
+    values = []
+    with txn.txn.cursor() as cursor:
+        if after is None:
+            positioned = cursor.set_key(key_enc)
+        else:
+            positioned = cursor.set_key_dup(key_enc, after) and \
+                cursor.next_dup()
+        while positioned and (limit is None or len(values) < limit):
+            values.append(bytes(cursor.value()))
+            positioned = cursor.next_dup()
+    return values, not positioned
+
+
+class _ChunkedIterator():
+    """
+    An async iterator over items fetched a chunk at a time.
+
+    `fetch_chunk`:
+        A no argument function returning an awaitable that resolves to a
+        (items, done) tuple.
+    """
+
+    def __init__(self, fetch_chunk):
+        self._fetch_chunk = fetch_chunk
+        self._items = collections.deque()
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        while not self._items:
+            if self._done:
+                raise StopAsyncIteration
+            items, self._done = yield from self._fetch_chunk()
+            self._items.extend(items)
+        return self._items.popleft()
+
+
+# Marks a key deleted in a write-behind overlay.
+_DELETED = object()
+
+
+def _apply_updates(txn, updates, overlay=None):
+    """
+    Applies a batch of queued (items, single, future) updates within a
+    single write transaction, where `items` is a list of (key, fn) pairs.
+    Each key is read and written at most once, no matter how many updates
+    target it. Returns a list of (exception, result) pairs, one for each
+    update, in the order they were queued. The result is the new value if
+    `single`, else a dict of {key, value}.
+
+    Buffered write-behind writes in `overlay` are written first, so updates
+    observe them.
+
+    An update whose function raises, or whose key or result cannot be
+    encoded, fails alone: none of its keys are changed by it, and the other
+    updates are still written.
+    """
+    for key, value in (overlay or {}).items():
+        if value is _DELETED:
+            txn.delete(key)
+        else:
+            txn.put(key, value)
+    # Maps each updated key to its (key_enc, value, value_enc).
+    values = {}
+    results = []
+    for items, single, _ in updates:
+        staged = {}
+        try:
+            for key, fn in items:
+                if key in staged:
+                    key_enc, value, _ = staged[key]
+                elif key in values:
+                    key_enc, value, _ = values[key]
+                else:
+                    key_enc = txn.key_coder.serialize(key)
+                    value = txn.get(key)
+                value = fn(value)
+                value_enc = txn.value_coder.serialize(value)
+                staged[key] = (key_enc, value, value_enc)
+        except Exception as exc:
+            results.append((exc, None))
+            continue
+        values.update(staged)
+        if single:
+            results.append((None, staged[items[0][0]][1]))
+        else:
+            results.append((None, {key: value
+                                   for key, (_, value, _) in staged.items()}))
+    for key, (key_enc, value, value_enc) in values.items():
+        txn._put_encoded(key, value, key_enc, value_enc)
+    return results
+
+
+def _warmup_chunk(txn, after, inclusive, stop, limit, psize):
+    """
+    Touches up to `limit` entries following the encoded key `after` (or
+    starting at it, if `inclusive`), reading one byte from every page spanned
+    by each value so that it is faulted into the page cache. Returns
+    (last_key, entries, bytes, done).
+    """
+    order = txn._key_order()
+    stop = None if stop is None else order(stop)
+    entries = 0
+    size = 0
+    last_key = after
+    with txn.txn.cursor() as cursor:
+        if after is None:
+            positioned = cursor.first()
+        else:
+            positioned = cursor.set_range(after)
+            if (positioned and not inclusive and
+                    bytes(cursor.key()) == after):
+                positioned = cursor.next_nodup()
+        while positioned and entries < limit:
+            key = bytes(cursor.key())
+            if stop is not None and order(key) >= stop:
+                return last_key, entries, size, True
+            value = cursor.value()
+            sum(value[::psize])
+            entries += 1
+            size += len(key) + len(value)
+            last_key = key
+            positioned = cursor.next()
+    return last_key, entries, size, not positioned
+
+
+def _query_chunk(txn, start, stop, reverse, stages, after, limit,
+                 reduce=None, acc=None):
+    """
+    Runs query `stages` over up to `limit` entries in the encoded key range
+    [`start`, `stop`), resuming after the raw (key, value) pair `after`.
+    Returns (results, last, done), where `last` is the raw (key, value) pair
+    of the last entry scanned. If `reduce` is not ``None``, results are
+    folded into `acc` with it, and `results` is the new accumulator.
+    """
+    def decode(item):
+        return (txn.key_coder.deserialize(item[0]),
+                txn.value_coder.deserialize(item[1]))
+    results = []
+    scanned = 0
+    last = after
+    done = True
+    with txn.txn.cursor() as cursor:
+        for item in txn._iter_range(cursor, start, stop, reverse=reverse,
+                                    after=after):
+            if limit is not None and scanned >= limit:
+                done = False
+                break
+            if not scanned % 256:
+                txn.check_age()
+            scanned += 1
+            txn.bytes += len(item[0]) + len(item[1])
+            last = item
+            keep = True
+            decoded = False
+            for kind, fn, raw in stages:
+                if not raw and not decoded:
+                    item = decode(item)
+                    decoded = True
+                if kind == 'filter':
+                    keep = fn(item)
+                    if not keep:
+                        break
+                else:
+                    item = fn(item)
+                    decoded = True
+            if not keep:
+                continue
+            if not decoded:
+                item = decode(item)
+            if reduce is None:
+                results.append(item)
+            else:
+                acc = reduce(acc, item)
+        if last is not after:
+            last = (bytes(last[0]), bytes(last[1]))
+    return (results if reduce is None else acc), last, done
+
+
+def _prefix_successor(prefix):
+    """
+    Returns the smallest byte string greater than every byte string starting
+    with `prefix`, or ``None`` if there is none.
+    """
+    prefix = bytes(prefix).rstrip(b'\xff')
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
+
+
+def _delete_batch(txn, start, stop, limit):
+    """
+    Deletes up to approximately `limit` entries with encoded keys in the
+    range [`start`, `stop`), all of them if `limit` is ``None``. Returns
+    (deleted, done).
+    """
+    order = txn._key_order()
+    upper = None if stop is None else order(stop)
+    dupsort = txn._flags()['dupsort']
+    deleted = 0
+    with txn.txn.cursor() as cursor:
+        positioned = cursor.first() if start is None \
+            else cursor.set_range(start)
+        while positioned:
+            if limit is not None and deleted >= limit:
+                return deleted, False
+            key = cursor.key()
+            if upper is not None and order(key) >= upper:
+                break
+            if txn.changes is not None:
+                txn._record('delete', txn.key_coder.deserialize(key))
+            deleted += cursor.count() if dupsort else 1
+            # Deleting moves the cursor to the next entry. Keys are never
+            # empty, so an empty key means there is none.
+            cursor.delete(dupdata=True)
+            positioned = bool(cursor.key())
+    return deleted, True
+
+
+def _encode_token(after, reverse, dupsort):
+    """
+    Encodes the raw (key, value) pair `after` as an opaque, URL safe page
+    token. Values are only needed to resume within duplicates.
+    """
+    key, value = after
+    value = value if dupsort else b''
+    return base64.urlsafe_b64encode(
+        struct.pack('>B?I', 1, reverse, len(key)) + key + value).decode()
+
+
+def _decode_token(token, reverse):
+    """
+    Decodes a page token made by `_encode_token`, returning the raw
+    (key, value) pair to resume after.
+    """
+    try:
+        buf = base64.urlsafe_b64decode(token.encode())
+        version, token_reverse, key_len = struct.unpack('>B?I', buf[:6])
+    except (binascii.Error, struct.error, AttributeError):
+        raise ValueError('invalid page token')
+    if version != 1 or len(buf) < 6 + key_len:
+        raise ValueError('invalid page token')
+    if token_reverse != reverse:
+        raise ValueError('page token was issued for the opposite order')
+    return buf[6:6 + key_len], buf[6 + key_len:]
+
+
+# Header of bloom filter sidecar files: a magic number, and the ID of the
+# last transaction committed when the filter was saved.
+_SIDECAR = struct.Struct('>4sQ')
+_SIDECAR_MAGIC = b'ALBF'
+
+
+def _fill_bloom_filter(txn, bloom_filter):
+    with txn.txn.cursor() as cursor:
+        for key in cursor.iternext_nodup(keys=True, values=False):
+            bloom_filter.add(key)
+
+
+def _read_sidecar(path):
+    """
+    Reads a bloom filter sidecar file, returning (txnid, filter), or
+    ``None`` if it is missing or unreadable.
+    """
+    try:
+        with builtins.open(path, 'rb') as sidecar:
+            buf = sidecar.read()
+        magic, txnid = _SIDECAR.unpack_from(buf)
+        if magic != _SIDECAR_MAGIC:
+            return None
+        return txnid, BloomFilter.from_bytes(buf[_SIDECAR.size:])
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _write_sidecar(path, buf):
+    temp_path = path + '.tmp'
+    with builtins.open(temp_path, 'wb') as sidecar:
+        sidecar.write(buf)
+    os.replace(temp_path, path)
+
+
+class _WriteBehindBuffer():
+    """
+    In-memory overlay of writes that have not been committed yet. `pending`
+    holds writes made since the last flush started, `flushing` holds writes
+    being committed by the in-flight flush. Both map keys to values, or to
+    `_DELETED` for deleted keys.
+
+    `waiters` are (future, result) pairs resolved once `pending` is
+    committed, `flushing_waiters` once `flushing` is.
+    """
+
+    def __init__(self, max_items, max_delay):
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.pending = {}
+        self.flushing = {}
+        self.waiters = []
+        self.flushing_waiters = []
+        self.requested = False
+        self.timer = None
+        # Consecutive failed flushes, which back off retries.
+        self.failures = 0
+
+    def __len__(self):
+        return len(self.pending) + len(self.flushing)
+
+    def lookup(self, key):
+        """Returns (found, value) for `key`."""
+        for layer in (self.pending, self.flushing):
+            if key in layer:
+                return True, layer[key]
+        return False, None
+
+    def take(self):
+        """Moves `pending` writes to `flushing` and returns them."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.flushing, self.pending = self.pending, {}
+        self.flushing_waiters, self.waiters = self.waiters, []
+        self.requested = False
+        return self.flushing
+
+    def retry_delay(self):
+        """
+        Returns the delay before retrying a failed flush, doubling with each
+        consecutive failure up to a minute, or `max_delay` if longer.
+        """
+        return min(self.max_delay * 2 ** min(self.failures, 16),
+                   max(self.max_delay, 60.0))
+
+    def finish(self, exc):
+        """Completes the in-flight flush, restoring its writes on failure."""
+        if exc is not None:
+            self.failures += 1
+            for key, value in self.flushing.items():
+                self.pending.setdefault(key, value)
+        else:
+            self.failures = 0
+        for future, result in self.flushing_waiters:
+            if future.cancelled():
+                continue
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+        self.flushing = {}
+        self.flushing_waiters = []
+
+
+class _Watcher():
+    """
+    An async iterator over committed changes to a database. If resuming from
+    a sequence number, logged changes are replayed before live events, and
+    live events already replayed are skipped.
+    """
+
+    def __init__(self, db, prefix, since, max_queue):
+        self._db = db
+        self._prefix = prefix
+        self._last_sequence = since
+        self._replaying = since is not None
+        self._replayed = collections.deque()
+        self._max_queue = max_queue
+        self._queue = collections.deque()
+        self._overflowed = False
+        self._closed = False
+        self._waiter = None
+
+    def _matches(self, event):
+        return self._prefix is None or event.key.startswith(self._prefix)
+
+    def _push_all(self, events):
+        for event in events:
+            if self._overflowed:
+                break
+            if not self._matches(event):
+                continue
+            if len(self._queue) >= self._max_queue:
+                self._overflowed = True
+                break
+            self._queue.append(event)
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        while True:
+            if self._replayed:
+                return self._replayed.popleft()
+            if self._replaying:
+                events = yield from self._db.read_changes(
+                    self._last_sequence)
+                if events:
+                    self._last_sequence = events[-1].sequence
+                    self._replayed.extend(filter(self._matches, events))
+                else:
+                    self._replaying = False
+                continue
+            if self._queue:
+                event = self._queue.popleft()
+                if self._last_sequence is not None and \
+                        event.sequence is not None and \
+                        event.sequence <= self._last_sequence:
+                    continue
+                return event
+            if self._overflowed:
+                raise WatchOverflowError()
+            if self._closed:
+                raise StopAsyncIteration
+            self._waiter = asyncio.get_event_loop().create_future()
+            yield from self._waiter
+            self._waiter = None
+
+    def close(self):
+        """Stops watching. Events already queued are still delivered."""
+        if self in self._db._watchers:
+            self._db._watchers.remove(self)
+        self._closed = True
+        self._wake()
+
+
+class _ActiveJob():
+    """
+    Wraps a job run in the executor, calling `on_finish` on the event loop
+    once it has actually finished. Cancelling the job's future does not stop
+    it once it is running, so it only counts as finished then if it never
+    started, in which case it is skipped.
+    """
+
+    def __init__(self, loop, fn, on_finish):
+        self.loop = loop
+        self.fn = fn
+        self.on_finish = on_finish
+        self.lock = threading.Lock()
+        self.started = False
+        self.abandoned = False
+
+    def __call__(self, *args):
+        with self.lock:
+            if self.abandoned:
+                return None
+            self.started = True
+        try:
+            return self.fn(*args)
+        finally:
+            try:
+                self.loop.call_soon_threadsafe(self.on_finish)
+            except RuntimeError:
+                # The loop was closed, so nobody is waiting for the job.
+                pass
+
+    def done(self, future):
+        if not future.cancelled():
+            return
+        with self.lock:
+            if self.started:
+                return
+            self.abandoned = True
+        self.on_finish()
+
+
+def _count_bytes(action, operation):
+    """
+    Wraps `action` to record the bytes its transaction counted in
+    `operation`.
+    """
+    def counted(txn):
+        try:
+            return action(txn)
+        finally:
+            operation.bytes = txn.bytes
+    return counted
+
+
+def _completed(result):
+    future = asyncio.get_event_loop().create_future()
+    future.set_result(result)
+    return future
+
+
+def _with_default(fn, default):
+    return lambda value: fn(default if value is None else value)
+
+
+def _add(value, delta):
+    return delta if value is None else value + delta
 
 
 class AsyncTransaction():
 
-    def __init__(self, async_db, txn):
+    def __init__(self, async_db, txn, max_age=None):
         self.key_coder = async_db.key_coder
         self.value_coder = async_db.value_coder
         self.db_handle = async_db.db_handle
         self.txn = txn
+        self.bloom_filter = async_db.bloom_filter
+        # Key and value bytes read or written, for tracing.
+        self.bytes = 0
+        self.deadline = None if max_age is None \
+            else time.monotonic() + max_age
+        # (op, key, value) tuples for every write, if the database is watched
+        # or logs changes.
+        self.changes = [] if async_db.tracks_changes else None
+        # (op, key_enc, value_enc) tuples for writes to keys the coders
+        # cannot decode, i.e. stream chunks, which are only replicated.
+        self.encoded_changes = [] if async_db.replicated else None
+
+    def _record(self, op, key, value=None):
+        if self.changes is not None:
+            self.changes.append((op, key, value))
+
+    def _record_encoded(self, op, key_enc, value_enc=None):
+        if self.encoded_changes is not None:
+            self.encoded_changes.append((op, bytes(key_enc),
+                                         None if value_enc is None
+                                         else bytes(value_enc)))
+
+    def _flags(self):
+        if self.db_handle is None:
+            return _DEFAULT_FLAGS
+        return self.db_handle.flags(self.txn)
+
+    def _key_order(self):
+        return _key_order(self._flags())
+
+    def _add_key(self, key_enc):
+        # Added before the write commits, so that the filter never reports a
+        # committed key as missing.
+        if self.bloom_filter is not None:
+            self.bloom_filter.add(key_enc)
+
+    def _iter_range(self, cursor, start=None, stop=None, reverse=False,
+                    after=None):
+        """
+        Yields raw (key, value) buffers for encoded keys in the range
+        [`start`, `stop`), ordered and resumed according to the database's
+        flags. See `_iter_range`.
+        """
+        flags = self._flags()
+        return _iter_range(cursor, start, stop, reverse=reverse,
+                           order=_key_order(flags), after=after,
+                           dupsort=flags['dupsort'])
+
+    def check_age(self):
+        """
+        Raises `TransactionTooOldError` if this is a read transaction that
+        has outlived the enviroment's `max_read_age`. Long running actions
+        passed to :py:meth:`AsyncDatabase.run` should call this periodically,
+        so that they do not hold back page reuse indefinitely.
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise TransactionTooOldError()
+
+    def stat(self):
+        """
+        Return statistics like :py:meth:`Environment.stat`, for this
+        transaction's database.
+        """
+        return self.txn.stat(self.db_handle)
 
     def get(self, key, default=None):
         """
         Fetch the first value matching `key`, returning `default` if `key`
-        does not exist. A cursor must be used to fetch all values for a key in
-        a `dupsort=True` database.
+        does not exist. Use `get_dups` to fetch all values for a key in a
+        `dupsort=True` database.
 
         Equivalent to `mdb_get()
         <http://symas.com/mdb/doc/group__mdb.html#ga8bf10cd91d3f3a83a34d04ce6b07992d>`_ # noqa: E501
         """
         key_enc = self.key_coder.serialize(key)
         buf = self.txn.get(key_enc)
-        return default if buf is None else self.value_coder.deserialize(buf)
+        if buf is None:
+            return default
+        self.bytes += len(buf)
+        return self.value_coder.deserialize(buf)
+
+    def get_multi(self, keys, default=None):
+        """
+        Fetches multiple keys, returning a dict of {key: value}, with
+        `default` as the value of missing keys. Keys and values are
+        serialized and deserialized a batch at a time, see
+        :py:meth:`Coder.serialize_many`.
+        """
+        keys = list(keys)
+        result = dict.fromkeys(keys, default)
+        found = []
+        bufs = []
+        for key, key_enc in zip(keys, self.key_coder.serialize_many(keys)):
+            buf = self.txn.get(key_enc)
+            if buf is not None:
+                self.bytes += len(buf)
+                found.append(key)
+                bufs.append(buf)
+        result.update(zip(found, self.value_coder.deserialize_many(bufs)))
+        return result
 
     def pop(self, key, default=None):
         """
@@ -65,7 +910,11 @@ class AsyncTransaction():
         buf = self.txn.pop(key_enc)
         if buf is None:
             return None
-        return self.value_coder.deserialize(buf)
+        value = self.value_coder.deserialize(buf)
+        # Only the first duplicate is popped from a dupsort database.
+        self._record('delete', key,
+                     value if self._flags()['dupsort'] else None)
+        return value
 
     def replace(self, key, value):
         """
@@ -73,7 +922,12 @@ class AsyncTransaction():
         """
         key_enc = self.key_coder.serialize(key)
         value_enc = self.value_coder.serialize(value)
+        self._add_key(key_enc)
         buf = self.txn.replace(key_enc, value_enc)
+        if buf is not None and self._flags()['dupsort']:
+            # Every duplicate is replaced, not just added to.
+            self._record('delete', key)
+        self._record('put', key, value)
         if buf is None:
             return None
         return self.value_coder.deserialize(buf)
@@ -103,10 +957,37 @@ class AsyncTransaction():
         `overwrite`:
             If ``False``, do not overwrite any existing matching key.
         """
-        key_enc = self.key_coder.serialize(key)
-        value_enc = self.value_coder.serialize(value)
-        return self.txn.put(key_enc, value_enc, dupdata=dupdata,
-                            overwrite=overwrite)
+        return self._put_encoded(key, value, self.key_coder.serialize(key),
+                                 self.value_coder.serialize(value),
+                                 dupdata=dupdata, overwrite=overwrite)
+
+    def _put_encoded(self, key, value, key_enc, value_enc, dupdata=True,
+                     overwrite=True):
+        self._add_key(key_enc)
+        self.bytes += len(key_enc) + len(value_enc)
+        written = self.txn.put(key_enc, value_enc, dupdata=dupdata,
+                               overwrite=overwrite)
+        if written:
+            self._record('put', key, value)
+        return written
+
+    def put_multi(self, items):
+        """
+        Stores multiple (key, value) tuples. Returns a tuple of the number of
+        items consumed and the number of items added.
+        """
+        items = list(items)
+        items_enc = list(zip(
+            self.key_coder.serialize_many([key for key, _ in items]),
+            self.value_coder.serialize_many([value for _, value in items])))
+        for key_enc, value_enc in items_enc:
+            self._add_key(key_enc)
+            self.bytes += len(key_enc) + len(value_enc)
+        with self.txn.cursor() as cursor:
+            result = cursor.putmulti(items_enc)
+        for key, value in items:
+            self._record('put', key, value)
+        return result
 
     def delete(self, key, value=None):
         """
@@ -126,14 +1007,180 @@ class AsyncTransaction():
         """
         key_enc = self.key_coder.serialize(key)
         value_enc = b'' if value is None else self.value_coder.serialize(value)
-        return self.txn.delete(key_enc, value_enc, self.db_handle)
+        deleted = self.txn.delete(key_enc, value_enc, self.db_handle)
+        if deleted:
+            self._record('delete', key, value)
+        return deleted
+
+    def scan(self, start=None, stop=None, limit=None, reverse=False):
+        """
+        Returns a list of decoded (key, value) tuples for keys in the range
+        [`start`, `stop`), in ascending key order, or descending if `reverse`
+        is ``True``. Either bound may be ``None`` to leave the range open.
+        At most `limit` items are returned if it is not ``None``.
+
+        Raises `TransactionTooOldError` if the scan outlives the enviroment's
+        `max_read_age`.
+        """
+        start_enc = None if start is None \
+            else bytes(self.key_coder.serialize(start))
+        stop_enc = None if stop is None \
+            else bytes(self.key_coder.serialize(stop))
+        return self._scan(start_enc, stop_enc, limit, reverse)
+
+    def scan_prefix(self, prefix, limit=None, reverse=False):
+        """
+        Returns a list of decoded (key, value) tuples for keys whose encoding
+        starts with the encoding of `prefix`, i.e. the tuples starting with
+        the elements of `prefix` in a database using a `TupleCoder`. See
+        :py:meth:`scan`.
+        """
+        start_enc = bytes(self.key_coder.serialize(prefix))
+        return self._scan(start_enc, _prefix_successor(start_enc), limit,
+                          reverse)
+
+    def _scan(self, start_enc, stop_enc, limit, reverse):
+        keys = []
+        values = []
+        with self.txn.cursor() as cursor:
+            for key, value in self._iter_range(cursor, start_enc, stop_enc,
+                                               reverse=reverse):
+                if limit is not None and len(keys) >= limit:
+                    break
+                if not len(keys) % 256:
+                    self.check_age()
+                self.bytes += len(key) + len(value)
+                keys.append(key)
+                values.append(value)
+        return list(zip(self.key_coder.deserialize_many(keys),
+                        self.value_coder.deserialize_many(values)))
+
+    def get_dups(self, key, dupfixed_bytes=None):
+        """
+        Returns a list of every value stored under `key` in a `dupsort=True`
+        database, in sorted order.
+
+        `dupfixed_bytes`:
+            For `dupfixed=True` databases, the size of each value. If given
+            and supported by the installed py-lmdb, values are fetched a page
+            at a time with `MDB_GET_MULTIPLE`.
+        """
+        key_enc = self.key_coder.serialize(key)
+        deserialize_many = self.value_coder.deserialize_many
+        with self.txn.cursor() as cursor:
+            if dupfixed_bytes is not None and hasattr(cursor, 'getmulti'):
+                items = cursor.getmulti([key_enc], dupdata=True,
+                                        dupfixed_bytes=dupfixed_bytes)
+                return deserialize_many([value for _, value in items])
+            if not cursor.set_key(key_enc):
+                return []
+            return deserialize_many(list(cursor.iternext_dup(keys=False)))
+
+    def count_dups(self, key):
+        """
+        Returns the number of values stored under `key` in a `dupsort=True`
+        database, or ``0`` if `key` does not exist.
+        """
+        key_enc = self.key_coder.serialize(key)
+        with self.txn.cursor() as cursor:
+            return cursor.count() if cursor.set_key(key_enc) else 0
+
+    def put_dups(self, key, values):
+        """
+        Stores every value in `values` as a duplicate of `key` in a
+        `dupsort=True` database. Returns the number of values added.
+        """
+        key_enc = self.key_coder.serialize(key)
+        values = list(values)
+        items = [(key_enc, value_enc)
+                 for value_enc in self.value_coder.serialize_many(values)]
+        self._add_key(key_enc)
+        with self.txn.cursor() as cursor:
+            added = cursor.putmulti(items, dupdata=True)[1]
+        for value in values:
+            self._record('put', key, value)
+        return added
 
     def drop(self, delete=True):
-        return self.txn.drop(self.db_handle)
+        return self.txn.drop(self.db_handle, delete=delete)
+
+
+class Compaction():
+    """
+    A compacted copy of an enviroment, written by
+    :py:meth:`AsyncEnviroment.compact`.
+
+    `path`:
+        Where the copy was written.
+
+    `txnid`:
+        The ID of the last transaction committed before the copy was made.
+        Transactions committed after it are not in the copy.
+    """
+
+    def __init__(self, async_env, path, txnid, open_args):
+        self.async_env = async_env
+        self.path = path
+        self.txnid = txnid
+        self._open_args = open_args
+
+    @asyncio.coroutine
+    def switch(self):
+        """|coro|
+        Replaces the enviroment's files with the compacted copy, and reopens
+        the enviroment and every database opened through it in place.
+        `AsyncDatabase` objects remain valid.
+
+        Writes are paused while switching, and reads only while the
+        enviroment is reopened. If anything has been committed since the
+        copy was made, the copy is first remade while writes are paused, so
+        no writes are lost. Switch while writes are quiet to keep the pause
+        brief.
+
+        The original files are deleted once the switch succeeds.
+
+        The switch is not atomic: the original files are first moved to
+        ``<path>.old``, then the copy is moved to the enviroment's path. A
+        crash between the two leaves nothing at the path, which
+        :py:func:`aiolmdb.open` recovers from by moving ``<path>.old`` back.
+        No other process, including `AsyncProcessEnviroment` workers, may
+        have the enviroment open, as its files are moved out from under it.
+        """
+        env = self.async_env
+        env._pause(reads=False)
+        try:
+            while env._active[True]:
+                yield from env._wait_idle()
+            if env.env.info()['last_txnid'] != self.txnid:
+                self.txnid = yield from env._submit(
+                    env._copy_compacted, self.path)
+            env._pause(reads=True)
+            while env._active[False] or env._active[True]:
+                yield from env._wait_idle()
+            env._swap(self.path, self._open_args)
+        finally:
+            env._resume()
+
+    def discard(self):
+        """
+        Deletes the compacted copy without switching to it.
+        """
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
 
 
 class AsyncEnviroment():
-    """An asyncio wrapper around lmdb.Enviroment."""
+    """
+    An asyncio wrapper around lmdb.Enviroment.
+
+    `max_read_age`:
+        If not ``None``, the number of seconds a read transaction started by
+        aiolmdb may stay open. Scans, and actions that call
+        :py:meth:`AsyncTransaction.check_age`, raise `TransactionTooOldError`
+        once it is exceeded. Defaults to ``None``, and may be set at any time.
+    """
 
     def __init__(self, env, executor=None):
         worker_count = multiprocessing.cpu_count()
@@ -141,16 +1188,477 @@ class AsyncEnviroment():
         self.env = env
         self.executor = executor or ThreadPoolExecutor(
             max_workers=worker_count)
+        self.max_read_age = None
+        self.reader_report = None
         self._default_db = AsyncDatabase(self, None)
+        self._databases = {}
+        self._database_args = {}
+        self._open_args = None
+        # Number of running executor tasks, keyed by whether they write.
+        self._active = collections.Counter()
+        self._idle_waiters = []
+        self._resumed = None
+        self._reads_paused = False
+        self._trace_hooks = []
+        self._recorder_hook = None
+        self._replication_log = None
+        self._replication_waiters = []
+        self.flight_recorder = None
+        self._reader_first_seen = {}
+        self._reader_timer = None
+        self._dirty_commits = 0
+        self._max_dirty_commits = None
+        self._sync_waiters = []
+        self._sync_requested = False
+        self._syncing = False
+        self._sync_timer = None
 
         for attr in __WRAPPED_ATTRS__:
             setattr(self, attr, getattr(self.env, attr))
 
-    def _run_action(self, async_db, action, write=False):
+    def _run_action(self, async_db, action, write=False, op='run',
+                    count=None):
+        if self._resumed is not None and (write or self._reads_paused):
+            resumed = self._resumed
+
+            @asyncio.coroutine
+            def run():
+                yield from asyncio.shield(resumed)
+                return (yield from self._run_action(async_db, action, write,
+                                                    op, count))
+            return asyncio.ensure_future(run())
+        if not self._trace_hooks:
+            future = self._submit(_action, self.env, async_db, action, write,
+                                  None if write else self.max_read_age,
+                                  write=write)
+        else:
+            operation = self._start_operation(async_db, op, write, count)
+            future = self._submit(operation.wrap(_action), self.env,
+                                  async_db, _count_bytes(action, operation),
+                                  write, None if write else self.max_read_age,
+                                  write=write)
+            future.add_done_callback(
+                lambda future: self._end_operation(operation, future))
+        if write:
+            future.add_done_callback(self._on_commit)
+        return future
+
+    def enable_replication(self, log_db):
+        """
+        Appends the operations of every write transaction committed through
+        aiolmdb, to any database, to a sequenced replication log within the
+        same transaction. Followers apply the log to their own copy of the
+        enviroment, see `aiolmdb.replication.Follower`. `log_db` must be a
+        dedicated database in this enviroment.
+
+        As with :py:meth:`AsyncDatabase.watch`, writes made directly to the
+        underlying `lmdb.Transaction` and `drop` are not logged.
+        """
+        self._replication_log = log_db
+
+    def _log_replication(self, txn, async_db, changes, encoded_changes=()):
+        """
+        Appends the recorded `changes` and `encoded_changes` to `async_db` to
+        the replication log within `txn`. Runs in the executor.
+        """
+        ops = []
+        for op, key, value in changes:
+            value_enc = None if value is None \
+                else async_db.value_coder.serialize(value)
+            ops.append((async_db.name, op,
+                        async_db.key_coder.serialize(key), value_enc))
+        ops.extend((async_db.name, op, key_enc, value_enc)
+                   for op, key_enc, value_enc in encoded_changes or ())
+        flags = _DEFAULT_FLAGS if async_db.db_handle is None \
+            else async_db.db_handle.flags(txn)
+        with txn.cursor(db=self._replication_log.db_handle) as cursor:
+            sequence = 1
+            if cursor.last():
+                sequence = struct.unpack('>Q', cursor.key())[0] + 1
+            cursor.put(struct.pack('>Q', sequence),
+                       _REPLICATION_RECORD.pack(time.time()) +
+                       _encode_ops(ops, {async_db.name: flags}),
+                       append=True)
+
+    def read_replication_log(self, since=0, limit=1000):
+        """|coro|
+        Returns a list of up to `limit` (sequence, timestamp, operations)
+        tuples from the replication log with sequence numbers greater than
+        `since`, in order. `operations` is the encoded operations of a
+        transaction.
+        """
+        log_handle = self._replication_log.db_handle
+
+        def __read_log_action(txn):
+            records = []
+            with txn.txn.cursor(db=log_handle) as cursor:
+                positioned = cursor.set_range(struct.pack('>Q', since + 1))
+                while positioned and len(records) < limit:
+                    record = cursor.value()
+                    records.append((
+                        struct.unpack('>Q', cursor.key())[0],
+                        _REPLICATION_RECORD.unpack_from(record)[0],
+                        bytes(record[_REPLICATION_RECORD.size:])))
+                    positioned = cursor.next()
+            return records
+        return self._replication_log.run(__read_log_action,
+                                         op='read_replication_log')
+
+    @asyncio.coroutine
+    def ship_replication_log(self, writer, since=0, batch_size=1000,
+                             heartbeat=1.0):
+        """|coro|
+        Streams the replication log to a follower through `writer`, an
+        `asyncio.StreamWriter`, starting after sequence number `since`, until
+        cancelled or the connection fails. New records are shipped as soon
+        as they are committed, and a heartbeat is sent every `heartbeat`
+        seconds while idle, so that followers can report their lag.
+        """
+        while True:
+            # Registered before reading, so that no commit is missed.
+            waiter = asyncio.get_event_loop().create_future()
+            self._replication_waiters.append(waiter)
+            try:
+                records = yield from self.read_replication_log(since,
+                                                               batch_size)
+                for sequence, timestamp, operations in records:
+                    writer.write(_REPLICATION_FRAME.pack(
+                        sequence, timestamp, len(operations)) + operations)
+                if records:
+                    since = records[-1][0]
+                else:
+                    try:
+                        yield from asyncio.wait_for(waiter, heartbeat)
+                    except asyncio.TimeoutError:
+                        writer.write(_REPLICATION_FRAME.pack(
+                            since, time.time(), 0))
+            finally:
+                if waiter in self._replication_waiters:
+                    self._replication_waiters.remove(waiter)
+            yield from writer.drain()
+
+    def trim_replication_log(self, before):
+        """|coro|
+        Deletes replication log records with sequence numbers lower than
+        `before`, once every follower has applied them. Returns the number
+        of records deleted.
+        """
+        log_db = self._replication_log
+        return log_db._delete_range(None, struct.pack('>Q', before), 1000)
+
+    def add_trace_hook(self, start=None, end=None):
+        """
+        Registers callbacks invoked on the event loop for every transaction
+        run by the enviroment, each passed an `Operation`. `start` is called
+        when the transaction is submitted to the executor, `end` once it has
+        completed, with its timings filled in. Returns a handle for
+        :py:meth:`remove_trace_hook`.
+
+        Transactions are only timed while a hook is registered.
+        """
+        hook = (start, end)
+        self._trace_hooks.append(hook)
+        return hook
+
+    def remove_trace_hook(self, hook):
+        """
+        Unregisters a hook returned by :py:meth:`add_trace_hook`.
+        """
+        self._trace_hooks.remove(hook)
+
+    def enable_flight_recorder(self, threshold=0.1, size=256):
+        """
+        Starts recording the `size` most recent transactions that took at
+        least `threshold` seconds from submission to completion, along with
+        the stack that issued them. Returns the `FlightRecorder`, also
+        available as `flight_recorder`; call its `dump` or `format` methods
+        to inspect the recorded operations.
+        """
+        self.disable_flight_recorder()
+        self.flight_recorder = FlightRecorder(threshold, size)
+        self._recorder_hook = self.add_trace_hook(end=self.flight_recorder)
+        return self.flight_recorder
+
+    def disable_flight_recorder(self):
+        """
+        Stops the flight recorder, if it is running.
+        """
+        if self.flight_recorder is not None:
+            self.remove_trace_hook(self._recorder_hook)
+            self.flight_recorder = None
+
+    def _start_operation(self, async_db, op, write, count):
+        operation = Operation(async_db.name, op, write, count)
+        if self.flight_recorder is not None:
+            operation.stack = _capture_stack()
+        for start, _ in list(self._trace_hooks):
+            if start is not None:
+                self._call_hook(start, operation)
+        return operation
+
+    def _end_operation(self, operation, future):
+        if operation.finished is None:
+            # Cancelled before it ran.
+            operation.started = operation.finished = time.perf_counter()
+        if not future.cancelled():
+            operation.error = future.exception()
+        for _, end in list(self._trace_hooks):
+            if end is not None:
+                self._call_hook(end, operation)
+
+    def _call_hook(self, hook, operation):
+        try:
+            hook(operation)
+        except Exception:
+            logger.exception('Trace hook failed')
+
+    def _submit(self, fn, *args, write=False):
+        """
+        Runs `fn` in the executor, counting it as active until it completes,
+        even if the returned future is cancelled first.
+        """
+        loop = asyncio.get_event_loop()
+        job = _ActiveJob(loop, fn,
+                         functools.partial(self._finish_active, write))
+        if hasattr(self.executor, 'submit_async'):
+            future = self.executor.submit_async(loop, job, *args)
+        else:
+            future = loop.run_in_executor(self.executor, job, *args)
+        self._active[write] += 1
+        future.add_done_callback(job.done)
+        return future
+
+    def _finish_active(self, write):
+        self._active[write] -= 1
+        if not self._active[write]:
+            waiters, self._idle_waiters = self._idle_waiters, []
+            for future in waiters:
+                if not future.done():
+                    future.set_result(None)
+
+    def _wait_idle(self):
+        """
+        Returns a future resolved the next time either kind of executor task
+        drains.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._idle_waiters.append(future)
+        return future
+
+    def _pause(self, reads):
+        """
+        Holds back new write transactions, and read transactions too if
+        `reads`, until `_resume` is called.
+        """
+        if self._resumed is None:
+            self._resumed = asyncio.get_event_loop().create_future()
+        self._reads_paused = reads
+
+    def _resume(self):
+        resumed, self._resumed = self._resumed, None
+        self._reads_paused = False
+        if resumed is not None:
+            resumed.set_result(None)
+
+    def _on_commit(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._dirty_commits += 1
+        waiters, self._replication_waiters = self._replication_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        if self._max_dirty_commits is not None and \
+                self._dirty_commits >= self._max_dirty_commits:
+            self._request_sync()
+
+    def start_sync_scheduler(self, interval=1.0, max_dirty_commits=None):
+        """
+        Starts periodically flushing data buffers to disk in the background,
+        for enviroments opened with `sync=False`. A forced sync is run every
+        `interval` seconds if anything was committed since the last one, and
+        as soon as `max_dirty_commits` write transactions have committed
+        without one if it is not ``None``.
+
+        Syncs are shared: at most one runs at a time, and every caller of
+        :py:meth:`wait_durable` waiting on it is resolved together.
+        """
+        self.stop_sync_scheduler()
+        self._max_dirty_commits = max_dirty_commits
+
+        def tick():
+            if self._dirty_commits:
+                self._request_sync()
+            self._sync_timer = loop.call_later(interval, tick)
+        loop = asyncio.get_event_loop()
+        self._sync_timer = loop.call_later(interval, tick)
+
+    def stop_sync_scheduler(self):
+        """
+        Stops the background sync scheduler, if it is running.
+        """
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+        self._max_dirty_commits = None
+
+    def start_reader_monitor(self, interval=10.0, max_age=60.0,
+                             callback=None):
+        """
+        Starts periodically checking the reader lock table in the background.
+        Long lived read transactions stop LMDB from reusing pages freed after
+        they started, so the data file grows for as long as they stay open.
+
+        Every `interval` seconds, stale readers left behind by dead processes
+        are cleared with :py:meth:`reader_check`, and the remaining readers
+        are listed with :py:meth:`readers`. A warning is logged for every
+        reader that has been observed reading the same snapshot for at least
+        `max_age` seconds. Reader ages are measured from the first check that
+        observed them, so are accurate to within `interval` seconds.
+
+        Each check stores a report in `reader_report`, and passes it to
+        `callback` on the event loop if it is not ``None``. The report is a
+        dict with:
+
+        `stale_readers`:
+            The number of stale readers cleared by this check.
+
+        `readers`:
+            A list of (pid, thread, txnid, age) tuples for active readers.
+
+        `long_readers`:
+            The subset of `readers` at least `max_age` seconds old.
+
+        `last_txnid`:
+            The ID of the last committed transaction. The gap between it
+            and a reader's txnid is the number of commits the reader is
+            holding back.
+
+        `map_pages`:
+            The number of pages used in the data file.
+
+        `free_pages`:
+            An estimate of the number of pages in the data file not used by
+            the default database or by databases opened by this enviroment.
+            It includes the freelist itself, and pages of databases not
+            opened by this enviroment.
+        """
+        self.stop_reader_monitor()
         loop = asyncio.get_event_loop()
-        return loop.run_in_executor(self.executor, _action,
-                                    self.env, async_db,
-                                    action, write)
+
+        def tick():
+            task = self._submit(self._reader_snapshot)
+            task.add_done_callback(check)
+
+        def check(task):
+            if self._reader_timer is None:
+                return
+            self._reader_timer = loop.call_later(interval, tick)
+            if task.exception() is not None:
+                logger.error('Failed to check the reader table',
+                             exc_info=task.exception())
+                return
+            self.reader_report = self._check_readers(task.result(), max_age)
+            if callback is not None:
+                callback(self.reader_report)
+        self._reader_timer = loop.call_later(interval, tick)
+
+    def stop_reader_monitor(self):
+        """
+        Stops the background reader monitor, if it is running.
+        """
+        if self._reader_timer is not None:
+            self._reader_timer.cancel()
+            self._reader_timer = None
+        self._reader_first_seen = {}
+
+    def _reader_snapshot(self):
+        """
+        Clears stale readers and collects reader and page usage statistics.
+        Runs in the executor.
+        """
+        stale_readers = self.env.reader_check()
+        readers = _parse_readers(self.env.readers())
+        info = self.env.info()
+        # The two meta pages are never part of a database.
+        used_pages = 2 + sum(_used_pages(stat)
+                             for stat in self._database_stats().values())
+        return stale_readers, readers, info, used_pages
+
+    def _database_stats(self):
+        """
+        Returns {name: stat} for the default database, keyed by ``None``, and
+        every database opened through this enviroment. Runs in the executor.
+        """
+        databases = dict(self._databases)
+        databases[None] = self._default_db
+        with self.env.begin() as txn:
+            return {name: txn.stat(db.db_handle)
+                    for name, db in databases.items()}
+
+    def _check_readers(self, snapshot, max_age):
+        stale_readers, readers, info, used_pages = snapshot
+        now = time.monotonic()
+        first_seen = {reader: self._reader_first_seen.get(reader, now)
+                      for reader in readers}
+        self._reader_first_seen = first_seen
+        readers = [reader + (now - first_seen[reader],)
+                   for reader in readers]
+        long_readers = [reader for reader in readers if reader[3] >= max_age]
+        for pid, thread, txnid, age in long_readers:
+            logger.warning('Read transaction %d (pid %d, thread %s) has been '
+                           'open for at least %.0f seconds, %d commits behind',
+                           txnid, pid, thread, age,
+                           info['last_txnid'] - txnid)
+        map_pages = info['last_pgno'] + 1
+        return {
+            'stale_readers': stale_readers,
+            'readers': readers,
+            'long_readers': long_readers,
+            'last_txnid': info['last_txnid'],
+            'map_pages': map_pages,
+            'free_pages': max(map_pages - used_pages, 0),
+        }
+
+    def wait_durable(self):
+        """|coro|
+        Completes once a forced sync started after this call has finished,
+        guaranteeing every transaction committed before the call is on disk.
+        Concurrent callers share a single sync.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._sync_waiters.append(future)
+        self._request_sync()
+        return future
+
+    def _request_sync(self):
+        if self._sync_requested:
+            return
+        self._sync_requested = True
+        if not self._syncing:
+            # Defer a loop iteration, so that callers in the same iteration
+            # share the sync.
+            asyncio.get_event_loop().call_soon(self._start_sync)
+
+    def _start_sync(self):
+        self._sync_requested = False
+        self._syncing = True
+        self._dirty_commits = 0
+        waiters, self._sync_waiters = self._sync_waiters, []
+        task = self._submit(self.env.sync, True)
+        task.add_done_callback(lambda task: self._finish_sync(waiters, task))
+
+    def _finish_sync(self, waiters, task):
+        self._syncing = False
+        for future in waiters:
+            if future.cancelled():
+                continue
+            if task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(None)
+        if self._sync_requested:
+            self._start_sync()
 
     def __enter__(self):
         self.env.__enter__()
@@ -159,13 +1667,30 @@ class AsyncEnviroment():
     def __exit__(self, *args):
         self.env.__exit__(*args)
 
-    def close(self):
+    def close(self, discard_buffered=False):
         """
         Closes the enviroment, invalidating any open iterators, cursors and
         transactions
 
         Repeat calls to close() have no effect.
+
+        Raises ``RuntimeError`` if a database holds writes buffered by
+        write-behind, which must be flushed first, see
+        :py:meth:`AsyncDatabase.flush`.
+
+        `discard_buffered`:
+            If ``True``, close anyway, losing any buffered writes.
         """
+        if not discard_buffered:
+            for async_db in [self._default_db] + list(
+                    self._databases.values()):
+                if async_db._write_behind is not None and \
+                        len(async_db._write_behind):
+                    raise RuntimeError(
+                        'database %r has unflushed write-behind writes'
+                        % async_db.name)
+        self.stop_sync_scheduler()
+        self.stop_reader_monitor()
         self.env.close()
 
     def get_default_db(self):
@@ -174,14 +1699,32 @@ class AsyncEnviroment():
         """
         return self._default_db
 
-    def open_db(self, name, *args, key_coder=None, value_coder=None, **kwargs):
+    def open_db(self, name, *args, key_coder=None, value_coder=None,
+                inline_threshold=None, **kwargs):
         """
         Opens a child database with the provided name. args and kwargs are
         passed into the `AsyncDatabase` constructor.
+
+        Databases opened with `integerkey=True` or `integerdup=True` compare
+        keys or values as native-endian integers, so any key or value coder
+        provided must be a native integer coder (i.e. `NativeUInt64Coder`).
         """
-        return AsyncDatabase(self, self.env.open_db(name, *args, **kwargs),
-                             key_coder=key_coder,
-                             value_coder=value_coder)
+        for flag, coder in (('integerkey', key_coder),
+                            ('integerdup', value_coder)):
+            if kwargs.get(flag) and coder is not None and \
+                    not coder.native_integer:
+                raise ValueError('%s=True databases require a native integer '
+                                 'coder, got %s' % (flag,
+                                                    type(coder).__name__))
+        async_db = AsyncDatabase(self, self.env.open_db(name, *args,
+                                                        **kwargs),
+                                 key_coder=key_coder,
+                                 value_coder=value_coder,
+                                 inline_threshold=inline_threshold)
+        async_db.name = name
+        self._databases[name] = async_db
+        self._database_args[name] = (args, kwargs)
+        return async_db
 
     def copy(self, path, compact=False):
         """|coro|
@@ -199,8 +1742,7 @@ class AsyncEnviroment():
         """
         def __copy_action():
             return self.env.copy(path, compact=compact)
-        loop = asyncio.get_event_loop()
-        return loop.run_in_executor(self.executor, __copy_action)
+        return self._submit(__copy_action)
 
     def copyfd(self, fd, compact=False):
         """|coro|
@@ -217,8 +1759,7 @@ class AsyncEnviroment():
         """
         def __copyfd_action():
             return self.env.copyfd(fd, compact=compact)
-        loop = asyncio.get_event_loop()
-        return loop.run_in_executor(self.executor, __copyfd_action)
+        return self._submit(__copyfd_action)
 
     def sync(self, force=False):
         """|coro|
@@ -237,20 +1778,416 @@ class AsyncEnviroment():
             environment was opened with `sync=False` the flushes will be
             omitted, and with `map_async=True` they will be asynchronous.
         """
-        loop = asyncio.get_event_loop()
-        return loop.run_in_executor(self.executor,
-                                    lambda: self.env.sync(force))
+        return self._submit(lambda: self.env.sync(force))
+
+    @asyncio.coroutine
+    def analyze(self):
+        """|coro|
+        Reports how space is used in the data file, to spot fragmentation
+        before the disk fills up. Returns a dict with:
+
+        `databases`:
+            A dict of {name: stat} for the default database, keyed by
+            ``None``, and every database opened through this enviroment. Each
+            stat is as returned by :py:meth:`Environment.stat`, with `pages`
+            and `bytes` totals added.
+
+        `map_pages`:
+            The number of pages used in the data file.
+
+        `free_pages`:
+            An estimate of the number of pages in the data file that no
+            database uses. See :py:meth:`start_reader_monitor`.
+
+        `overflow_share`:
+            The share of database pages that are overflow pages, holding
+            values too large for a leaf page.
+
+        `reclaimable_bytes`:
+            An estimate of the bytes :py:meth:`compact` would reclaim.
+        """
+        def __analyze_action():
+            return (self.env.stat()['psize'], self.env.info(),
+                    self._database_stats())
+        psize, info, stats = yield from self._submit(__analyze_action)
+        databases = {}
+        for name, stat in stats.items():
+            stat = dict(stat, pages=_used_pages(stat))
+            stat['bytes'] = stat['pages'] * psize
+            databases[name] = stat
+        pages = sum(stat['pages'] for stat in databases.values())
+        overflow_pages = sum(stat['overflow_pages']
+                             for stat in databases.values())
+        map_pages = info['last_pgno'] + 1
+        # The two meta pages are never part of a database.
+        free_pages = max(map_pages - 2 - pages, 0)
+        return {
+            'databases': databases,
+            'map_pages': map_pages,
+            'free_pages': free_pages,
+            'overflow_share': overflow_pages / pages if pages else 0.0,
+            'reclaimable_bytes': free_pages * psize,
+        }
+
+    @asyncio.coroutine
+    def compact(self, path=None, **kwargs):
+        """|coro|
+        Writes a compacted copy of the enviroment with `copy(compact=True)`
+        in the background, returning a `Compaction`. Call
+        :py:meth:`Compaction.switch` to switch the enviroment over to it, or
+        :py:meth:`Compaction.discard` to delete it.
+
+        `path`:
+            Where to write the copy. Defaults to a sibling of the
+            enviroment's path, with ``.compact`` appended. Must be on the same
+            filesystem, and must not hold an existing copy.
+
+        `kwargs`:
+            Passed to `lmdb.open` when reopening the enviroment after
+            switching. Defaults to the arguments the enviroment was opened
+            with by :py:func:`aiolmdb.open`, and must be given otherwise.
+        """
+        if kwargs:
+            open_args = ((), kwargs)
+        elif self._open_args is not None:
+            open_args = self._open_args
+        else:
+            raise ValueError('enviroment was not opened with aiolmdb.open, '
+                             'lmdb.open arguments are required')
+        path = path or self.env.path().rstrip(os.sep) + '.compact'
+        txnid = yield from self._submit(self._copy_compacted, path)
+        return Compaction(self, path, txnid, open_args)
+
+    def _copy_compacted(self, path):
+        """
+        Writes a compacted copy to `path`, replacing any earlier copy.
+        Returns the ID of the last transaction committed before the copy.
+        Runs in the executor.
+        """
+        if self.env.flags()['subdir']:
+            os.makedirs(path, exist_ok=True)
+            target = os.path.join(path, 'data.mdb')
+        else:
+            target = path
+        if os.path.exists(target):
+            os.remove(target)
+        txnid = self.env.info()['last_txnid']
+        self.env.copy(path, compact=True)
+        return txnid
+
+    def _swap(self, path, open_args):
+        """
+        Closes the enviroment, moves the files at `path` over it and reopens
+        it, along with every database opened through it. No transactions may
+        be running.
+        """
+        args, kwargs = open_args
+        env_path = self.env.path()
+        backup = env_path.rstrip(os.sep) + '.old'
+        self.env.close()
+        os.rename(env_path, backup)
+        try:
+            os.rename(path, env_path)
+            env = lmdb.open(env_path, *args, **kwargs)
+        except Exception:
+            if os.path.exists(env_path):
+                os.rename(env_path, path)
+            os.rename(backup, env_path)
+            env = lmdb.open(env_path, *args, **kwargs)
+            self._reopen(env)
+            raise
+        self._reopen(env)
+        if os.path.isdir(backup):
+            shutil.rmtree(backup)
+        else:
+            os.remove(backup)
+
+    def _reopen(self, env):
+        self.env = env
+        for attr in __WRAPPED_ATTRS__:
+            setattr(self, attr, getattr(self.env, attr))
+        for name, async_db in self._databases.items():
+            args, kwargs = self._database_args[name]
+            async_db.db_handle = env.open_db(name, *args, **kwargs)
+
+    @asyncio.coroutine
+    def warmup(self, databases=None, key_range=None, budget=None, rate=None,
+               fadvise=False, chunk_size=1000, progress=None):
+        """|coro|
+        Walks the selected databases in background reader threads, touching
+        every page holding their keys and values so that they are faulted into
+        the page cache ahead of traffic. Returns a dict with the number of
+        `entries` and `bytes` touched.
+
+        Each chunk of entries is read in its own short read transaction, so
+        warming up does not hold back page reuse by writers.
+
+        `databases`:
+            An iterable of `AsyncDatabase` to warm up. Defaults to the default
+            database. Databases are walked concurrently.
+
+        `key_range`:
+            An optional (start, stop) tuple of keys, corresponding to each
+            database's key coder. `start` is inclusive, `stop` is exclusive,
+            and either may be ``None`` to leave the range open.
+
+        `budget`:
+            If not ``None``, stop after approximately this many bytes have
+            been touched across all databases.
+
+        `rate`:
+            If not ``None``, limit warmup to approximately this many bytes
+            per second across all databases.
+
+        `fadvise`:
+            If ``True``, additionally hint the operating system to read ahead
+            the whole data file. Ignored on platforms without
+            ``posix_fadvise``.
+
+        `chunk_size`:
+            The maximum number of entries read per transaction.
+
+        `progress`:
+            An optional one argument function invoked on the event loop after
+            every chunk with the running totals dict.
+        """
+        if fadvise:
+            self._fadvise_willneed()
+        databases = list(databases or [self._default_db])
+        stats = {'entries': 0, 'bytes': 0}
+        psize = self.env.stat()['psize']
+        start_time = time.monotonic()
+
+        @asyncio.coroutine
+        def warmup_db(db):
+            start, stop = key_range or (None, None)
+            after = None
+            if start is not None:
+                after = db.key_coder.serialize(start)
+            if stop is not None:
+                stop = bytes(db.key_coder.serialize(stop))
+            inclusive = True
+            while budget is None or stats['bytes'] < budget:
+                action = (lambda txn, after=after, inclusive=inclusive:
+                          _warmup_chunk(txn, after, inclusive, stop,
+                                        chunk_size, psize))
+                inclusive = False
+                after, entries, size, done = yield from db.run(
+                    action, op='warmup')
+                stats['entries'] += entries
+                stats['bytes'] += size
+                if progress is not None:
+                    progress(stats)
+                if done:
+                    break
+                if rate is not None:
+                    delay = (stats['bytes'] / rate -
+                             (time.monotonic() - start_time))
+                    if delay > 0:
+                        yield from asyncio.sleep(delay)
+
+        yield from asyncio.gather(*[warmup_db(db) for db in databases])
+        return stats
+
+    def _fadvise_willneed(self):
+        if not hasattr(os, 'posix_fadvise'):
+            return
+        path = self.env.path()
+        if self.env.flags()['subdir']:
+            path = os.path.join(path, 'data.mdb')
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+def _count(count, _):
+    return count + 1
+
+
+class Query():
+    """
+    A pipeline of stages run over a key range of an `AsyncDatabase` within
+    read transactions in the executor, so that only matching or reduced
+    results are returned to the event loop. Created by
+    :py:meth:`AsyncDatabase.query`. :py:meth:`filter` and :py:meth:`map`
+    each return a new query with a stage added.
+
+    Results are produced by iterating over the query with ``async for``, or
+    by :py:meth:`collect`, :py:meth:`aggregate` or :py:meth:`count`.
+    """
+
+    def __init__(self, db, start, stop, reverse, chunk_size, partitions,
+                 stages=()):
+        self._db = db
+        self._start = start
+        self._stop = stop
+        self._reverse = reverse
+        self._chunk_size = chunk_size
+        self._partitions = list(partitions or [])
+        self._stages = tuple(stages)
+
+    def _extend(self, kind, fn, raw):
+        if raw and any(not stage_raw or stage_kind == 'map'
+                       for stage_kind, _, stage_raw in self._stages):
+            raise ValueError('raw stages must come before every other stage')
+        return Query(self._db, self._start, self._stop, self._reverse,
+                     self._chunk_size, self._partitions,
+                     self._stages + ((kind, fn, raw),))
+
+    def filter(self, fn, raw=False):
+        """
+        Adds a stage keeping only the items for which `fn` returns true.
+
+        `fn`:
+            A one argument function taking a decoded (key, value) tuple, or
+            the result of the previous `map`. It is executed in the executor.
+
+        `raw`:
+            If ``True``, `fn` is passed the raw (key, value) buffers instead,
+            so entries it rejects are never decoded. Buffers are only valid
+            during the call. Raw stages must come before every other stage.
+        """
+        return self._extend('filter', fn, raw)
+
+    def map(self, fn, raw=False):
+        """
+        Adds a stage replacing each item with the result of `fn`.
+
+        `fn`:
+            A one argument function taking a decoded (key, value) tuple, or
+            the result of the previous `map`. It is executed in the executor.
+
+        `raw`:
+            If ``True``, `fn` is passed the raw (key, value) buffers instead.
+            Its result must not reference them, they are only valid during
+            the call. Raw stages must come before every other stage.
+        """
+        return self._extend('map', fn, raw)
+
+    def _ranges(self):
+        def encode(key):
+            return None if key is None \
+                else bytes(self._db.key_coder.serialize(key))
+        bounds = [self._start] + self._partitions + [self._stop]
+        ranges = [(encode(start), encode(stop))
+                  for start, stop in zip(bounds, bounds[1:])]
+        return ranges[::-1] if self._reverse else ranges
+
+    def _run_chunk(self, start, stop, after, reduce=None, acc=None):
+        def __query_action(txn):
+            return _query_chunk(txn, start, stop, self._reverse, self._stages,
+                                after, self._chunk_size, reduce, acc)
+        return self._db._after_flush(
+            lambda: self._db.run(__query_action, op='query'))
+
+    @asyncio.coroutine
+    def _run_range(self, start, stop, reduce=None, acc=None):
+        results = []
+        after = None
+        done = False
+        while not done:
+            result, after, done = yield from self._run_chunk(
+                start, stop, after, reduce, acc)
+            if reduce is None:
+                results.extend(result)
+            else:
+                acc = result
+        return results if reduce is None else acc
+
+    def __aiter__(self):
+        ranges = collections.deque(self._ranges())
+        state = {'after': None}
+
+        @asyncio.coroutine
+        def fetch_chunk():
+            start, stop = ranges[0]
+            items, state['after'], done = yield from self._run_chunk(
+                start, stop, state['after'])
+            if done:
+                ranges.popleft()
+                state['after'] = None
+            return items, not ranges
+        return _ChunkedIterator(fetch_chunk)
+
+    @asyncio.coroutine
+    def collect(self):
+        """|coro|
+        Returns a list of every result, in key order. Partitions are read in
+        parallel.
+        """
+        results = yield from asyncio.gather(
+            *[self._run_range(start, stop) for start, stop in self._ranges()])
+        return [item for result in results for item in result]
+
+    @asyncio.coroutine
+    def aggregate(self, fn, init, combine=None):
+        """|coro|
+        Folds every result into an accumulator within the executor, returning
+        only the final value.
+
+        `fn`:
+            A two argument function taking the accumulator and a result,
+            returning the new accumulator.
+
+        `init`:
+            The initial accumulator, for every partition.
+
+        `combine`:
+            A two argument function merging the accumulators of two
+            partitions, in key order. Required if the query is partitioned.
+        """
+        ranges = self._ranges()
+        if len(ranges) > 1 and combine is None:
+            raise ValueError('partitioned queries require combine')
+        results = yield from asyncio.gather(
+            *[self._run_range(start, stop, fn, init)
+              for start, stop in ranges])
+        return functools.reduce(combine, results) if combine is not None \
+            else results[0]
+
+    def count(self):
+        """|coro|
+        Returns the number of results.
+        """
+        return self.aggregate(_count, 0, operator.add)
 
 
 class AsyncDatabase():
+    """
+    An asyncio wrapper around a single database within an enviroment.
+
+    `inline_threshold`:
+        If not ``None``, `get` and `get_multi` run directly on the event loop
+        thread whenever the recently measured cost of the read is expected to
+        be below this many seconds, and in the executor otherwise. Useful for
+        small reads against memory resident pages, where the executor hop
+        dominates the cost of the lookup. Decisions are counted in
+        `read_stats`.
+    """
 
-    def __init__(self, async_env, db_handle, key_coder=None, value_coder=None):
+    def __init__(self, async_env, db_handle, key_coder=None, value_coder=None,
+                 inline_threshold=None):
         self.async_env = async_env
         self.db_handle = db_handle
+        self.name = None
         self.key_coder = key_coder or IdentityCoder()
         self.value_coder = value_coder or IdentityCoder()
-
-    def run(self, action, write=False):
+        self.inline_threshold = inline_threshold
+        self.read_stats = {'inline': 0, 'executor': 0}
+        self._read_cost = float('inf')
+        self._pending_updates = []
+        self._updating = False
+        self._write_behind = None
+        self._watchers = []
+        self._change_log = None
+        self._loop = None
+        self.bloom_filter = None
+        self._bloom_ready = False
+        self._bloom_path = None
+
+    def run(self, action, write=False, op='run', count=None):
         """
         Runs an asynchronous operation with the database.
 
@@ -265,40 +2202,121 @@ class AsyncDatabase():
             If ``True``, starts a read-write transaction, otherwise starts a
             read-only transaction. Write transactions will block the thread
             they are executing if there are contending write transactions.
+
+        `op`:
+            The name of the operation reported to trace hooks.
+
+        `count`:
+            The number of keys the operation touches reported to trace
+            hooks, if known.
+        """
+        return self.async_env._run_action(self, action, write=write, op=op,
+                                          count=count)
+
+    def _run_read(self, action, count, op):
+        """
+        Runs a read-only `action` touching `count` keys. If `inline_threshold`
+        is set and the recently measured per-key transaction cost predicts
+        the action will finish within it, the action is run directly on the
+        event loop thread, skipping the executor hop. Either way, an
+        awaitable is returned.
         """
-        return self.async_env._run_action(self, action, write=write)
+        env = self.async_env
+        if self.inline_threshold is None or env._resumed is not None:
+            return self.run(action, op=op, count=count)
+        timed_read = self._timed_read
+        operation = None
+        if env._trace_hooks:
+            operation = env._start_operation(self, op, False, count)
+            action = _count_bytes(action, operation)
+            timed_read = operation.wrap(timed_read)
+        if count is not None and \
+                self._read_cost * count <= self.inline_threshold:
+            self.read_stats['inline'] += 1
+            future = asyncio.get_event_loop().create_future()
+            try:
+                future.set_result(timed_read(action, count))
+            except Exception as exc:
+                future.set_exception(exc)
+        else:
+            self.read_stats['executor'] += 1
+            future = env._submit(timed_read, action, count)
+        if operation is not None:
+            future.add_done_callback(
+                lambda future: env._end_operation(operation, future))
+        return future
+
+    def _timed_read(self, action, count):
+        start = time.perf_counter()
+        result = _action(self.async_env.env, self, action, False)
+        if count:
+            cost = (time.perf_counter() - start) / count
+            # Exponentially weighted, so a few slow reads (i.e. page faults)
+            # quickly push subsequent reads back onto the executor.
+            if self._read_cost == float('inf'):
+                self._read_cost = cost
+            else:
+                self._read_cost = 0.75 * self._read_cost + 0.25 * cost
+        return result
 
     def stat(self):
         """|coro|
         Return statistics like :py:meth:`Environment.stat`, except for a single
-        DBI. `db` must be a database handle returned by :py:meth:`open_db`.
+        DBI.
         """
-        return self.run(lambda txn: txn.stat(self.db))
+        return self.run(lambda txn: txn.stat(), op='stat')
 
     def get(self, key, default=None):
         """|coro|
         Fetch the first value matching `key`, returning `default` if `key`
-        does not exist. A cursor must be used to fetch all values for a key in
-        a `dupsort=True` database.
+        does not exist. Use `get_dups` to fetch all values for a key in a
+        `dupsort=True` database.
 
         Equivalent to `mdb_get()
         <http://symas.com/mdb/doc/group__mdb.html#ga8bf10cd91d3f3a83a34d04ce6b07992d>`_
         """
-        return self.run(lambda txn: txn.get(key, default))
+        if self._write_behind is not None:
+            found, value = self._write_behind.lookup(key)
+            if found:
+                return _completed(default if value is _DELETED else value)
+        if self._definitely_missing(key):
+            return _completed(default)
+        return self._run_read(lambda txn: txn.get(key, default), 1, 'get')
+
+    def contains(self, key):
+        """|coro|
+        Returns ``True`` if `key` exists in the database. With a bloom
+        filter enabled, most missing keys are answered without a
+        transaction.
+        """
+        if self._write_behind is not None:
+            found, value = self._write_behind.lookup(key)
+            if found:
+                return _completed(value is not _DELETED)
+        if self._definitely_missing(key):
+            return _completed(False)
+        key_enc = self.key_coder.serialize(key)
+        return self._run_read(
+            lambda txn: txn.txn.get(key_enc) is not None, 1, 'contains')
 
     def pop(self, key):
         """|coro|
         Use a temporary cursor to invoke :py:meth:`Cursor.pop` on a key.
         """
-        return self.run(lambda txn: txn.pop(key), write=True)
+        return self._after_flush(
+            lambda: self.run(lambda txn: txn.pop(key), write=True, op='pop',
+                             count=1))
 
     def replace(self, key, value):
         """|coro|
         Use a temporary cursor to invoke :py:meth:`Cursor.replace`.
         """
-        return self.run(lambda txn: txn.replace(key, value), write=True)
+        return self._after_flush(
+            lambda: self.run(lambda txn: txn.replace(key, value), write=True,
+                             op='replace', count=1))
 
-    def put(self, key, value, dupdata=True, overwrite=True):
+    def put(self, key, value, dupdata=True, overwrite=True,
+            durable=False):
         """|coro|
         Store a record, returning ``True`` if it was written, or ``False``
         to indicate the key was already present and `overwrite=False`. On
@@ -322,13 +2340,24 @@ class AsyncDatabase():
 
         `overwrite`:
             If ``False``, do not overwrite any existing matching key.
+
+        `durable`:
+            If ``True``, only complete once the write has been flushed to
+            disk by a forced sync, shared with other concurrent durable
+            writes. See :py:meth:`AsyncEnviroment.wait_durable`.
         """
-        return self.run(lambda txn: txn.put(key, value, dupdata=dupdata,
-                                            overwrite=overwrite),
-                        write=True)
+        if self._write_behind is not None and overwrite:
+            future = self._buffer_write(key, value)
+        else:
+            future = self._after_flush(
+                lambda: self.run(lambda txn: txn.put(key, value,
+                                                     dupdata=dupdata,
+                                                     overwrite=overwrite),
+                                 write=True, op='put', count=1))
+        return self._durable(future) if durable else future
 
     @asyncio.coroutine
-    def delete(self, key, value=None):
+    def delete(self, key, value=None, durable=False):
         """|coro|
         Delete a key from the database.
 
@@ -342,9 +2371,325 @@ class AsyncDatabase():
             the empty bytestring, then delete elements matching only this
             `(key, value)` pair, otherwise all values for key are deleted.
 
-        Returns True if at least one key was deleted.
+        `durable`:
+            If ``True``, only complete once the write has been flushed to
+            disk by a forced sync, shared with other concurrent durable
+            writes. See :py:meth:`AsyncEnviroment.wait_durable`.
+
+        Returns True if at least one key was deleted. Deletes buffered by
+        write-behind always return True.
+        """
+        if self._write_behind is not None and value is None:
+            result = yield from self._buffer_write(key, _DELETED)
+        else:
+            result = yield from self._after_flush(
+                lambda: self.run(lambda txn: txn.delete(key, value),
+                                 write=True, op='delete', count=1))
+        if durable:
+            yield from self._wait_durable()
+        return result
+
+    @asyncio.coroutine
+    def delete_range(self, start=None, stop=None, batch_size=1000,
+                     atomic=False):
+        """|coro|
+        Deletes every entry with a key in the range [`start`, `stop`),
+        returning the number of entries deleted. Either bound may be ``None``
+        to leave the range open.
+
+        `batch_size`:
+            The approximate number of entries deleted per write transaction,
+            so that large deletions do not hold the write lock for long.
+            Entries written to the range while it is being deleted may
+            survive.
+
+        `atomic`:
+            If ``True``, delete the whole range in a single write
+            transaction instead.
+        """
+        start_enc = None if start is None \
+            else bytes(self.key_coder.serialize(start))
+        stop_enc = None if stop is None \
+            else bytes(self.key_coder.serialize(stop))
+        return (yield from self._delete_range(start_enc, stop_enc,
+                                              None if atomic else batch_size))
+
+    def delete_prefix(self, prefix, batch_size=1000, atomic=False):
+        """|coro|
+        Deletes every entry whose encoded key starts with the encoding of
+        `prefix`, returning the number of entries deleted. See
+        :py:meth:`delete_range`.
+        """
+        start = bytes(self.key_coder.serialize(prefix))
+        return self._delete_range(start, _prefix_successor(start),
+                                  None if atomic else batch_size)
+
+    @asyncio.coroutine
+    def _delete_range(self, start, stop, batch_size):
+        yield from self.flush()
+        total = 0
+        done = False
+        while not done:
+            deleted, done = yield from self.run(
+                lambda txn: _delete_batch(txn, start, stop, batch_size),
+                write=True, op='delete_range')
+            total += deleted
+        return total
+
+    @asyncio.coroutine
+    def put_stream(self, key, data, chunk_size=262144, batch_size=16,
+                   durable=False):
+        """|coro|
+        Stores a large value read from `data` as a stream of fixed size
+        chunks under keys derived from `key`, so that it can be read back
+        piecewise with :py:meth:`open_stream` without being held in memory.
+        Returns the length of the stream.
+
+        Chunks are written in several transactions, and the stream replaces
+        any previous stream under `key` once it has been written in full.
+        Streams should be kept in a database of their own, with the default
+        key ordering. Streams are replicated, but cannot be written to a
+        watched database or one with a change log, since their chunks cannot
+        be decoded into events.
+
+        `data`:
+            An iterable or async iterable of bytes-like objects of any size.
+
+        `chunk_size`:
+            The size of each stored chunk in bytes.
+
+        `batch_size`:
+            The number of chunks written per write transaction.
+
+        `durable`:
+            If ``True``, only complete once the stream has been flushed to
+            disk. See :py:meth:`AsyncEnviroment.wait_durable`.
+        """
+        if chunk_size < 1 or batch_size < 1:
+            raise ValueError('chunk_size and batch_size must be positive')
+        self._check_streams()
+        key_enc = bytes(self.key_coder.serialize(key))
+        generation = _new_generation()
+        is_async = hasattr(data, '__aiter__')
+        data_iterator = data.__aiter__() if is_async else iter(data)
+        yield from self.flush()
+        buf = bytearray()
+        batch = []
+        first = size = 0
+        try:
+            while True:
+                if is_async:
+                    try:
+                        piece = yield from data_iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                else:
+                    piece = next(data_iterator, None)
+                    if piece is None:
+                        break
+                buf += piece
+                size += len(piece)
+                while len(buf) >= chunk_size:
+                    batch.append(bytes(buf[:chunk_size]))
+                    del buf[:chunk_size]
+                    if len(batch) < batch_size:
+                        continue
+                    yield from self._put_chunks(key_enc, generation, first,
+                                                batch)
+                    first += len(batch)
+                    batch = []
+            if buf:
+                batch.append(bytes(buf))
+            old, done = yield from self.run(
+                lambda txn: _commit_stream(txn, key_enc, generation, first,
+                                           batch, size, chunk_size, 1000),
+                write=True, op='put_stream', count=len(batch) + 1)
+        except Exception:
+            yield from self._purge_chunks(key_enc, generation, _abort_stream)
+            raise
+        if not done:
+            yield from self._purge_chunks(key_enc, old, _delete_chunks)
+        if durable:
+            yield from self._wait_durable()
+        return size
+
+    def _check_streams(self):
+        if self._watchers or self._change_log is not None:
+            raise ValueError('streams cannot be written to a watched or '
+                             'change logged database')
+
+    def _put_chunks(self, key_enc, generation, first, chunks):
+        return self.run(
+            lambda txn: _write_chunks(txn, key_enc, generation, first,
+                                      chunks),
+            write=True, op='put_stream', count=len(chunks))
+
+    @asyncio.coroutine
+    def _purge_chunks(self, key_enc, generation, delete):
+        done = False
+        while not done:
+            done = yield from self.run(
+                lambda txn: delete(txn, key_enc, generation, 1000),
+                write=True, op='delete_stream')
+
+    @asyncio.coroutine
+    def open_stream(self, key):
+        """|coro|
+        Opens the stream stored under `key` by :py:meth:`put_stream` for
+        reading, returning a `BlobReader`, or ``None`` if there is no stream
+        under `key`.
+        """
+        key_enc = bytes(self.key_coder.serialize(key))
+        manifest = yield from self.run(
+            lambda txn: _read_manifest(txn, key_enc),
+            op='open_stream', count=1)
+        if manifest is None:
+            return None
+        return BlobReader(self, key_enc, *manifest)
+
+    @asyncio.coroutine
+    def delete_stream(self, key):
+        """|coro|
+        Deletes the stream stored under `key` by :py:meth:`put_stream`,
+        returning ``True`` if there was one. Its chunks are deleted in
+        several transactions.
+        """
+        self._check_streams()
+        key_enc = bytes(self.key_coder.serialize(key))
+        yield from self.flush()
+        generation, done = yield from self.run(
+            lambda txn: _remove_stream(txn, key_enc, 1000),
+            write=True, op='delete_stream')
+        if not done:
+            yield from self._purge_chunks(key_enc, generation,
+                                          _delete_chunks)
+        return generation is not None
+
+    def get_all(self, key, chunk_size=1000):
+        """
+        Returns an async iterator over every value stored under `key` in a
+        `dupsort=True` database, in sorted order. Values are read
+        `chunk_size` at a time, each chunk in its own read transaction.
+        """
+        key_enc = bytes(self.key_coder.serialize(key))
+        state = {'after': None}
+
+        @asyncio.coroutine
+        def fetch_chunk():
+            values, done = yield from self.run(
+                lambda txn: _read_dups(txn, key_enc, state['after'],
+                                       chunk_size),
+                op='get_all', count=1)
+            if values:
+                state['after'] = values[-1]
+            return [self.value_coder.deserialize(value)
+                    for value in values], done
+        return _ChunkedIterator(fetch_chunk)
+
+    def get_dups(self, key, dupfixed_bytes=None):
+        """|coro|
+        Returns a list of every value stored under `key` in a `dupsort=True`
+        database, read in a single transaction. See
+        :py:meth:`AsyncTransaction.get_dups`.
+        """
+        return self.run(lambda txn: txn.get_dups(
+            key, dupfixed_bytes=dupfixed_bytes), op='get_dups', count=1)
+
+    def count_dups(self, key):
+        """|coro|
+        Returns the number of values stored under `key` in a `dupsort=True`
+        database, or ``0`` if `key` does not exist.
         """
-        return self.run(lambda txn: txn.delete(key), write=True)
+        return self.run(lambda txn: txn.count_dups(key), op='count_dups',
+                        count=1)
+
+    def put_dups(self, key, values):
+        """|coro|
+        Stores every value in `values` as a duplicate of `key` in a
+        `dupsort=True` database, within a single write transaction. Returns
+        the number of values added.
+        """
+        return self.run(lambda txn: txn.put_dups(key, values), write=True,
+                        op='put_dups', count=1)
+
+    def scan(self, start=None, stop=None, limit=None, reverse=False):
+        """|coro|
+        Returns a list of (key, value) tuples for keys in the range
+        [`start`, `stop`), in ascending key order, or descending if `reverse`
+        is ``True``. Either bound may be ``None`` to leave the range open.
+
+        `limit`:
+            If not ``None``, return at most this many items.
+        """
+        return self._after_flush(
+            lambda: self.run(lambda txn: txn.scan(start, stop, limit=limit,
+                                                  reverse=reverse),
+                             op='scan'))
+
+    def scan_prefix(self, prefix, limit=None, reverse=False):
+        """|coro|
+        Returns a list of (key, value) tuples for keys whose encoding starts
+        with the encoding of `prefix`. With a `TupleCoder`, these are the keys
+        starting with the elements of the tuple `prefix`. See
+        :py:meth:`scan`.
+        """
+        return self._after_flush(
+            lambda: self.run(lambda txn: txn.scan_prefix(prefix, limit=limit,
+                                                         reverse=reverse),
+                             op='scan'))
+
+    def page(self, start=None, stop=None, limit=100, token=None,
+             reverse=False):
+        """|coro|
+        Returns a page of up to `limit` (key, value) tuples for keys in the
+        range [`start`, `stop`), and a continuation token for the next page,
+        or ``None`` if there are no more. Passing the token back resumes
+        right after the last item returned, seeking directly to it, even if
+        it has since been deleted. In a `dupsort=True` database, pages may
+        end and resume between the values of a key.
+
+        `token`:
+            A token returned by a previous call with the same `reverse`,
+            `start` and `stop`. Tokens are opaque, URL safe strings.
+
+        `reverse`:
+            If ``True``, pages are returned in descending key order.
+        """
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+        start_enc = None if start is None \
+            else bytes(self.key_coder.serialize(start))
+        stop_enc = None if stop is None \
+            else bytes(self.key_coder.serialize(stop))
+        after = None if token is None else _decode_token(token, reverse)
+
+        def __page_action(txn):
+            items, last, done = _query_chunk(txn, start_enc, stop_enc,
+                                             reverse, (), after, limit)
+            if done:
+                return items, None
+            return items, _encode_token(last, reverse,
+                                        txn._flags()['dupsort'])
+        return self._after_flush(lambda: self.run(__page_action, op='page'))
+
+    def query(self, start=None, stop=None, reverse=False, chunk_size=1000,
+              partitions=None):
+        """
+        Returns a `Query` over the keys in the range [`start`, `stop`), in
+        ascending key order, or descending if `reverse` is ``True``. Its
+        stages run in the executor, next to the data.
+
+        `chunk_size`:
+            The maximum number of entries scanned per read transaction, or
+            ``None`` to scan each partition in a single transaction. Results
+            of a chunked query are not read from a single snapshot.
+
+        `partitions`:
+            An optional sorted list of keys splitting the range into
+            partitions, which `collect`, `aggregate` and `count` read in
+            parallel.
+        """
+        return Query(self, start, stop, reverse, chunk_size, partitions)
 
     @asyncio.coroutine
     def get_multi(self, keys):
@@ -354,35 +2699,535 @@ class AsyncDatabase():
         `keys`:
         An iterable of keys to retrieve from the database.
         """
-        return self.run(lambda txn: {key: txn.get(key) for key in keys})
+        result = {}
+        if self._write_behind is not None:
+            remaining = []
+            for key in keys:
+                found, value = self._write_behind.lookup(key)
+                if not found:
+                    remaining.append(key)
+                elif value is not _DELETED:
+                    result[key] = value
+                else:
+                    result[key] = None
+            keys = remaining
+        if self._bloom_ready:
+            remaining = []
+            for key in keys:
+                if self._definitely_missing(key):
+                    result[key] = None
+                else:
+                    remaining.append(key)
+            keys = remaining
+        if (self._write_behind is not None or self._bloom_ready) and \
+                not keys:
+            return result
+        count = len(keys) if hasattr(keys, '__len__') else None
+        result.update((yield from self._run_read(
+            lambda txn: txn.get_multi(keys), count, 'get_multi')))
+        return result
+
+    def iter_multi(self, keys, chunk_size=1000):
+        """
+        Returns an async iterator of (key, value) tuples for every key in
+        `keys`, in order, with ``None`` as the value of missing keys. Keys
+        are looked up `chunk_size` at a time, each chunk in its own read
+        transaction, and the next chunk is looked up while the current one
+        is consumed. At most two chunks are held in memory.
+
+        `keys`:
+            An iterable or async iterable of keys.
+        """
+        if hasattr(keys, '__aiter__'):
+            key_iterator = keys.__aiter__()
+
+            @asyncio.coroutine
+            def next_keys():
+                chunk = []
+                while len(chunk) < chunk_size:
+                    try:
+                        chunk.append((yield from key_iterator.__anext__()))
+                    except StopAsyncIteration:
+                        break
+                return chunk
+        else:
+            key_iterator = iter(keys)
+
+            @asyncio.coroutine
+            def next_keys():
+                return list(itertools.islice(key_iterator, chunk_size))
+
+        @asyncio.coroutine
+        def lookup():
+            chunk = yield from next_keys()
+            if not chunk:
+                return [], True
+            values = yield from self.get_multi(chunk)
+            return [(key, values[key]) for key in chunk], False
+        state = {'next': None}
+
+        @asyncio.coroutine
+        def fetch_chunk():
+            items, done = yield from (state['next'] or lookup())
+            state['next'] = None if done \
+                else asyncio.ensure_future(lookup())
+            return items, done
+        return _ChunkedIterator(fetch_chunk)
 
     @asyncio.coroutine
-    def put_multi(self, items):
+    def put_multi(self, items, durable=False):
         """|coro|
         Sets multiple (key, value) tuples in the database.
 
         `items`:
             An iterable of (key, value) tuples to set.
+
+        `durable`:
+            If ``True``, only complete once the write has been flushed to
+            disk by a forced sync, shared with other concurrent durable
+            writes. See :py:meth:`AsyncEnviroment.wait_durable`.
         """
-        def __put_multi_action(txn):
-            with txn.cursor(self.db) as csr:
-                items_enc = [(self.key_coder.serialize(key),
-                              self.value_coder.serialize(value))
-                             for key, value in items]
-                return csr.put_multi(items_enc)
-        return self.run(__put_multi_action, write=True)
+        result = None
+        if self._write_behind is not None:
+            items = list(items)
+            for key, value in items:
+                self._check_buffered(key, value)
+            yield from asyncio.gather(
+                *[self._buffer_write(key, value) for key, value in items])
+        else:
+            result = yield from self.run(lambda txn: txn.put_multi(items),
+                                         write=True, op='put_multi')
+        if durable:
+            yield from self._wait_durable()
+        return result
 
-    def delete_multi(self, keys):
+    @asyncio.coroutine
+    def delete_multi(self, keys, durable=False):
         """|coro|
         Deletes multiple keys from the database. Returns a dictionary of
         {key, bool} each stating which key was successfully deleted.
 
         `items`:
             An iterable of keys to delete.
+
+        `durable`:
+            If ``True``, only complete once the write has been flushed to
+            disk by a forced sync, shared with other concurrent durable
+            writes. See :py:meth:`AsyncEnviroment.wait_durable`.
         """
-        return self.run(
-            lambda txn: {key: txn.delete(key) for key in keys},
-            write=True)
+        if self._write_behind is not None:
+            keys = list(keys)
+            for key in keys:
+                self._check_buffered(key, _DELETED)
+            results = yield from asyncio.gather(
+                *[self._buffer_write(key, _DELETED) for key in keys])
+            result = dict(zip(keys, results))
+        else:
+            result = yield from self.run(
+                lambda txn: {key: txn.delete(key) for key in keys},
+                write=True, op='delete_multi')
+        if durable:
+            yield from self._wait_durable()
+        return result
+
+    def merge(self, key, operand, merge_fn):
+        """|coro|
+        Merges `operand` into the value stored under `key`, returning the
+        resulting value.
+
+        Merges issued concurrently are queued and applied together in a single
+        write transaction. Each key is read and written once per transaction
+        regardless of how many merges target it. Callers that do not need the
+        result are not required to await the returned future.
+
+        `key`:
+            The key to merge into.
+
+        `operand`:
+            The operand passed to `merge_fn`.
+
+        `merge_fn`:
+            A two argument function taking the current decoded value (or
+            ``None`` if `key` does not exist) and `operand`, returning the new
+            value. It is executed in the executor.
+        """
+        return self._enqueue_update(
+            [(key, lambda value: merge_fn(value, operand))])
+
+    def increment(self, key, delta=1):
+        """|coro|
+        Atomically adds `delta` to the value stored under `key`, treating a
+        missing key as ``0``. Returns the resulting value. The database's
+        value coder must support integers (i.e. `UInt64Coder`).
+
+        Concurrent increments are coalesced, see :py:meth:`merge`.
+        """
+        return self.merge(key, delta, _add)
+
+    def update(self, key, fn, default=None):
+        """|coro|
+        Reads the value stored under `key`, applies `fn` to it and writes
+        the result back within a single write transaction. Returns the new
+        value.
+
+        Concurrent updates are queued and applied together in a single write
+        transaction, in the order they were issued.
+
+        `fn`:
+            A one argument function that takes the current decoded value and
+            returns the new value. It is executed in the executor.
+
+        `default`:
+            The value passed to `fn` if `key` does not exist.
+        """
+        return self._enqueue_update([(key, _with_default(fn, default))])
+
+    def update_multi(self, updates, default=None):
+        """|coro|
+        Applies multiple updates atomically within the same write
+        transaction. Returns a dict of {key, value} with the new values. If
+        any function raises, none of the keys are updated.
+
+        `updates`:
+            A dict of {key, fn}. See :py:meth:`update`.
+
+        `default`:
+            The value passed to each function if its key does not exist.
+        """
+        return self._enqueue_update(
+            [(key, _with_default(fn, default)) for key, fn in updates.items()],
+            single=False)
+
+    @property
+    def tracks_changes(self):
+        return bool(self._watchers) or self._change_log is not None or \
+            self.replicated
+
+    @property
+    def replicated(self):
+        return self.async_env._replication_log not in (None, self)
+
+    def enable_change_log(self, log_db):
+        """
+        Records every write made through aiolmdb to `log_db`, within the same
+        transaction as the write, under sequential 64-bit keys. Watchers can
+        then resume from a sequence number instead of rescanning. `log_db`
+        must be a dedicated database in the same enviroment.
+        """
+        self._change_log = log_db
+
+    def watch(self, prefix=None, since=None, max_queue=10000):
+        """
+        Returns an async iterator of `ChangeEvent` for writes made through
+        aiolmdb to this database, emitted once they have been committed.
+        Writes made through :py:meth:`run` are included if they use the
+        `AsyncTransaction` write methods; `drop` is not.
+
+        `prefix`:
+            If not ``None``, only emit events for keys starting with
+            `prefix`. Keys must support `startswith` (i.e. bytes or str).
+
+        `since`:
+            If not ``None``, first replay every logged change with a sequence
+            number greater than `since`. Requires a change log, see
+            :py:meth:`enable_change_log`.
+
+        `max_queue`:
+            The maximum number of undelivered events. If exceeded, further
+            events are dropped and the iterator raises `WatchOverflowError`
+            once the queued events are consumed.
+
+        Call `close()` on the iterator to stop watching.
+        """
+        if since is not None and self._change_log is None:
+            raise ValueError('resuming a watch requires a change log')
+        self._loop = asyncio.get_event_loop()
+        watcher = _Watcher(self, prefix, since, max_queue)
+        self._watchers.append(watcher)
+        return watcher
+
+    def read_changes(self, since=0, limit=1000):
+        """|coro|
+        Returns a list of up to `limit` `ChangeEvent` from the change log with
+        sequence numbers greater than `since`, in order.
+        """
+        if self._change_log is None:
+            raise ValueError('database has no change log')
+        log_handle = self._change_log.db_handle
+
+        def __read_changes_action(txn):
+            events = []
+            with txn.txn.cursor(db=log_handle) as cursor:
+                positioned = cursor.set_range(struct.pack('>Q', since + 1))
+                while positioned and len(events) < limit:
+                    sequence = struct.unpack('>Q', cursor.key())[0]
+                    op, key, value = _decode_change(cursor.value())
+                    if value is not None:
+                        value = self.value_coder.deserialize(value)
+                    events.append(ChangeEvent(
+                        sequence, op, self.key_coder.deserialize(key), value))
+                    positioned = cursor.next()
+            return events
+        return self.run(__read_changes_action, op='read_changes')
+
+    def _log_changes(self, txn, changes, encoded_changes=None):
+        """
+        Converts recorded changes to events, appending them to the change log
+        within `txn` if enabled. Runs in the executor.
+        """
+        if self.replicated:
+            self.async_env._log_replication(txn, self, changes,
+                                            encoded_changes)
+        if self._change_log is None:
+            return [ChangeEvent(None, op, key, value)
+                    for op, key, value in changes]
+        events = []
+        with txn.cursor(db=self._change_log.db_handle) as cursor:
+            sequence = 1
+            if cursor.last():
+                sequence = struct.unpack('>Q', cursor.key())[0] + 1
+            for op, key, value in changes:
+                value_enc = None if value is None \
+                    else self.value_coder.serialize(value)
+                cursor.put(struct.pack('>Q', sequence),
+                           _encode_change(op, self.key_coder.serialize(key),
+                                          value_enc),
+                           append=True)
+                events.append(ChangeEvent(sequence, op, key, value))
+                sequence += 1
+        return events
+
+    def _publish_threadsafe(self, events):
+        if self._watchers and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._publish, events)
+
+    def _publish(self, events):
+        for watcher in list(self._watchers):
+            watcher._push_all(events)
+
+    @asyncio.coroutine
+    def enable_bloom_filter(self, capacity=None, error_rate=0.01,
+                            path=None):
+        """|coro|
+        Builds an in-memory bloom filter of the database's keys, so that
+        `get`, `get_multi` and `contains` answer most lookups of missing keys
+        on the event loop, without a transaction. Keys written through
+        aiolmdb are added as they are written. Writes made directly to the
+        underlying `lmdb.Transaction` or from other processes are not, and
+        must not be made while the filter is enabled.
+
+        Deleted keys stay in the filter, raising its false positive rate
+        until it is rebuilt by enabling it again.
+
+        `capacity`:
+            The number of keys to size the filter for. Defaults to twice the
+            current number of entries, and at least 1024.
+
+        `error_rate`:
+            The target false positive rate at `capacity` keys.
+
+        `path`:
+            An optional sidecar file to load the filter from, instead of
+            scanning the database. It is only used if nothing has been
+            committed to the enviroment since it was written by
+            :py:meth:`save_bloom_filter`.
+        """
+        env = self.async_env
+        self.bloom_filter = None
+        self._bloom_ready = False
+        self._bloom_path = path
+        loaded = None
+        if path is not None:
+            loaded = yield from env._submit(_read_sidecar, path)
+        if loaded is not None:
+            txnid, self.bloom_filter = loaded
+            # Wait for writes that started without the filter to commit, so
+            # they are reflected in the enviroment's last txnid.
+            while env._active[True]:
+                yield from env._wait_idle()
+            if env.env.info()['last_txnid'] == txnid:
+                self._bloom_ready = True
+                return
+        if capacity is None:
+            capacity = max((yield from self.stat())['entries'] * 2, 1024)
+        bloom_filter = BloomFilter(capacity, error_rate)
+        self.bloom_filter = bloom_filter
+        while env._active[True]:
+            yield from env._wait_idle()
+        yield from self.run(
+            lambda txn: _fill_bloom_filter(txn, bloom_filter),
+            op='enable_bloom_filter')
+        self._bloom_ready = True
+
+    def save_bloom_filter(self):
+        """|coro|
+        Writes the bloom filter to the sidecar file passed to
+        :py:meth:`enable_bloom_filter`, so that it can be loaded without
+        scanning the next time the database is opened. Call it once writes
+        have stopped, i.e. before closing the enviroment.
+        """
+        if not self._bloom_ready or self._bloom_path is None:
+            raise ValueError('no bloom filter with a sidecar file enabled')
+        # The txnid must be read before the filter is copied, so keys of any
+        # transaction committed after the copy invalidate the file.
+        txnid = self.async_env.env.info()['last_txnid']
+        buf = _SIDECAR.pack(_SIDECAR_MAGIC, txnid) + \
+            self.bloom_filter.to_bytes()
+        return self.async_env._submit(_write_sidecar, self._bloom_path, buf)
+
+    def _definitely_missing(self, key):
+        return self._bloom_ready and \
+            bytes(self.key_coder.serialize(key)) not in self.bloom_filter
+
+    def enable_write_behind(self, max_items=10000, max_delay=1.0):
+        """
+        Enables write-behind buffering. `put`, `put_multi`, `delete` and
+        `delete_multi` return after updating an in-memory overlay instead of
+        committing, and reads consult the overlay before the database.
+        Buffered writes are committed in a single write transaction once
+        `max_items` keys are buffered, `max_delay` seconds after the first
+        buffered write, or when :py:meth:`flush` is called.
+
+        Buffered writes are lost if the process exits before they are
+        flushed, and :py:meth:`AsyncEnviroment.close` refuses to close while
+        any are buffered. A failed flush is retried after `max_delay`,
+        backing off while it keeps failing. Writers wait for a flush whenever
+        `max_items` keys are buffered, bounding memory use. Operations that
+        cannot be served from the overlay (`scan`, `pop`, `replace`,
+        conditional puts and deletes) flush it first. Not supported for
+        `dupsort=True` databases.
+        """
+        self._write_behind = _WriteBehindBuffer(max_items, max_delay)
+
+    def flush(self):
+        """|coro|
+        Commits every write buffered by write-behind so far. Completes
+        immediately if write-behind is not enabled or nothing is buffered.
+        """
+        buffer = self._write_behind
+        if buffer is None or not len(buffer):
+            return _completed(None)
+        future = asyncio.get_event_loop().create_future()
+        if buffer.pending:
+            buffer.waiters.append((future, None))
+            self._request_flush()
+        else:
+            buffer.flushing_waiters.append((future, None))
+        return future
+
+    def _check_buffered(self, key, value):
+        # Buffered writes are only committed by a later flush, so encoding
+        # errors are raised here instead, where they reach the writer.
+        self.key_coder.serialize(key)
+        if value is not _DELETED:
+            self.value_coder.serialize(value)
+
+    def _buffer_write(self, key, value):
+        buffer = self._write_behind
+        try:
+            self._check_buffered(key, value)
+        except Exception as exc:
+            future = asyncio.get_event_loop().create_future()
+            future.set_exception(exc)
+            return future
+        buffer.pending[key] = value
+        if len(buffer) >= buffer.max_items:
+            future = asyncio.get_event_loop().create_future()
+            buffer.waiters.append((future, True))
+            self._request_flush()
+            return future
+        if buffer.timer is None and not buffer.requested:
+            buffer.timer = asyncio.get_event_loop().call_later(
+                buffer.max_delay, self._request_flush)
+        return _completed(True)
+
+    def _after_flush(self, fn):
+        """
+        Runs `fn`, which returns an awaitable, once buffered writes are
+        committed.
+        """
+        if self._write_behind is None or not len(self._write_behind):
+            return fn()
+
+        @asyncio.coroutine
+        def run():
+            yield from self.flush()
+            return (yield from fn())
+        return asyncio.ensure_future(run())
+
+    @asyncio.coroutine
+    def _wait_durable(self):
+        yield from self.flush()
+        yield from self.async_env.wait_durable()
+
+    def _durable(self, future):
+        """
+        Returns a future resolving to the result of `future` once it has been
+        synced to disk.
+        """
+        @asyncio.coroutine
+        def run():
+            result = yield from future
+            yield from self._wait_durable()
+            return result
+        return asyncio.ensure_future(run())
+
+    def _request_flush(self):
+        self._write_behind.requested = True
+        self._start_updates(asyncio.get_event_loop())
+
+    def _enqueue_update(self, items, single=True):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending_updates.append((items, single, future))
+        self._start_updates(loop)
+        return future
+
+    def _start_updates(self, loop):
+        if not self._updating:
+            self._updating = True
+            loop.call_soon(self._flush_updates, loop)
+
+    def _flush_updates(self, loop):
+        updates, self._pending_updates = self._pending_updates, []
+        overlay = None
+        if self._write_behind is not None:
+            overlay = self._write_behind.take()
+        if not updates and not overlay:
+            self._updating = False
+            return
+        task = self.run(lambda txn: _apply_updates(txn, updates, overlay),
+                        write=True, op='update',
+                        count=len(updates) + len(overlay or ()))
+        task.add_done_callback(
+            lambda task: self._finish_updates(loop, updates, task))
+
+    def _finish_updates(self, loop, updates, task):
+        buffer = self._write_behind
+        if buffer is not None:
+            buffer.finish(task.exception())
+            if task.exception() is not None and buffer.pending and \
+                    buffer.timer is None and not buffer.requested:
+                # Restored writes were already acknowledged, so they are
+                # retried rather than left for the next write to flush.
+                buffer.timer = loop.call_later(buffer.retry_delay(),
+                                               self._request_flush)
+        if task.exception() is not None:
+            results = [(task.exception(), None)] * len(updates)
+        else:
+            results = task.result()
+        for (_, _, future), (exc, value) in zip(updates, results):
+            if future.cancelled():
+                continue
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(value)
+        if self._pending_updates or (self._write_behind is not None and
+                                     self._write_behind.requested):
+            self._flush_updates(loop)
+        else:
+            self._updating = False
 
     def drop(self, delete=True):
         """|coro|
@@ -391,4 +3236,6 @@ class AsyncDatabase():
         `delete`:
         If ``True``, also deletes all values in the database.
         """
-        return self.run(lambda txn: self.drop(delete=delete), write=True)
+        return self._after_flush(
+            lambda: self.run(lambda txn: txn.drop(delete=delete), write=True,
+                             op='drop'))
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import struct
+
+# A stream's manifest is stored under its encoded key, and holds a random
+# generation, its length and its chunk size. Chunk `i` is stored under the
+# encoded key followed by a NUL byte, the generation and `i`. Chunks are
+# never modified, so a reader only needs its generation's chunks to exist.
+_MANIFEST = struct.Struct('>4sQQI')
+_MAGIC = b'ALBS'
+_CHUNK_PREFIX = struct.Struct('>cQ')
+_CHUNK_INDEX = struct.Struct('>I')
+
+
+class StreamChangedError(Exception):
+    """
+    Raised by a `BlobReader` when the stream it reads has been overwritten
+    or deleted since it was opened.
+    """
+
+
+def _chunk_prefix(key_enc, generation):
+    return key_enc + _CHUNK_PREFIX.pack(b'\x00', generation)
+
+
+def _chunk_key(key_enc, generation, index):
+    return _chunk_prefix(key_enc, generation) + _CHUNK_INDEX.pack(index)
+
+
+def _new_generation():
+    return struct.unpack('>Q', os.urandom(8))[0]
+
+
+def _read_manifest(txn, key_enc):
+    """
+    Returns the (generation, size, chunk_size) of the stream stored under
+    `key_enc`, or ``None`` if there is none. Raises ``ValueError`` if the
+    key does not hold a stream.
+    """
+    buf = txn.txn.get(key_enc)
+    if buf is None:
+        return None
+    if len(buf) != _MANIFEST.size or bytes(buf[:4]) != _MAGIC:
+        raise ValueError('key does not hold a stream')
+    return _MANIFEST.unpack(buf)[1:]
+
+
+def _write_chunks(txn, key_enc, generation, first, chunks):
+    for index, chunk in enumerate(chunks, first):
+        chunk_key = _chunk_key(key_enc, generation, index)
+        txn.txn.put(chunk_key, chunk)
+        txn._record_encoded('put', chunk_key, chunk)
+        txn.bytes += len(chunk)
+
+
+def _delete_chunks(txn, key_enc, generation, limit):
+    """
+    Deletes up to `limit` chunks of a generation. Returns ``True`` once none
+    are left.
+    """
+    prefix = _chunk_prefix(key_enc, generation)
+    deleted = 0
+    with txn.txn.cursor() as cursor:
+        positioned = cursor.set_range(prefix)
+        while positioned and bytes(cursor.key()).startswith(prefix):
+            if deleted >= limit:
+                return False
+            txn._record_encoded('delete', cursor.key())
+            cursor.delete()
+            deleted += 1
+            positioned = bool(cursor.key())
+    return True
+
+
+def _commit_stream(txn, key_enc, generation, first, chunks, size,
+                   chunk_size, limit):
+    """
+    Writes the final chunks and the manifest of a new generation, returning
+    the replaced generation, if any, and whether its chunks were all
+    deleted.
+    """
+    _write_chunks(txn, key_enc, generation, first, chunks)
+    old = _read_manifest(txn, key_enc)
+    manifest = _MANIFEST.pack(_MAGIC, generation, size, chunk_size)
+    txn.txn.put(key_enc, manifest)
+    txn._record_encoded('put', key_enc, manifest)
+    txn._add_key(key_enc)
+    if old is None:
+        return None, True
+    return old[0], _delete_chunks(txn, key_enc, old[0], limit)
+
+
+def _abort_stream(txn, key_enc, generation, limit):
+    """
+    Deletes up to `limit` chunks of an unfinished generation, unless it was
+    committed after all. Returns ``True`` once none are left.
+    """
+    manifest = _read_manifest(txn, key_enc)
+    if manifest is not None and manifest[0] == generation:
+        return True
+    return _delete_chunks(txn, key_enc, generation, limit)
+
+
+def _remove_stream(txn, key_enc, limit):
+    manifest = _read_manifest(txn, key_enc)
+    if manifest is None:
+        return None, True
+    txn.txn.delete(key_enc)
+    txn._record_encoded('delete', key_enc)
+    return manifest[0], _delete_chunks(txn, key_enc, manifest[0], limit)
+
+
+def _read_range(txn, key_enc, generation, chunk_size, start, stop):
+    """
+    Returns the bytes [`start`, `stop`) of a stream generation.
+    """
+    parts = []
+    for index in range(start // chunk_size, -(-stop // chunk_size)):
+        chunk = txn.txn.get(_chunk_key(key_enc, generation, index))
+        if chunk is None:
+            raise StreamChangedError()
+        offset = index * chunk_size
+        parts.append(chunk[max(start - offset, 0):stop - offset])
+    data = b''.join(parts)
+    txn.bytes += len(data)
+    return data
+
+
+class BlobReader():
+    """
+    Reads a stream written by :py:meth:`AsyncDatabase.put_stream`, fetching
+    only the chunks covering each read, each read in its own transaction.
+    Returned by :py:meth:`AsyncDatabase.open_stream`.
+
+    The reader keeps reading the version of the stream it was opened on,
+    and raises `StreamChangedError` if that version is overwritten or
+    deleted before it is fully read.
+
+    `size`:
+        The length of the stream in bytes.
+
+    `chunk_size`:
+        The size of the chunks the stream is stored in.
+    """
+
+    def __init__(self, db, key_enc, generation, size, chunk_size):
+        self._db = db
+        self._key_enc = key_enc
+        self._generation = generation
+        self.size = size
+        self.chunk_size = chunk_size
+        self._position = 0
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Moves the read position to `offset`, relative to `whence` as for
+        `io.IOBase.seek`. Returns the new position.
+        """
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        elif whence != os.SEEK_SET:
+            raise ValueError('invalid whence: %r' % whence)
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._position = offset
+        return offset
+
+    @asyncio.coroutine
+    def read(self, n=-1):
+        """|coro|
+        Reads up to `n` bytes, or to the end of the stream if `n` is
+        negative. Returns ``b''`` at the end of the stream.
+        """
+        start = self._position
+        stop = self.size if n < 0 else min(start + n, self.size)
+        if start >= stop:
+            return b''
+        key_enc, generation = self._key_enc, self._generation
+        chunk_size = self.chunk_size
+        data = yield from self._db.run(
+            lambda txn: _read_range(txn, key_enc, generation, chunk_size,
+                                    start, stop),
+            op='read_stream',
+            count=(stop - 1) // chunk_size - start // chunk_size + 1)
+        self._position = stop
+        return data
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        # Iterates over the remaining stream a chunk at a time.
+        data = yield from self.read(
+            self.chunk_size - self._position % self.chunk_size)
+        if not data:
+            raise StopAsyncIteration
+        return data
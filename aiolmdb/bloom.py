@@ -0,0 +1,72 @@
+import hashlib
+import math
+import struct
+
+_HEADER = struct.Struct('>IQ')
+
+
+class BloomFilter():
+    """
+    A probabilistic set of encoded keys. Membership tests never return false
+    negatives, and return false positives at approximately `error_rate` as
+    long as at most `capacity` keys have been added. Keys cannot be removed.
+
+    `capacity`:
+        The number of keys the filter is sized for.
+
+    `error_rate`:
+        The target false positive rate at `capacity` keys.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        bit_count = max(int(-capacity * math.log(error_rate) /
+                            math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(bit_count / capacity *
+                                        math.log(2))), 1)
+        self.bits = bytearray(-(-bit_count // 8))
+
+    @property
+    def bit_count(self):
+        return len(self.bits) * 8
+
+    def _positions(self, key):
+        # Double hashing: positions are h1 + i * h2 for i in [0, k).
+        h1, h2 = struct.unpack('<QQ', hashlib.sha1(key).digest()[:16])
+        bit_count = self.bit_count
+        return [(h1 + i * h2) % bit_count for i in range(self.hash_count)]
+
+    def add(self, key):
+        """
+        Adds the encoded key `key` to the filter.
+        """
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    def to_bytes(self):
+        """
+        Serializes the filter, see :py:meth:`from_bytes`.
+        """
+        return _HEADER.pack(self.hash_count, len(self.bits)) + self.bits
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """
+        Deserializes a filter serialized by :py:meth:`to_bytes`. Raises
+        ``ValueError`` if `buf` is truncated.
+        """
+        if len(buf) < _HEADER.size:
+            raise ValueError('truncated bloom filter')
+        hash_count, size = _HEADER.unpack_from(buf)
+        if len(buf) != _HEADER.size + size or not hash_count:
+            raise ValueError('truncated bloom filter')
+        bloom = cls.__new__(cls)
+        bloom.hash_count = hash_count
+        bloom.bits = bytearray(buf[_HEADER.size:])
+        return bloom
@@ -1,4 +1,7 @@
+import collections
+import datetime
 import json
+import operator
 import struct
 import pickle
 import zlib
@@ -7,6 +10,11 @@ from abc import abstractmethod
 
 class Coder():
 
+    # True if this coder produces native-endian unsigned integers, as
+    # required for keys and values of `integerkey=True` and
+    # `integerdup=True` databases.
+    native_integer = False
+
     @abstractmethod
     def serialize(self, obj):
         pass
@@ -15,6 +23,24 @@ class Coder():
     def deserialize(self, buf):
         pass
 
+    def serialize_many(self, objs):
+        """
+        Serializes a list of objects, returning a list of bytes-like
+        objects. Used by batch operations such as `put_multi`. Coders may
+        override this to amortize per-object overhead across the batch.
+        """
+        serialize = self.serialize
+        return [serialize(obj) for obj in objs]
+
+    def deserialize_many(self, bufs):
+        """
+        Deserializes a list of buffers, none of which are ``None``. Used by
+        batch operations such as `get_multi` and `scan`. See
+        :py:meth:`serialize_many`.
+        """
+        deserialize = self.deserialize
+        return [deserialize(buf) for buf in bufs]
+
     def compressed(self, level=1):
         return ZlibCoder(self, level)
 
@@ -37,7 +63,7 @@ class StringCoder(Coder):
         return obj.encode(self.encoding)
 
     def deserialize(self, buf):
-        return None if buf is None else buf.decode(self.encoding)
+        return None if buf is None else str(buf, self.encoding)
 
 
 def __create_int_coder(name, fmt):
@@ -58,6 +84,296 @@ UInt16Coder = __create_int_coder("UInt16Coder", ">H")
 UInt32Coder = __create_int_coder("UInt32Coder", ">I")
 UInt64Coder = __create_int_coder("UInt64Coder", ">Q")
 
+# Native-endian unsigned integers for `integerkey=True` and
+# `integerdup=True` databases, where LMDB compares keys as integers.
+NativeUInt32Coder = __create_int_coder("NativeUInt32Coder", "=I")
+NativeUInt64Coder = __create_int_coder("NativeUInt64Coder", "=Q")
+NativeUInt32Coder.native_integer = True
+NativeUInt64Coder.native_integer = True
+
+
+def __create_signed_int_coder(name, fmt, bits):
+    # Offsetting by 2 ** (bits - 1) maps the signed range onto the unsigned
+    # range, so that the big-endian encoding sorts in numeric order.
+    offset = 1 << (bits - 1)
+
+    class SignedIntCoder(Coder):
+
+        def serialize(self, obj):
+            if not -offset <= obj < offset:
+                raise struct.error('%s out of range: %r' % (name, obj))
+            return struct.pack(fmt, obj + offset)
+
+        def deserialize(self, buf):
+            return None if buf is None else struct.unpack(fmt, buf)[0] - offset
+
+    SignedIntCoder.__name__ = name
+    return SignedIntCoder
+
+
+Int16Coder = __create_signed_int_coder("Int16Coder", ">H", 16)
+Int32Coder = __create_signed_int_coder("Int32Coder", ">I", 32)
+Int64Coder = __create_signed_int_coder("Int64Coder", ">Q", 64)
+
+
+class Float64Coder(Coder):
+    """
+    Encodes floats as 8 bytes that sort in numeric order: the sign bit of
+    positive numbers is set, and every bit of negative numbers is inverted.
+    """
+
+    _SIGN = 1 << 63
+    _MASK = (1 << 64) - 1
+
+    def serialize(self, obj):
+        bits = struct.unpack('>Q', struct.pack('>d', obj))[0]
+        bits = bits ^ self._MASK if bits & self._SIGN else bits | self._SIGN
+        return struct.pack('>Q', bits)
+
+    def deserialize(self, buf):
+        if buf is None:
+            return None
+        bits = struct.unpack('>Q', buf)[0]
+        bits = bits ^ self._SIGN if bits & self._SIGN else bits ^ self._MASK
+        return struct.unpack('>d', struct.pack('>Q', bits))[0]
+
+
+class TimestampCoder(Int64Coder):
+    """
+    Encodes datetimes as microseconds since the Unix epoch, in an order
+    preserving signed 64-bit integer. Naive datetimes are assumed to be in
+    UTC. Deserializes to timezone aware datetimes in UTC.
+    """
+
+    EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def serialize(self, obj):
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=datetime.timezone.utc)
+        delta = obj - self.EPOCH
+        micros = (delta.days * 86400 + delta.seconds) * 10 ** 6 + \
+            delta.microseconds
+        return super(TimestampCoder, self).serialize(micros)
+
+    def deserialize(self, buf):
+        if buf is None:
+            return None
+        micros = super(TimestampCoder, self).deserialize(buf)
+        return self.EPOCH + datetime.timedelta(microseconds=micros)
+
+
+# Type codes of tuple elements, as in the FoundationDB tuple layer. Elements
+# of different types sort by type code.
+_NULL = 0x00
+_BYTES = 0x01
+_STRING = 0x02
+_NESTED = 0x05
+_NEG_INT = 0x0b
+_INT_ZERO = 0x14
+_POS_INT = 0x1d
+_DOUBLE = 0x21
+_FALSE = 0x26
+_TRUE = 0x27
+
+
+def _escape(buf):
+    return buf.replace(b'\x00', b'\x00\xff') + b'\x00'
+
+
+def _unescape(buf, pos):
+    end = buf.index(b'\x00', pos)
+    while buf[end + 1:end + 2] == b'\xff':
+        end = buf.index(b'\x00', end + 2)
+    return buf[pos:end].replace(b'\x00\xff', b'\x00'), end + 1
+
+
+class TupleCoder(Coder):
+    """
+    Encodes tuples of ``None``, bools, ints, floats, strings, bytes and
+    nested tuples so that the encodings sort in tuple order, compatible
+    with the FoundationDB tuple layer. Elements of different types sort in
+    that order, so ints and floats do not sort together. Lists are encoded
+    as tuples.
+
+    The encoding of a tuple is a prefix of the encodings of every tuple
+    starting with its elements, see :py:meth:`prefix_range` and
+    :py:meth:`AsyncDatabase.scan_prefix`.
+    """
+
+    _FLOAT = Float64Coder()
+
+    def serialize(self, obj):
+        parts = []
+        for item in obj:
+            self._encode(item, parts, False)
+        return b''.join(parts)
+
+    def _encode(self, obj, parts, nested):
+        if obj is None:
+            parts.append(b'\x00\xff' if nested else b'\x00')
+        elif obj is True or obj is False:
+            parts.append(bytes([_TRUE if obj else _FALSE]))
+        elif isinstance(obj, int):
+            self._encode_int(obj, parts)
+        elif isinstance(obj, float):
+            parts.append(bytes([_DOUBLE]))
+            parts.append(self._FLOAT.serialize(obj))
+        elif isinstance(obj, str):
+            parts.append(bytes([_STRING]))
+            parts.append(_escape(obj.encode('utf8')))
+        elif isinstance(obj, (bytes, bytearray, memoryview)):
+            parts.append(bytes([_BYTES]))
+            parts.append(_escape(bytes(obj)))
+        elif isinstance(obj, (tuple, list)):
+            parts.append(bytes([_NESTED]))
+            for item in obj:
+                self._encode(item, parts, True)
+            parts.append(b'\x00')
+        else:
+            raise TypeError('unsupported tuple element: %r' % (obj,))
+
+    def _encode_int(self, obj, parts):
+        # Integers are stored big-endian in as few bytes as possible, with
+        # the byte count in the type code, or in a length byte for integers
+        # over 8 bytes, so that longer integers sort further from zero.
+        # Negative integers are stored as one's complements so that they
+        # sort in reverse.
+        size = (abs(obj).bit_length() + 7) // 8
+        if size > 255:
+            raise ValueError('integer too large for TupleCoder')
+        if obj >= 0:
+            header = [_INT_ZERO + size] if size <= 8 else [_POS_INT, size]
+        else:
+            header = [_INT_ZERO - size] if size <= 8 \
+                else [_NEG_INT, size ^ 0xff]
+            obj += (1 << (size * 8)) - 1
+        parts.append(bytes(header))
+        parts.append(obj.to_bytes(size, 'big'))
+
+    def deserialize(self, buf):
+        if buf is None:
+            return None
+        buf = bytes(buf)
+        items = []
+        pos = 0
+        while pos < len(buf):
+            item, pos = self._decode(buf, pos, False)
+            items.append(item)
+        return tuple(items)
+
+    def _decode(self, buf, pos, nested):
+        code = buf[pos]
+        pos += 1
+        if code == _NULL:
+            return None, pos + 1 if nested else pos
+        if code == _FALSE or code == _TRUE:
+            return code == _TRUE, pos
+        if code == _BYTES:
+            return _unescape(buf, pos)
+        if code == _STRING:
+            value, pos = _unescape(buf, pos)
+            return value.decode('utf8'), pos
+        if code == _DOUBLE:
+            return self._FLOAT.deserialize(buf[pos:pos + 8]), pos + 8
+        if code == _NESTED:
+            items = []
+            while buf[pos] != _NULL or buf[pos + 1:pos + 2] == b'\xff':
+                item, pos = self._decode(buf, pos, True)
+                items.append(item)
+            return tuple(items), pos + 1
+        if _NEG_INT <= code <= _POS_INT:
+            return self._decode_int(buf, pos, code)
+        raise ValueError('unknown tuple type code: 0x%02x' % code)
+
+    def _decode_int(self, buf, pos, code):
+        if code == _POS_INT:
+            size = buf[pos]
+            pos += 1
+        elif code == _NEG_INT:
+            size = buf[pos] ^ 0xff
+            pos += 1
+        else:
+            size = abs(code - _INT_ZERO)
+        value = int.from_bytes(buf[pos:pos + size], 'big')
+        if code < _INT_ZERO:
+            value -= (1 << (size * 8)) - 1
+        return value, pos + size
+
+    def prefix_range(self, prefix):
+        """
+        Returns the range [`start`, `stop`) of encoded keys of the tuples
+        starting with the elements of `prefix`, including `prefix` itself.
+        """
+        start = self.serialize(prefix)
+        return start, start + b'\xff'
+
+
+class StructCoder(Coder):
+    """
+    Encodes fixed layout records with a precompiled `struct.Struct`.
+
+    `fmt`:
+        The `struct` format of a record. Use a big-endian format (``'>'``)
+        for keys that sort by their fields.
+
+    `fields`:
+        Either a list of field names, or a space separated string of them,
+        to deserialize records to a namedtuple with those fields, a
+        namedtuple class, or a dataclass whose fields are in `fmt` order.
+        Records are deserialized to plain tuples if ``None``.
+    """
+
+    def __init__(self, fmt, fields=None):
+        self._struct = struct.Struct(fmt)
+        self._fields = None
+        if fields is None:
+            self.record_type = tuple
+            self._make = tuple
+        elif isinstance(fields, type) and hasattr(fields, '_make'):
+            self.record_type = fields
+            self._make = fields._make
+        elif isinstance(fields, type):
+            # A dataclass, whose fields are stored in definition order.
+            names = list(fields.__dataclass_fields__)
+            self.record_type = fields
+            self._make = lambda values: fields(*values)
+            self._fields = operator.attrgetter(*names) if len(names) > 1 \
+                else (lambda obj: (getattr(obj, names[0]),))
+        else:
+            self.record_type = collections.namedtuple('Record', fields)
+            self._make = self.record_type._make
+
+    def _values(self, obj):
+        return obj if self._fields is None else self._fields(obj)
+
+    def serialize(self, obj):
+        return self._struct.pack(*self._values(obj))
+
+    def deserialize(self, buf):
+        if buf is None:
+            return None
+        return self._make(self._struct.unpack(buf))
+
+    def serialize_many(self, objs):
+        # Packs the whole batch into one buffer, returning views of it.
+        objs = list(objs)
+        size = self._struct.size
+        buf = bytearray(size * len(objs))
+        pack_into = self._struct.pack_into
+        for offset, obj in zip(range(0, len(buf), size), objs):
+            pack_into(buf, offset, *self._values(obj))
+        view = memoryview(buf)
+        return [view[offset:offset + size]
+                for offset in range(0, len(buf), size)]
+
+    def deserialize_many(self, bufs):
+        # Unpacks the whole batch at once from a single contiguous copy.
+        data = b''.join(bufs)
+        if len(data) != self._struct.size * len(bufs):
+            raise struct.error('unpack requires buffers of %d bytes' %
+                               self._struct.size)
+        return list(map(self._make, self._struct.iter_unpack(data)))
+
 
 class PickleCoder(Coder):
 
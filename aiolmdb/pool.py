@@ -0,0 +1,314 @@
+import collections
+import multiprocessing
+import threading
+import time
+import weakref
+from concurrent.futures import Executor, Future
+
+_SHARED_POOL = None
+_SHARED_POOL_LOCK = threading.Lock()
+
+
+def shared_pool():
+    """
+    Returns the process wide `WorkerPool`, created on first use with a
+    thread per CPU. Enviroments share it through their own
+    :py:meth:`WorkerPool.client`, i.e.
+    ``aiolmdb.open(path, executor=shared_pool().client(4))``.
+    """
+    global _SHARED_POOL
+    with _SHARED_POOL_LOCK:
+        if _SHARED_POOL is None:
+            _SHARED_POOL = WorkerPool()
+        return _SHARED_POOL
+
+
+class _Completions():
+    """
+    Results of jobs submitted from one event loop, waiting to be delivered
+    to it. Only holds a weak reference to the loop, so that the pool does
+    not keep loops alive once they are no longer used.
+    """
+
+    def __init__(self, loop):
+        self.loop = weakref.ref(loop)
+        self.results = collections.deque()
+        self.scheduled = False
+
+
+class PoolClient(Executor):
+    """
+    An executor running jobs on a `WorkerPool` shared with other clients,
+    i.e. one per enviroment. Returned by :py:meth:`WorkerPool.client`.
+
+    Clients with queued jobs take turns, so that a busy client cannot
+    starve the others, and each runs at most `max_concurrency` jobs at
+    once. Shutting a client down does not affect the pool.
+    """
+
+    def __init__(self, pool, max_concurrency=None):
+        self.pool = pool
+        self.max_concurrency = max_concurrency
+        self._jobs = collections.deque()
+        self._running = 0
+        self._ready = False
+        self._shutdown = False
+
+    def _available(self):
+        return self._jobs and (self.max_concurrency is None or
+                               self._running < self.max_concurrency)
+
+    def submit_async(self, loop, fn, *args):
+        """
+        Runs `fn(*args)` in a worker thread, returning an asyncio future
+        attached to `loop` for its result. Cancelling the future before the
+        job starts skips it.
+        """
+        future = loop.create_future()
+        self.pool._put(self, (fn, args, future,
+                              self.pool._get_completions(loop)))
+        return future
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.pool._put(self, (lambda: fn(*args, **kwargs), (), future, None))
+        return future
+    submit.__doc__ = Executor.submit.__doc__
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting jobs, waiting for queued and running jobs to finish
+        if `wait`.
+        """
+        with self.pool._lock:
+            self._shutdown = True
+            while wait and (self._jobs or self._running):
+                self.pool._client_idle.wait()
+
+
+class WorkerPool(Executor):
+    """
+    A thread pool tuned for many short transactions. Can be used in place of
+    the default `ThreadPoolExecutor` of an `AsyncEnviroment`, i.e.
+    ``aiolmdb.open(path, executor=WorkerPool())``, or shared by many
+    enviroments through a :py:meth:`client` each. See `shared_pool`.
+
+    Jobs submitted with :py:meth:`submit_async` resolve asyncio futures
+    directly, without an intermediate `concurrent.futures.Future`. Idle
+    workers are only signalled when there are any, and a worker takes
+    several queued jobs at a time when the queue is long. Results are
+    handed back to the event loop in batches: at most one wake-up is
+    pending per loop, and it delivers every result completed until it
+    runs.
+
+    Threads are started as jobs arrive, up to `max_workers`, and exit after
+    `idle_timeout` seconds without work, so the number of threads follows
+    the load rather than the number of clients.
+
+    `max_workers`:
+        The maximum number of worker threads. Defaults to the number of
+        CPUs.
+
+    `batch_size`:
+        The maximum number of queued jobs a worker takes at once.
+
+    `idle_timeout`:
+        Seconds an idle thread waits for work before exiting, or ``None``
+        to keep threads until shutdown.
+    """
+
+    def __init__(self, max_workers=None, batch_size=16, idle_timeout=60.0):
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._client_idle = threading.Condition(self._lock)
+        # Clients with jobs that may run now, in the order they take turns.
+        self._ready = collections.deque()
+        self._threads = []
+        self._thread_count = 0
+        # Threads waiting for jobs, threads running taken jobs, and jobs
+        # not taken yet.
+        self._idle = 0
+        self._running = 0
+        self._queued = 0
+        self._shutdown = False
+        # Keyed weakly, so that entries go away with their loops.
+        self._completions = weakref.WeakKeyDictionary()
+        self._default_client = PoolClient(self)
+
+    def client(self, max_concurrency=None):
+        """
+        Returns a new `PoolClient` running jobs on this pool, at most
+        `max_concurrency` at a time if not ``None``.
+        """
+        return PoolClient(self, max_concurrency)
+
+    def submit_async(self, loop, fn, *args):
+        """
+        Runs `fn(*args)` in a worker thread, returning an asyncio future
+        attached to `loop` for its result. Cancelling the future before the
+        job starts skips it.
+        """
+        return self._default_client.submit_async(loop, fn, *args)
+
+    def submit(self, fn, *args, **kwargs):
+        return self._default_client.submit(fn, *args, **kwargs)
+    submit.__doc__ = Executor.submit.__doc__
+
+    def _get_completions(self, loop):
+        completions = self._completions.get(loop)
+        if completions is None:
+            with self._lock:
+                completions = self._completions.setdefault(
+                    loop, _Completions(loop))
+        return completions
+
+    def _put(self, client, job):
+        with self._lock:
+            if self._shutdown or client._shutdown:
+                raise RuntimeError('cannot schedule new jobs after shutdown')
+            client._jobs.append(job)
+            self._queued += 1
+            if not client._available():
+                return
+            if not client._ready:
+                client._ready = True
+                self._ready.append(client)
+            if self._idle:
+                self._work.notify()
+            elif self._queued > len(self._threads) - self._running and \
+                    len(self._threads) < self.max_workers:
+                self._thread_count += 1
+                thread = threading.Thread(target=self._worker, daemon=True,
+                                          name='aiolmdb-worker-%d' %
+                                          self._thread_count)
+                self._threads.append(thread)
+                thread.start()
+
+    def _take(self):
+        """
+        Waits for a client with jobs that may run, returning it and a share
+        of its jobs, or ``None`` once shut down or idle for `idle_timeout`.
+        """
+        with self._lock:
+            while not self._ready:
+                if self._shutdown:
+                    self._threads.remove(threading.current_thread())
+                    return None
+                self._idle += 1
+                started = time.monotonic()
+                self._work.wait(self.idle_timeout)
+                self._idle -= 1
+                if not self._ready and self.idle_timeout is not None and \
+                        time.monotonic() - started >= self.idle_timeout:
+                    self._threads.remove(threading.current_thread())
+                    return None
+            client = self._ready.popleft()
+            # Leave work for the other threads when the queue is short.
+            count = min(self.batch_size,
+                        len(client._jobs) // len(self._threads) or 1)
+            if client.max_concurrency is not None:
+                count = min(count, client.max_concurrency - client._running)
+            jobs = [client._jobs.popleft() for _ in range(count)]
+            client._running += count
+            self._running += 1
+            self._queued -= count
+            if client._available():
+                self._ready.append(client)
+                if self._idle:
+                    self._work.notify()
+            else:
+                client._ready = False
+            return client, jobs
+
+    def _finish(self, client, count):
+        client._running -= count
+        self._running -= 1
+        if not client._ready and client._available():
+            client._ready = True
+            self._ready.append(client)
+        if not client._jobs and not client._running:
+            self._client_idle.notify_all()
+
+    def _worker(self):
+        while True:
+            taken = self._take()
+            if taken is None:
+                return
+            # Jobs run in their own frame, so that an idle worker holds no
+            # references to finished jobs and their loops.
+            self._run_jobs(*taken)
+            del taken
+
+    def _run_jobs(self, client, jobs):
+        notify = []
+        for fn, args, future, completions in jobs:
+            if completions is None:
+                self._run_sync(fn, future)
+            elif not future.cancelled():
+                self._run_async(fn, args, future, completions)
+                if completions not in notify:
+                    notify.append(completions)
+        with self._lock:
+            self._finish(client, len(jobs))
+            # Loops with a wake-up already pending get these results with
+            # it.
+            notify = [completions for completions in notify
+                      if not completions.scheduled]
+            for completions in notify:
+                completions.scheduled = True
+        for completions in notify:
+            loop = completions.loop()
+            if loop is None:
+                continue
+            try:
+                loop.call_soon_threadsafe(self._deliver, completions)
+            except RuntimeError:
+                # The loop was closed, so nobody is waiting for results.
+                # Dropping them releases their futures, and the loop.
+                completions.results.clear()
+
+    def _run_sync(self, fn, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+    def _run_async(self, fn, args, future, completions):
+        try:
+            result = (None, fn(*args))
+        except BaseException as exc:
+            result = (exc, None)
+        completions.results.append((future,) + result)
+
+    def _deliver(self, completions):
+        with self._lock:
+            completions.scheduled = False
+        results = completions.results
+        while results:
+            future, exc, result = results.popleft()
+            if future.cancelled():
+                continue
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """
+        Stops the workers once every queued job has run.
+        """
+        with self._lock:
+            self._shutdown = True
+            self._work.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for thread in threads:
+                if thread is not threading.current_thread():
+                    thread.join()
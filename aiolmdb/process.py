@@ -0,0 +1,204 @@
+import asyncio
+import collections
+import functools
+import lmdb
+import multiprocessing
+import operator
+import os
+import sys
+from . import _action
+from .coders import IdentityCoder
+from concurrent.futures import ProcessPoolExecutor
+
+# Per process cache of {path: (pid, lmdb.Environment, {name: db_handle})}.
+_ENVIROMENTS = {}
+
+_LocalDatabase = collections.namedtuple(
+    '_LocalDatabase',
+    ['key_coder', 'value_coder', 'db_handle', 'tracks_changes',
+     'replicated', 'bloom_filter'])
+
+
+def _get_enviroment(path, env_kwargs):
+    """
+    Opens, or reuses, this process's enviroment for `path`. LMDB
+    enviroments must not be used across fork(), so an enviroment inherited
+    from a parent process is never reused.
+    """
+    entry = _ENVIROMENTS.get(path)
+    if entry is None or entry[0] != os.getpid():
+        entry = (os.getpid(), lmdb.open(path, **env_kwargs), {})
+        _ENVIROMENTS[path] = entry
+    return entry[1], entry[2]
+
+
+def _process_action(path, env_kwargs, name, key_coder, value_coder, action):
+    env, db_handles = _get_enviroment(path, env_kwargs)
+    if name not in db_handles:
+        db_handles[name] = None if name is None \
+            else env.open_db(name, create=False)
+    local_db = _LocalDatabase(key_coder, value_coder, db_handles[name],
+                              False, False, None)
+    return _action(env, local_db, action, False)
+
+
+def _get_multi(keys, txn):
+    return txn.get_multi(keys)
+
+
+def _default_executor(workers):
+    # Forked workers would inherit the parent's open enviroments and lock
+    # file descriptors, which LMDB forbids using, and opening the same path
+    # again in such a process fails. Start them from a clean process instead.
+    if sys.version_info < (3, 7):
+        # ProcessPoolExecutor only accepts a start method from Python 3.7.
+        raise RuntimeError('AsyncProcessEnviroment needs Python 3.7 or later '
+                           'to start workers without fork(); pass an '
+                           'executor whose workers do not inherit open '
+                           'enviroments instead')
+    method = 'forkserver' \
+        if 'forkserver' in multiprocessing.get_all_start_methods() \
+        else 'spawn'
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context(method))
+
+
+class AsyncProcessEnviroment():
+    """
+    Serves read-only transactions against an LMDB enviroment from a pool of
+    worker processes, so decoding and application logic are not bound to a
+    single core by the GIL.
+
+    Each worker lazily opens its own enviroment for `path` the first time it
+    runs a transaction. Workers are started with the ``forkserver`` method
+    (``spawn`` where it is unavailable), so that they do not inherit any
+    enviroment open in this process. Before Python 3.7, which cannot choose
+    the start method, an `executor` must be passed. Requests and results are
+    pickled across process boundaries, so keys, values, coders and actions
+    must all be picklable, and defined in importable modules.
+
+    `path`:
+        Path to the enviroment, as passed to `lmdb.open`.
+
+    `workers`:
+        The number of worker processes. Defaults to the number of CPUs.
+
+    `executor`:
+        An optional `concurrent.futures.Executor` to run transactions with,
+        overriding `workers`. Must run transactions in separate processes,
+        and is required before Python 3.7.
+        If they are forked while this process has `path` open, i.e. by a
+        `ProcessPoolExecutor` using the default ``fork`` start method on
+        Linux, opening the enviroment in them fails or corrupts LMDB's locks;
+        pass a ``forkserver`` or ``spawn`` `mp_context` instead.
+
+    `kwargs`:
+        Passed to `lmdb.open` in each worker. Enviroments are opened with
+        `readonly=True` unless overridden.
+    """
+
+    def __init__(self, path, workers=None, executor=None, **kwargs):
+        kwargs.setdefault('readonly', True)
+        self.path = path
+        self.env_kwargs = kwargs
+        self.workers = workers or multiprocessing.cpu_count()
+        self.executor = executor or _default_executor(self.workers)
+        self._default_db = AsyncProcessDatabase(self, None)
+
+    def _run_action(self, async_db, action):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, _process_action,
+                                    self.path, self.env_kwargs,
+                                    async_db.name, async_db.key_coder,
+                                    async_db.value_coder, action)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the worker processes, closing their enviroments.
+        """
+        self.executor.shutdown()
+
+    def get_default_db(self):
+        """
+        Gets an AsyncProcessDatabase wrapping the default database for the
+        enviroment.
+        """
+        return self._default_db
+
+    def open_db(self, name, key_coder=None, value_coder=None):
+        """
+        Gets an AsyncProcessDatabase wrapping an existing child database with
+        the provided name. The enviroment must have been opened with a large
+        enough `max_dbs`.
+        """
+        return AsyncProcessDatabase(self, name, key_coder=key_coder,
+                                    value_coder=value_coder)
+
+
+class AsyncProcessDatabase():
+    """
+    A read-only view of a database served by an `AsyncProcessEnviroment`.
+    """
+
+    def __init__(self, async_env, name, key_coder=None, value_coder=None):
+        self.async_env = async_env
+        self.name = name
+        self.key_coder = key_coder or IdentityCoder()
+        self.value_coder = value_coder or IdentityCoder()
+
+    def run(self, action):
+        """|coro|
+        Runs a read-only transaction in a worker process.
+
+        `action`:
+            A picklable one argument function (i.e. a module level function
+            or `functools.partial` of one) that takes an `AsyncTransaction`.
+            Its result must be picklable.
+        """
+        return self.async_env._run_action(self, action)
+
+    def get(self, key, default=None):
+        """|coro|
+        Fetch the first value matching `key`, returning `default` if `key`
+        does not exist.
+        """
+        return self.run(operator.methodcaller('get', key, default))
+
+    @asyncio.coroutine
+    def get_multi(self, keys, chunk_size=None):
+        """|coro|
+        Gets multiple keys from the database. Returns a dict of {key, value}.
+
+        `keys`:
+            An iterable of keys to retrieve from the database.
+
+        `chunk_size`:
+            The number of keys fetched per worker request. Defaults to
+            spreading the keys evenly across all workers.
+        """
+        keys = list(keys)
+        if chunk_size is None:
+            chunk_size = -(-len(keys) // self.async_env.workers)
+        chunk_size = max(chunk_size, 1)
+        chunks = yield from asyncio.gather(
+            *[self.run(functools.partial(_get_multi,
+                                         keys[i:i + chunk_size]))
+              for i in range(0, len(keys), chunk_size)])
+        result = {}
+        for chunk in chunks:
+            result.update(chunk)
+        return result
+
+    def scan(self, start=None, stop=None, limit=None, reverse=False):
+        """|coro|
+        Returns a list of (key, value) tuples for keys in the range
+        [`start`, `stop`). See :py:meth:`AsyncDatabase.scan`.
+        """
+        return self.run(operator.methodcaller('scan', start, stop,
+                                              limit=limit, reverse=reverse))
@@ -0,0 +1,219 @@
+import asyncio
+import os
+import struct
+import time
+from . import open as _open_env
+from . import _REPLICATION_FRAME, _REPLICATION_RECORD, _decode_ops
+
+
+class ReplicationError(Exception):
+    """
+    Raised by a `Follower` when the log it is given does not continue from
+    its position, i.e. because the leader trimmed records it had not
+    applied yet.
+    """
+
+
+@asyncio.coroutine
+def _read_frame(reader):
+    """
+    Reads a (sequence, timestamp, operations) frame shipped by
+    `AsyncEnviroment.ship_replication_log`, or returns ``None`` at the end of
+    the stream.
+    """
+    try:
+        header = yield from reader.readexactly(_REPLICATION_FRAME.size)
+    except asyncio.IncompleteReadError as exc:
+        if exc.partial:
+            raise
+        return None
+    sequence, timestamp, size = _REPLICATION_FRAME.unpack(header)
+    operations = yield from reader.readexactly(size)
+    return sequence, timestamp, operations
+
+
+def _apply_frames(txn, handles, log_handle, frames):
+    with txn.txn.cursor(db=log_handle) as log:
+        for sequence, timestamp, operations in frames:
+            for name, op, key, value in _decode_ops(operations):
+                if op == 'put':
+                    txn.txn.put(key, value, db=handles[name])
+                elif value is None:
+                    # Deletes every duplicate in a dupsort database.
+                    txn.txn.delete(key, db=handles[name])
+                else:
+                    txn.txn.delete(key, value, db=handles[name])
+            log.put(struct.pack('>Q', sequence),
+                    _REPLICATION_RECORD.pack(timestamp) + operations,
+                    append=True)
+
+
+def _receive_snapshot(fd, path):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'data.mdb'), 'wb') as data:
+        while True:
+            chunk = os.read(fd, 1 << 20)
+            if not chunk:
+                return
+            data.write(chunk)
+
+
+class Follower():
+    """
+    Applies a leader's replication log to a copy of its enviroment, so that
+    it can serve reads. See :py:meth:`AsyncEnviroment.enable_replication`.
+
+    Applied records are appended to the follower's own copy of the log
+    within the same transaction, so the follower's position survives
+    restarts. Nothing else may write to the follower's enviroment.
+
+    `async_env`:
+        The follower's `AsyncEnviroment`, holding a copy of the leader's
+        enviroment made after replication was enabled.
+
+    `log_db`:
+        The follower's copy of the replication log database.
+
+    `batch_size`:
+        The maximum number of log records applied per write transaction.
+    """
+
+    def __init__(self, async_env, log_db, batch_size=1000):
+        self.async_env = async_env
+        self.log_db = log_db
+        self.batch_size = batch_size
+        self.position = 0
+        self.timestamp = None
+        with async_env.env.begin(db=log_db.db_handle) as txn:
+            with txn.cursor() as cursor:
+                if cursor.last():
+                    self.position = struct.unpack('>Q', cursor.key())[0]
+                    self.timestamp = _REPLICATION_RECORD.unpack_from(
+                        cursor.value())[0]
+        self.leader_position = self.position
+
+    @classmethod
+    @asyncio.coroutine
+    def bootstrap(cls, fd, path, log_name, batch_size=1000, **kwargs):
+        """|coro|
+        Creates a follower from a copy of the leader's enviroment read from
+        file descriptor `fd` until EOF, as written by
+        :py:meth:`AsyncEnviroment.copyfd`, i.e. through a pipe. The copy is
+        written to the directory `path`, and opened with `kwargs` passed to
+        `lmdb.open`. The follower resumes from the last log record in the
+        copy.
+
+        `log_name`:
+            The name of the replication log database.
+        """
+        loop = asyncio.get_event_loop()
+        yield from loop.run_in_executor(None, _receive_snapshot, fd, path)
+        async_env = _open_env(path, **kwargs)
+        return cls(async_env, async_env.open_db(log_name),
+                   batch_size=batch_size)
+
+    @property
+    def lag(self):
+        """
+        The number of leader transactions not yet applied, as of the last
+        frame received.
+        """
+        return self.leader_position - self.position
+
+    @property
+    def lag_seconds(self):
+        """
+        Seconds since the leader committed the last applied transaction,
+        or ``0`` if the follower has caught up.
+        """
+        if not self.lag or self.timestamp is None:
+            return 0.0
+        return max(time.time() - self.timestamp, 0.0)
+
+    def _handle(self, name, flags):
+        """
+        Returns the handle of the database `name`, opening it with the
+        leader's `flags` if needed. Raises `ReplicationError` if it is
+        already open with other flags.
+        """
+        if name is None:
+            return self.async_env.get_default_db().db_handle
+        async_db = self.async_env._databases.get(name)
+        if async_db is None:
+            async_db = self.async_env.open_db(name, **flags)
+        with self.async_env.env.begin() as txn:
+            actual = async_db.db_handle.flags(txn)
+        if any(actual[flag] != value for flag, value in flags.items()):
+            raise ReplicationError('database %r is open with flags %r, the '
+                                   'leader uses %r' % (name, actual, flags))
+        return async_db.db_handle
+
+    @asyncio.coroutine
+    def apply(self, frames):
+        """|coro|
+        Applies a list of (sequence, timestamp, operations) frames in a
+        single write transaction. Frames already applied are skipped, and
+        frames without operations only update `leader_position`.
+        """
+        batch = []
+        position = self.position
+        for sequence, timestamp, operations in frames:
+            self.leader_position = max(self.leader_position, sequence)
+            if not operations or sequence <= position:
+                continue
+            if sequence != position + 1:
+                raise ReplicationError(
+                    'log skips from %d to %d' % (position, sequence))
+            batch.append((sequence, timestamp, operations))
+            position = sequence
+        if not batch:
+            return
+        flags = {}
+        for _, _, operations in batch:
+            _decode_ops(operations, flags)
+        handles = {name: self._handle(name, db_flags)
+                   for name, db_flags in flags.items()}
+        log_handle = self.log_db.db_handle
+        yield from self.async_env.get_default_db().run(
+            lambda txn: _apply_frames(txn, handles, log_handle, batch),
+            write=True, op='apply_replication_log', count=len(batch))
+        self.position, self.timestamp = batch[-1][0], batch[-1][1]
+
+    @asyncio.coroutine
+    def follow(self, reader):
+        """|coro|
+        Applies frames read from `reader`, an `asyncio.StreamReader`
+        connected to :py:meth:`AsyncEnviroment.ship_replication_log`, until
+        the end of the stream. Frames that arrive while a batch is being
+        applied are applied together in the next one.
+        """
+        queue = asyncio.Queue(maxsize=self.batch_size)
+
+        @asyncio.coroutine
+        def read():
+            while True:
+                frame = yield from _read_frame(reader)
+                yield from queue.put(frame)
+                if frame is None:
+                    return
+        read_task = asyncio.ensure_future(read())
+        try:
+            while True:
+                get_task = asyncio.ensure_future(queue.get())
+                yield from asyncio.wait([get_task, read_task],
+                                        return_when=asyncio.FIRST_COMPLETED)
+                if not get_task.done() and read_task.exception() is not None:
+                    # The stream failed without ending cleanly.
+                    get_task.cancel()
+                    raise read_task.exception()
+                frames = [(yield from get_task)]
+                while len(frames) < self.batch_size and not queue.empty():
+                    frames.append(queue.get_nowait())
+                eof = frames[-1] is None
+                if eof:
+                    frames.pop()
+                yield from self.apply(frames)
+                if eof:
+                    return
+        finally:
+            read_task.cancel()
@@ -0,0 +1,296 @@
+import asyncio
+import bisect
+import heapq
+import itertools
+import zlib
+from . import open as _open_env
+from . import _DEFAULT_FLAGS, _key_order
+
+
+def open(paths, partitioner=None, **kwargs):
+    """
+    Creates a new async sharded enviroment, with one LMDB enviroment per path
+    in `paths`. All other arguments are passed to lmdb.open to create each
+    enviroment.
+    """
+    paths = list(paths)
+    if isinstance(partitioner, RangePartitioner):
+        # Checked before any enviroment is opened.
+        partitioner.check(len(paths))
+    return AsyncShardedEnviroment([_open_env(path, **kwargs)
+                                   for path in paths],
+                                  partitioner=partitioner)
+
+
+class HashPartitioner():
+    """
+    Routes keys to shards by a stable hash (CRC32) of the encoded key. Spreads
+    load evenly, but every range scan must visit every shard.
+    """
+
+    def __call__(self, key, shard_count):
+        return zlib.crc32(key) % shard_count
+
+
+class RangePartitioner():
+    """
+    Routes keys to shards by comparing the encoded key to sorted
+    `boundaries`. With N boundaries, there must be N + 1 shards: keys below
+    `boundaries[0]` go to the first shard, keys at or above
+    `boundaries[i - 1]` and below `boundaries[i]` go to shard `i`.
+    Raises ``ValueError`` if `boundaries` are not strictly increasing.
+    """
+
+    def __init__(self, boundaries):
+        self.boundaries = [bytes(boundary) for boundary in boundaries]
+        if any(low >= high for low, high in zip(self.boundaries,
+                                                self.boundaries[1:])):
+            raise ValueError('boundaries must be strictly increasing')
+
+    def check(self, shard_count):
+        """
+        Raises ``ValueError`` unless the boundaries split keys into exactly
+        `shard_count` shards.
+        """
+        if len(self.boundaries) != shard_count - 1:
+            raise ValueError('%d boundaries require %d shards, got %d' % (
+                len(self.boundaries), len(self.boundaries) + 1, shard_count))
+
+    def __call__(self, key, shard_count):
+        return bisect.bisect_right(self.boundaries, key)
+
+
+class AsyncShardedEnviroment():
+    """
+    Spreads keys across multiple LMDB enviroments so that writes to
+    different shards commit in parallel. LMDB permits a single writer per
+    enviroment, so this is the only way to scale writes past one core.
+
+    Transactions never span shards: multi-key writes are atomic per shard,
+    not as a whole.
+
+    `envs`:
+        A list of `AsyncEnviroment`, one per shard. The order must be the
+        same every time the shards are opened.
+
+    `partitioner`:
+        A callable taking an encoded key and the number of shards, returning
+        the index of the shard to route the key to. Defaults to a
+        `HashPartitioner`. A `RangePartitioner` must have one boundary less
+        than there are shards.
+    """
+
+    def __init__(self, envs, partitioner=None):
+        self.envs = list(envs)
+        self.partitioner = partitioner or HashPartitioner()
+        if isinstance(self.partitioner, RangePartitioner):
+            self.partitioner.check(len(self.envs))
+        self._default_db = AsyncShardedDatabase(
+            self, [env.get_default_db() for env in self.envs])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Closes every shard's enviroment.
+        """
+        for env in self.envs:
+            env.close()
+
+    def get_default_db(self):
+        """
+        Gets an AsyncShardedDatabase wrapping the default database of every
+        shard.
+        """
+        return self._default_db
+
+    def open_db(self, name, *args, key_coder=None, value_coder=None,
+                **kwargs):
+        """
+        Opens a child database with the provided name in every shard. args
+        and kwargs are passed to `AsyncEnviroment.open_db`.
+        """
+        return AsyncShardedDatabase(
+            self, [env.open_db(name, *args, key_coder=key_coder,
+                               value_coder=value_coder, **kwargs)
+                   for env in self.envs])
+
+    def sync(self, force=False):
+        """|coro|
+        Flushes the data buffers of every shard to disk in parallel.
+        """
+        return asyncio.gather(*[env.sync(force) for env in self.envs])
+
+
+class AsyncShardedDatabase():
+    """
+    A database spread across the shards of an `AsyncShardedEnviroment`,
+    exposing the same API as `AsyncDatabase`.
+    """
+
+    def __init__(self, async_env, shards):
+        self.async_env = async_env
+        self.shards = shards
+        self._order = None
+
+    @property
+    def key_coder(self):
+        return self.shards[0].key_coder
+
+    @property
+    def value_coder(self):
+        return self.shards[0].value_coder
+
+    def _encode_key(self, key):
+        return bytes(self.key_coder.serialize(key))
+
+    def _key_order(self):
+        """
+        Returns a function mapping encoded keys to objects that sort the way
+        the shards sort them, see `aiolmdb._key_order`.
+        """
+        if self._order is None:
+            shard = self.shards[0]
+            flags = _DEFAULT_FLAGS
+            if shard.db_handle is not None:
+                with shard.async_env.env.begin() as txn:
+                    flags = shard.db_handle.flags(txn)
+            self._order = _key_order(flags)
+        return self._order
+
+    def _shard(self, key):
+        index = self.async_env.partitioner(self._encode_key(key),
+                                           len(self.shards))
+        return self.shards[index]
+
+    def _group(self, keys, key=None):
+        groups = {}
+        for item in keys:
+            shard = self._shard(item if key is None else key(item))
+            groups.setdefault(shard, []).append(item)
+        return groups
+
+    def get(self, key, default=None):
+        """|coro|
+        Fetch the first value matching `key`. See :py:meth:`AsyncDatabase.get`.
+        """
+        return self._shard(key).get(key, default)
+
+    def pop(self, key):
+        """|coro|
+        See :py:meth:`AsyncDatabase.pop`.
+        """
+        return self._shard(key).pop(key)
+
+    def replace(self, key, value):
+        """|coro|
+        See :py:meth:`AsyncDatabase.replace`.
+        """
+        return self._shard(key).replace(key, value)
+
+    def put(self, key, value, dupdata=True, overwrite=True, durable=False):
+        """|coro|
+        Store a record. See :py:meth:`AsyncDatabase.put`.
+        """
+        return self._shard(key).put(key, value, dupdata=dupdata,
+                                    overwrite=overwrite, durable=durable)
+
+    def delete(self, key, value=None, durable=False):
+        """|coro|
+        Delete a key. See :py:meth:`AsyncDatabase.delete`.
+        """
+        return self._shard(key).delete(key, value, durable=durable)
+
+    def merge(self, key, operand, merge_fn):
+        """|coro|
+        See :py:meth:`AsyncDatabase.merge`.
+        """
+        return self._shard(key).merge(key, operand, merge_fn)
+
+    def increment(self, key, delta=1):
+        """|coro|
+        See :py:meth:`AsyncDatabase.increment`.
+        """
+        return self._shard(key).increment(key, delta)
+
+    def update(self, key, fn, default=None):
+        """|coro|
+        See :py:meth:`AsyncDatabase.update`.
+        """
+        return self._shard(key).update(key, fn, default=default)
+
+    @asyncio.coroutine
+    def get_multi(self, keys):
+        """|coro|
+        Gets multiple keys from the database, reading from every shard in
+        parallel. Returns a dict of {key, value}.
+        """
+        groups = self._group(keys)
+        results = yield from asyncio.gather(
+            *[shard.get_multi(group) for shard, group in groups.items()])
+        merged = {}
+        for result in results:
+            merged.update(result)
+        return merged
+
+    @asyncio.coroutine
+    def put_multi(self, items, durable=False):
+        """|coro|
+        Sets multiple (key, value) tuples in the database, writing to every
+        shard in parallel. Returns a tuple of the number of items consumed
+        and the number of items added, summed across shards, or ``None`` if
+        any shard buffered its writes. Writes are only atomic per shard.
+        """
+        groups = self._group(items, key=lambda item: item[0])
+        results = yield from asyncio.gather(
+            *[shard.put_multi(group, durable=durable)
+              for shard, group in groups.items()])
+        if any(result is None for result in results):
+            return None
+        consumed = added = 0
+        for result in results:
+            consumed += result[0]
+            added += result[1]
+        return consumed, added
+
+    @asyncio.coroutine
+    def delete_multi(self, keys, durable=False):
+        """|coro|
+        Deletes multiple keys from the database, writing to every shard in
+        parallel. Returns a dictionary of {key, bool} each stating which key
+        was successfully deleted. Deletes are only atomic per shard.
+        """
+        groups = self._group(keys)
+        results = yield from asyncio.gather(
+            *[shard.delete_multi(group, durable=durable)
+              for shard, group in groups.items()])
+        merged = {}
+        for result in results:
+            merged.update(result)
+        return merged
+
+    @asyncio.coroutine
+    def scan(self, start=None, stop=None, limit=None, reverse=False):
+        """|coro|
+        Returns a list of (key, value) tuples for keys in the range
+        [`start`, `stop`), scanning every shard in parallel and merging the
+        results in the database's key order. See :py:meth:`AsyncDatabase.scan`.
+        """
+        results = yield from asyncio.gather(
+            *[shard.scan(start, stop, limit=limit, reverse=reverse)
+              for shard in self.shards])
+        order = self._key_order()
+        merged = heapq.merge(*results, reverse=reverse,
+                             key=lambda item: order(self._encode_key(item[0])))
+        return list(itertools.islice(merged, limit))
+
+    def drop(self, delete=True):
+        """|coro|
+        Drops the database from every shard.
+        """
+        return asyncio.gather(*[shard.drop(delete=delete)
+                                for shard in self.shards])
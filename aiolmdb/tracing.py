@@ -0,0 +1,137 @@
+import collections
+import os
+import sys
+import time
+import traceback
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _capture_stack(limit=32):
+    """
+    Returns the calling stack as a list of (filename, lineno, name) tuples,
+    innermost last, skipping aiolmdb's own frames. Source lines are only
+    looked up when formatted.
+    """
+    stack = []
+    frame = sys._getframe(1)
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        if os.path.dirname(code.co_filename) != _PACKAGE_DIR:
+            stack.append((code.co_filename, frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class Operation():
+    """
+    A transaction run by an `AsyncEnviroment`, as reported to trace hooks.
+    Times are `time.perf_counter` values.
+
+    `database`:
+        The name of the database, or ``None`` for the default database.
+
+    `op`:
+        The name of the operation, i.e. ``'get'`` or ``'put_multi'``.
+
+    `write`:
+        ``True`` for write transactions.
+
+    `count`:
+        The number of keys the operation touches, if known.
+
+    `bytes`:
+        The number of key and value bytes read or written, for operations
+        that count them, set once the operation ends.
+
+    `error`:
+        The exception the operation raised, if any.
+
+    `stack`:
+        The calling stack as a list of (filename, lineno, name) tuples, if
+        captured by a flight recorder.
+    """
+
+    def __init__(self, database, op, write, count):
+        self.database = database
+        self.op = op
+        self.write = write
+        self.count = count
+        self.bytes = None
+        self.error = None
+        self.stack = None
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+
+    @property
+    def queue_time(self):
+        """Seconds spent waiting for an executor thread."""
+        return self.started - self.submitted
+
+    @property
+    def txn_time(self):
+        """
+        Seconds spent running the transaction, including waiting for the
+        write lock and committing.
+        """
+        return self.finished - self.started
+
+    @property
+    def total_time(self):
+        return self.finished - self.submitted
+
+    def wrap(self, fn):
+        """
+        Wraps `fn`, a function run in the executor, to record when it runs.
+        """
+        def traced(*args):
+            self.started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self.finished = time.perf_counter()
+        return traced
+
+    def format(self):
+        lines = ['%s %s on %r: %.6fs total, %.6fs queued, %.6fs in txn, '
+                 'count=%s, bytes=%s%s\n' %
+                 ('write' if self.write else 'read', self.op, self.database,
+                  self.total_time, self.queue_time, self.txn_time,
+                  self.count, self.bytes,
+                  '' if self.error is None else ', error=%r' % self.error)]
+        if self.stack is not None:
+            lines.extend(traceback.format_list(
+                [traceback.FrameSummary(filename, lineno, name,
+                                        lookup_line=False)
+                 for filename, lineno, name in self.stack]))
+        return ''.join(lines)
+
+
+class FlightRecorder():
+    """
+    Keeps the `size` most recent operations that took at least `threshold`
+    seconds, along with the stack that issued them. See
+    :py:meth:`AsyncEnviroment.enable_flight_recorder`.
+    """
+
+    def __init__(self, threshold, size):
+        self.threshold = threshold
+        self.records = collections.deque(maxlen=size)
+
+    def __call__(self, operation):
+        if operation.total_time >= self.threshold:
+            self.records.append(operation)
+
+    def dump(self):
+        """
+        Returns a list of the recorded `Operation`, oldest first.
+        """
+        return list(self.records)
+
+    def format(self):
+        """
+        Returns the recorded operations and their stacks as text.
+        """
+        return '\n'.join(operation.format() for operation in self.records)
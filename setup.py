@@ -17,9 +17,9 @@ setuptools.setup(
     url="https://github.com/james7132/aiolmdb",
     packages=setuptools.find_packages(),
     install_requires=install_requires,
+    python_requires=">=3.5.2",
     classifiers=[
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.4",
         "Programming Language :: Python :: 3.5",
         "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
@@ -4,7 +4,14 @@ import unittest
 import aiolmdb
 import asyncio
 import lmdb
+import operator
+import struct
 import sys
+import threading
+import time
+from aiolmdb.coders import JSONCoder, NativeUInt64Coder
+from aiolmdb.coders import StringCoder, StructCoder, TupleCoder
+from aiolmdb.coders import UInt16Coder, UInt64Coder
 from tests import testlib
 import weakref
 
@@ -501,6 +508,25 @@ class OpenDbTest(testlib.AiolmdbTestCase):
         for val in (True, False)
     ]
 
+    def test_integerkey_coder(self):
+        _, env = self.create_env()
+        self.assertRaises(ValueError,
+                          lambda: env.open_db(b'ints', integerkey=True,
+                                              key_coder=UInt64Coder()))
+        self.assertRaises(ValueError,
+                          lambda: env.open_db(b'dups', dupsort=True,
+                                              integerdup=True,
+                                              value_coder=UInt64Coder()))
+
+    @asyncio.coroutine
+    def test_integerkey_order(self):
+        _, env = self.create_env()
+        db = env.open_db(b'ints', integerkey=True,
+                         key_coder=NativeUInt64Coder())
+        yield from db.put_multi([(i, b'') for i in (1000, 1, 256, 65536)])
+        self.assertEqual([key for key, _ in (yield from db.scan(2, 70000))],
+                         [256, 1000, 65536])
+
     def test_readonly_env_main(self):
         path, env = self.create_env()
         env.close()
@@ -537,6 +563,1090 @@ class OpenDbTest(testlib.AiolmdbTestCase):
         self.assertIsNotNone(db)
 
 
+class ScanTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_scan(self):
+        _, env = self.create_env()
+        db = env.open_db(b'db', key_coder=UInt16Coder())
+        yield from db.put_multi([(i, b'%d' % i) for i in range(10)])
+        self.assertEqual(len((yield from db.scan())), 10)
+        self.assertEqual((yield from db.scan(3, 6)),
+                         [(3, b'3'), (4, b'4'), (5, b'5')])
+        self.assertEqual((yield from db.scan(3, 6, reverse=True)),
+                         [(5, b'5'), (4, b'4'), (3, b'3')])
+        self.assertEqual((yield from db.scan(8, limit=5)),
+                         [(8, b'8'), (9, b'9')])
+        self.assertEqual((yield from db.scan(stop=2, reverse=True)),
+                         [(1, b'1'), (0, b'0')])
+
+    @asyncio.coroutine
+    def test_scan_prefix(self):
+        _, env = self.create_env()
+        db = env.open_db(b'db', key_coder=TupleCoder())
+        yield from db.put_multi([
+            (('t1', -5, 1), b'a'), (('t1', 3, 2), b'b'), (('t10', 1, 1), b'c'),
+            (('t1',), b'd'), (('t2', 0, 0), b'e')])
+        self.assertEqual([key for key, _ in (yield from db.scan_prefix(
+            ('t1',)))], [('t1',), ('t1', -5, 1), ('t1', 3, 2)])
+        self.assertEqual((yield from db.scan_prefix(('t1', 3),
+                                                    reverse=True)),
+                         [(('t1', 3, 2), b'b')])
+        self.assertEqual((yield from db.scan_prefix(('t3',))), [])
+
+    @asyncio.coroutine
+    def test_batch_coders(self):
+        _, env = self.create_env()
+        db = env.open_db(b'db', key_coder=StructCoder('>I'),
+                         value_coder=StructCoder('>Hd', 'flags score'))
+        record = db.value_coder.record_type
+        yield from db.put_multi([((i,), record(i, i / 2)) for i in range(10)])
+        self.assertEqual((yield from db.get_multi([(3,), (42,)])),
+                         {(3,): record(3, 1.5), (42,): None})
+        self.assertEqual((yield from db.scan((8,))),
+                         [((8,), record(8, 4.0)), ((9,), record(9, 4.5))])
+
+
+class DupsortTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def setUp(self):
+        super(DupsortTest, self).setUp()
+        _, self.env = self.create_env()
+        self.db = self.env.open_db(b'dups', dupsort=True,
+                                   value_coder=UInt16Coder())
+        added = yield from self.db.put_dups(b'a', range(10))
+        self.assertEqual(added, 10)
+        yield from self.db.put(b'b', 1)
+
+    @asyncio.coroutine
+    def test_get_all(self):
+        values = []
+        iterator = self.db.get_all(b'a', chunk_size=3)
+        while True:
+            try:
+                values.append((yield from iterator.__anext__()))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(values, list(range(10)))
+
+    @asyncio.coroutine
+    def test_get_dups(self):
+        self.assertEqual((yield from self.db.get_dups(b'a')),
+                         list(range(10)))
+        self.assertEqual((yield from self.db.get_dups(b'c')), [])
+
+    @asyncio.coroutine
+    def test_get_dups_fixed(self):
+        db = self.env.open_db(b'fixed', dupsort=True, dupfixed=True,
+                              value_coder=UInt16Coder())
+        yield from db.put_dups(b'a', [3, 1, 2])
+        self.assertEqual((yield from db.get_dups(b'a', dupfixed_bytes=2)),
+                         [1, 2, 3])
+
+    @asyncio.coroutine
+    def test_count_dups(self):
+        self.assertEqual((yield from self.db.count_dups(b'a')), 10)
+        self.assertEqual((yield from self.db.count_dups(b'b')), 1)
+        self.assertEqual((yield from self.db.count_dups(b'c')), 0)
+
+    @asyncio.coroutine
+    def test_delete_value(self):
+        self.assertTrue((yield from self.db.delete(b'a', 3)))
+        self.assertEqual((yield from self.db.count_dups(b'a')), 9)
+        self.assertNotIn(3, (yield from self.db.get_dups(b'a')))
+        self.assertTrue((yield from self.db.delete(b'a')))
+        self.assertEqual((yield from self.db.count_dups(b'a')), 0)
+
+
+class QueryTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def create_db(self):
+        _, env = self.create_env()
+        db = env.open_db(b'sub', key_coder=UInt16Coder(),
+                         value_coder=UInt16Coder())
+        yield from db.put_multi([(i, i * 2) for i in range(100)])
+        return db
+
+    @asyncio.coroutine
+    def test_filter_map(self):
+        db = yield from self.create_db()
+        query = db.query(10, 90, chunk_size=7) \
+            .filter(lambda item: item[0] % 10 == 0) \
+            .map(lambda item: item[1])
+        self.assertEqual((yield from query.collect()),
+                         [20, 40, 60, 80, 100, 120, 140, 160])
+        query = db.query(reverse=True, chunk_size=3) \
+            .filter(lambda item: item[0] < 5)
+        self.assertEqual((yield from query.collect()),
+                         [(4, 8), (3, 6), (2, 4), (1, 2), (0, 0)])
+
+    @asyncio.coroutine
+    def test_iterate(self):
+        db = yield from self.create_db()
+        query = db.query(chunk_size=16, partitions=[30, 60]) \
+            .filter(lambda item: item[0] % 3 == 0)
+        results = []
+        iterator = query.__aiter__()
+        while True:
+            try:
+                results.append((yield from iterator.__anext__()))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(results, [(i, i * 2) for i in range(0, 100, 3)])
+
+    @asyncio.coroutine
+    def test_raw_stages(self):
+        db = yield from self.create_db()
+        decoded = []
+        query = db.query(chunk_size=None) \
+            .filter(lambda item: bytes(item[0]) < b'\x00\x03', raw=True) \
+            .filter(lambda item: decoded.append(item) or True)
+        self.assertEqual((yield from query.count()), 3)
+        self.assertEqual(decoded, [(0, 0), (1, 2), (2, 4)])
+        self.assertRaises(ValueError,
+                          lambda: query.map(bytes, raw=True))
+
+    @asyncio.coroutine
+    def test_aggregate(self):
+        db = yield from self.create_db()
+        query = db.query(chunk_size=9).map(lambda item: item[1])
+        self.assertEqual((yield from query.aggregate(
+            lambda acc, value: acc + value, 0)), 9900)
+        partitioned = db.query(partitions=[25, 50, 75]) \
+            .map(lambda item: item[0])
+        self.assertEqual((yield from partitioned.aggregate(
+            lambda acc, key: acc + [key], [], operator.add)),
+            list(range(100)))
+        yield from self.assertAsyncRaises(
+            ValueError, partitioned.aggregate(lambda acc, key: acc, 0))
+        self.assertEqual((yield from partitioned.count()), 100)
+
+
+class PageTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def read_pages(self, db, **kwargs):
+        pages = []
+        token = None
+        while True:
+            items, token = yield from db.page(token=token, **kwargs)
+            pages.append(items)
+            if token is None:
+                return pages
+
+    @asyncio.coroutine
+    def test_pages(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'%02d' % i, b'') for i in range(10)])
+        pages = yield from self.read_pages(db, start=b'01', stop=b'09',
+                                           limit=3)
+        self.assertEqual([[key for key, _ in page] for page in pages],
+                         [[b'01', b'02', b'03'], [b'04', b'05', b'06'],
+                          [b'07', b'08']])
+        pages = yield from self.read_pages(db, limit=4, reverse=True)
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual(pages[0][0][0], b'09')
+        self.assertEqual(pages[2][-1][0], b'00')
+
+    @asyncio.coroutine
+    def test_resume_after_delete(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'%02d' % i, b'') for i in range(10)])
+        items, token = yield from db.page(limit=3)
+        yield from db.delete(b'02')
+        items, token = yield from db.page(limit=3, token=token)
+        self.assertEqual([key for key, _ in items], [b'03', b'04', b'05'])
+        items, token = yield from db.page(limit=2, reverse=True)
+        yield from db.delete(b'08')
+        items, token = yield from db.page(limit=2, token=token,
+                                          reverse=True)
+        self.assertEqual([key for key, _ in items], [b'07', b'06'])
+
+    @asyncio.coroutine
+    def test_dupsort(self):
+        _, env = self.create_env()
+        db = env.open_db(b'dups', dupsort=True)
+        for key in (b'a', b'b', b'c'):
+            yield from db.put_dups(key, [b'1', b'2', b'3'])
+        for reverse in (False, True):
+            pages = yield from self.read_pages(db, limit=2, reverse=reverse)
+            items = [item for page in pages for item in page]
+            expected = [(key, value) for key in (b'a', b'b', b'c')
+                        for value in (b'1', b'2', b'3')]
+            self.assertEqual(items, expected[::-1] if reverse else expected)
+
+    @asyncio.coroutine
+    def test_invalid_token(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'a', b''), (b'b', b'')])
+        _, token = yield from db.page(limit=1)
+        self.assertRaises(ValueError,
+                          lambda: db.page(token=token, reverse=True))
+        self.assertRaises(ValueError, lambda: db.page(token='garbage'))
+        self.assertRaises(ValueError, lambda: db.page(limit=0))
+
+
+class BloomFilterTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_negative_lookups(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'%d' % i, b'v') for i in range(100)])
+        yield from db.enable_bloom_filter()
+        run = db.run
+        db.run = None
+        self.assertIsNone((yield from db.get(b'missing')))
+        self.assertFalse((yield from db.contains(b'missing')))
+        self.assertEqual((yield from db.get_multi([b'x', b'y'])),
+                         {b'x': None, b'y': None})
+        db.run = run
+        self.assertTrue((yield from db.contains(b'1')))
+        self.assertEqual((yield from db.get_multi([b'1', b'x'])),
+                         {b'1': b'v', b'x': None})
+
+    @asyncio.coroutine
+    def test_writes_update_filter(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.enable_bloom_filter()
+        yield from db.put(b'a', b'1')
+        yield from db.put_multi([(b'b', b'2')])
+        yield from db.increment(b'c')
+        yield from db.run(lambda txn: txn.replace(b'd', b'4'), write=True)
+        result = yield from db.get_multi([b'a', b'b', b'c', b'd'])
+        self.assertTrue(all(value is not None for value in result.values()))
+
+    @asyncio.coroutine
+    def test_sidecar(self):
+        path, env = self.create_env()
+        sidecar = os.path.join(path, 'bloom')
+        db = env.get_default_db()
+        yield from db.put(b'a', b'1')
+        yield from db.enable_bloom_filter(path=sidecar)
+        yield from db.save_bloom_filter()
+
+        built = db.bloom_filter
+        yield from db.enable_bloom_filter(path=sidecar)
+        saved = db.bloom_filter
+        self.assertIsNot(saved, built)
+        self.assertEqual(saved.bits, built.bits)
+        yield from db.put(b'b', b'2')
+        yield from db.enable_bloom_filter(path=sidecar)
+        self.assertIsNot(db.bloom_filter, saved)
+        self.assertTrue((yield from db.contains(b'b')))
+        self.assertRaises(ValueError,
+                          env.open_db(b'other').save_bloom_filter)
+
+
+class IterMultiTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def consume(self, iterator):
+        items = []
+        while True:
+            try:
+                items.append((yield from iterator.__anext__()))
+            except StopAsyncIteration:
+                return items
+
+    @asyncio.coroutine
+    def test_sync_keys(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'%d' % i, b'v%d' % i) for i in range(10)])
+        keys = (b'%d' % i for i in range(12))
+        items = yield from self.consume(db.iter_multi(keys, chunk_size=3))
+        self.assertEqual(items, [(b'%d' % i, None if i >= 10 else b'v%d' % i)
+                                 for i in range(12)])
+
+    @asyncio.coroutine
+    def test_async_keys(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'a', b'1'), (b'b', b'2')])
+        source = aiolmdb._ChunkedIterator(
+            lambda: aiolmdb._completed(([b'b', b'x', b'a'], True)))
+        items = yield from self.consume(db.iter_multi(source, chunk_size=2))
+        self.assertEqual(items, [(b'b', b'2'), (b'x', None), (b'a', b'1')])
+        self.assertEqual((yield from self.consume(db.iter_multi([]))), [])
+
+
+class DeleteRangeTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_delete_range(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'%03d' % i, b'') for i in range(100)])
+        commits = env._dirty_commits
+        self.assertEqual((yield from db.delete_range(b'010', b'050',
+                                                     batch_size=7)), 40)
+        self.assertEqual(env._dirty_commits - commits, 6)
+        keys = [key for key, _ in (yield from db.scan())]
+        self.assertEqual(keys, [b'%03d' % i for i in range(100)
+                                if not 10 <= i < 50])
+        self.assertEqual((yield from db.delete_range(b'090', atomic=True)),
+                         10)
+        self.assertEqual((yield from db.delete_range()), 50)
+        self.assertEqual((yield from db.scan()), [])
+
+    @asyncio.coroutine
+    def test_delete_prefix(self):
+        _, env = self.create_env()
+        db = env.open_db(b'dups', dupsort=True)
+        yield from db.put_dups(b'a\xff', [b'1', b'2'])
+        yield from db.put_dups(b'a\xff\xff', [b'1'])
+        yield from db.put_dups(b'b', [b'1'])
+        watcher = db.watch()
+        self.assertEqual((yield from db.delete_prefix(b'a\xff',
+                                                      batch_size=1)), 3)
+        self.assertEqual((yield from db.scan()), [(b'b', b'1')])
+        event = yield from watcher.__anext__()
+        self.assertEqual((event.op, event.key), ('delete', b'a\xff'))
+        self.assertEqual(aiolmdb._prefix_successor(b'\xff\xff'), None)
+        self.assertEqual(aiolmdb._prefix_successor(b'ab\xff'), b'ac')
+
+
+class StreamTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_watched_raises(self):
+        _, env = self.create_env()
+        db = env.open_db(b'blobs')
+        watcher = db.watch()
+        self.cleanups.append(watcher.close)
+        yield from self.assertAsyncRaises(
+            ValueError, db.put_stream(b'blob', [b'x']))
+        yield from self.assertAsyncRaises(
+            ValueError, db.delete_stream(b'blob'))
+
+    @asyncio.coroutine
+    def test_put_and_read(self):
+        _, env = self.create_env()
+        db = env.open_db(b'blobs', key_coder=StringCoder())
+        data = os.urandom(10000)
+        commits = env._dirty_commits
+        size = yield from db.put_stream(
+            'blob', [data[i:i + 300] for i in range(0, len(data), 300)],
+            chunk_size=1024, batch_size=3)
+        self.assertEqual(size, len(data))
+        # Ten chunks, three per transaction, the last with the manifest.
+        self.assertEqual(env._dirty_commits - commits, 4)
+        reader = yield from db.open_stream('blob')
+        self.assertEqual(reader.size, len(data))
+        self.assertEqual((yield from reader.read(10)), data[:10])
+        self.assertEqual(reader.seek(2000), 2000)
+        self.assertEqual((yield from reader.read(3000)), data[2000:5000])
+        reader.seek(-100, os.SEEK_END)
+        self.assertEqual((yield from reader.read()), data[-100:])
+        self.assertEqual((yield from reader.read()), b'')
+        reader.seek(0)
+        chunks = []
+        while True:
+            try:
+                chunks.append((yield from reader.__anext__()))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(b''.join(chunks), data)
+        self.assertEqual(set(map(len, chunks)), {1024, 10000 % 1024})
+
+    @asyncio.coroutine
+    def test_async_source_and_empty(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+
+        class Source():
+            def __init__(self):
+                self.pieces = [b'abc', b'', b'defg']
+
+            def __aiter__(self):
+                return self
+
+            @asyncio.coroutine
+            def __anext__(self):
+                if not self.pieces:
+                    raise StopAsyncIteration
+                return self.pieces.pop(0)
+        self.assertEqual((yield from db.put_stream(b'a', Source(),
+                                                   chunk_size=2)), 7)
+        reader = yield from db.open_stream(b'a')
+        self.assertEqual((yield from reader.read()), b'abcdefg')
+        self.assertEqual((yield from db.put_stream(b'empty', [])), 0)
+        reader = yield from db.open_stream(b'empty')
+        self.assertEqual((yield from reader.read()), b'')
+        self.assertIsNone((yield from db.open_stream(b'missing')))
+
+    @asyncio.coroutine
+    def test_overwrite_and_delete(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_stream(b'a', [b'x' * 100], chunk_size=10)
+        old_reader = yield from db.open_stream(b'a')
+        yield from db.put_stream(b'a', [b'y' * 15], chunk_size=10)
+        # Only the manifest and the new generation's chunks remain.
+        self.assertEqual(len((yield from db.scan())), 3)
+        yield from self.assertAsyncRaises(aiolmdb.blobs.StreamChangedError,
+                                          old_reader.read())
+        reader = yield from db.open_stream(b'a')
+        self.assertEqual((yield from reader.read()), b'y' * 15)
+        self.assertTrue((yield from db.delete_stream(b'a')))
+        self.assertFalse((yield from db.delete_stream(b'a')))
+        self.assertEqual((yield from db.scan()), [])
+
+    @asyncio.coroutine
+    def test_failed_write_is_discarded(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+
+        def source():
+            yield b'x' * 100
+            raise RuntimeError()
+        yield from self.assertAsyncRaises(
+            RuntimeError, db.put_stream(b'a', source(), chunk_size=10,
+                                        batch_size=2))
+        self.assertEqual((yield from db.scan()), [])
+        yield from db.put(b'b', b'not a stream')
+        yield from self.assertAsyncRaises(ValueError, db.open_stream(b'b'))
+
+
+class MergeTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_increment(self):
+        _, env = self.create_env()
+        db = env.open_db(b'counters', value_coder=UInt64Coder())
+        results = yield from asyncio.gather(
+            *[db.increment(b'a') for _ in range(100)])
+        self.assertEqual(sorted(results), list(range(1, 101)))
+        self.assertEqual((yield from db.get(b'a')), 100)
+        self.assertEqual((yield from db.increment(b'a', 5)), 105)
+
+    @asyncio.coroutine
+    def test_increment_coalesced(self):
+        _, env = self.create_env()
+        db = env.open_db(b'counters', value_coder=UInt64Coder())
+        last_txnid = env.info()['last_txnid']
+        yield from asyncio.gather(*[db.increment(b'a') for _ in range(100)])
+        self.assertEqual(env.info()['last_txnid'], last_txnid + 1)
+
+    @asyncio.coroutine
+    def test_merge(self):
+        _, env = self.create_env()
+        db = env.open_db(b'lists', value_coder=JSONCoder())
+
+        def append(value, item):
+            return (value or []) + [item]
+        yield from asyncio.gather(*[db.merge(b'a', i, append)
+                                    for i in range(5)])
+        self.assertEqual((yield from db.get(b'a')), [0, 1, 2, 3, 4])
+
+    @asyncio.coroutine
+    def test_merge_error(self):
+        _, env = self.create_env()
+        db = env.open_db(b'counters', value_coder=UInt64Coder())
+
+        def fail(value, operand):
+            raise ValueError()
+        failed = db.merge(b'a', None, fail)
+        incremented = db.increment(b'a')
+        yield from self.assertAsyncRaises(ValueError, failed)
+        self.assertEqual((yield from incremented), 1)
+
+    @asyncio.coroutine
+    def test_unencodable_result(self):
+        _, env = self.create_env()
+        db = env.open_db(b'counters', value_coder=UInt64Coder())
+        good = db.increment(b'good')
+        bad = db.increment(b'bad', -1)
+        self.assertEqual((yield from good), 1)
+        yield from self.assertAsyncRaises(struct.error, bad)
+        self.assertEqual((yield from db.get(b'good')), 1)
+        self.assertIsNone((yield from db.get(b'bad')))
+
+
+class UpdateTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_update(self):
+        _, env = self.create_env()
+        db = env.open_db(b'docs', value_coder=JSONCoder())
+        yield from db.put(b'a', {'count': 1})
+
+        def bump(doc):
+            doc['count'] += 1
+            return doc
+        self.assertEqual((yield from db.update(b'a', bump)), {'count': 2})
+        self.assertEqual((yield from db.update(b'b', bump,
+                                               default={'count': 0})),
+                         {'count': 1})
+        self.assertEqual((yield from db.get(b'a')), {'count': 2})
+
+    @asyncio.coroutine
+    def test_update_ordered(self):
+        _, env = self.create_env()
+        db = env.open_db(b'docs', value_coder=JSONCoder())
+        yield from asyncio.gather(
+            db.update(b'a', lambda value: value + [1], default=[]),
+            db.update(b'a', lambda value: value + [2], default=[]),
+            db.update(b'a', lambda value: value * 2, default=[]))
+        self.assertEqual((yield from db.get(b'a')), [1, 2, 1, 2])
+
+    @asyncio.coroutine
+    def test_update_multi(self):
+        _, env = self.create_env()
+        db = env.open_db(b'counters', value_coder=UInt64Coder())
+        yield from db.put(b'a', 1)
+        last_txnid = env.info()['last_txnid']
+        result = yield from db.update_multi({
+            b'a': lambda value: value + 1,
+            b'b': lambda value: value + 2,
+        }, default=0)
+        self.assertEqual(result, {b'a': 2, b'b': 2})
+        self.assertEqual(env.info()['last_txnid'], last_txnid + 1)
+
+    @asyncio.coroutine
+    def test_update_multi_error(self):
+        _, env = self.create_env()
+        db = env.open_db(b'counters', value_coder=UInt64Coder())
+        yield from db.put(b'a', 1)
+
+        def fail(value):
+            raise ValueError()
+        failed = db.update_multi({b'a': lambda value: value + 10,
+                                  b'b': fail}, default=0)
+        incremented = db.increment(b'a')
+        yield from self.assertAsyncRaises(ValueError, failed)
+        self.assertEqual((yield from incremented), 2)
+        self.assertIsNone((yield from db.get(b'b')))
+
+
+class WarmupTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_warmup(self):
+        _, env = self.create_env()
+        db = env.open_db(b'db')
+        yield from db.put_multi([(b'%03d' % i, b'x' * 100)
+                                 for i in range(50)])
+        progress = []
+        stats = yield from env.warmup([db], chunk_size=10, fadvise=True,
+                                      progress=progress.append)
+        self.assertEqual(stats['entries'], 50)
+        self.assertEqual(stats['bytes'], 50 * 103)
+        self.assertEqual(len(progress), 5)
+
+    @asyncio.coroutine
+    def test_warmup_key_range(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'%03d' % i, b'x') for i in range(50)])
+        stats = yield from env.warmup(key_range=(b'010', b'020'),
+                                      chunk_size=3)
+        self.assertEqual(stats['entries'], 10)
+
+    @asyncio.coroutine
+    def test_warmup_budget(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'%03d' % i, b'x') for i in range(50)])
+        stats = yield from env.warmup(budget=40, chunk_size=5)
+        self.assertEqual(stats['entries'], 10)
+
+
+class InlineReadTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_inline_after_fast_reads(self):
+        _, env = self.create_env()
+        db = env.open_db(b'db', inline_threshold=1.0)
+        yield from db.put(b'a', b'b')
+        self.assertEqual((yield from db.get(b'a')), b'b')
+        self.assertEqual(db.read_stats, {'inline': 0, 'executor': 1})
+        self.assertEqual((yield from db.get(b'a')), b'b')
+        self.assertEqual((yield from db.get_multi([b'a', b'c'])),
+                         {b'a': b'b', b'c': None})
+        self.assertEqual(db.read_stats, {'inline': 2, 'executor': 1})
+
+    @asyncio.coroutine
+    def test_slow_reads_use_executor(self):
+        _, env = self.create_env()
+        db = env.open_db(b'db', inline_threshold=0.0)
+        yield from db.get(b'a')
+        yield from db.get(b'a')
+        self.assertEqual(db.read_stats, {'inline': 0, 'executor': 2})
+
+    @asyncio.coroutine
+    def test_inline_errors(self):
+        _, env = self.create_env()
+        db = env.open_db(b'db', key_coder=UInt16Coder(),
+                         inline_threshold=1.0)
+        yield from db.get(1)
+        yield from self.assertAsyncRaises(struct.error, db.get(2 ** 16))
+        self.assertEqual(db.read_stats['inline'], 1)
+
+
+class WriteBehindTest(testlib.AiolmdbTestCase):
+
+    def create_db(self, **kwargs):
+        _, env = self.create_env()
+        db = env.open_db(b'db', key_coder=StringCoder(),
+                         value_coder=StringCoder())
+        db.enable_write_behind(**kwargs)
+        return env, db
+
+    @asyncio.coroutine
+    def test_read_your_writes(self):
+        env, db = self.create_db(max_delay=60)
+        last_txnid = env.info()['last_txnid']
+        for i in range(10):
+            self.assertTrue((yield from db.put('%d' % i, 'v%d' % i)))
+        yield from db.delete('3')
+        self.assertEqual((yield from db.get('1')), 'v1')
+        self.assertEqual((yield from db.get('3', 'gone')), 'gone')
+        self.assertEqual((yield from db.get_multi(['2', '3'])),
+                         {'2': 'v2', '3': None})
+        self.assertEqual(env.info()['last_txnid'], last_txnid)
+
+        yield from db.flush()
+        self.assertEqual(env.info()['last_txnid'], last_txnid + 1)
+        self.assertEqual((yield from db.run(lambda txn: txn.get('1'))), 'v1')
+        self.assertIsNone((yield from db.run(lambda txn: txn.get('3'))))
+
+    @asyncio.coroutine
+    def test_flush_on_size(self):
+        env, db = self.create_db(max_items=5, max_delay=60)
+        yield from db.put_multi([('%d' % i, '') for i in range(5)])
+        self.assertEqual((yield from db.run(lambda txn: txn.get('4'))), '')
+
+    @asyncio.coroutine
+    def test_flush_on_delay(self):
+        env, db = self.create_db(max_delay=0.01)
+        yield from db.put('a', 'b')
+        yield from asyncio.sleep(0.1)
+        self.assertEqual((yield from db.run(lambda txn: txn.get('a'))), 'b')
+
+    @asyncio.coroutine
+    def test_scan_flushes(self):
+        env, db = self.create_db(max_delay=60)
+        yield from db.put('a', '1')
+        yield from db.put('b', '2')
+        self.assertEqual((yield from db.scan()), [('a', '1'), ('b', '2')])
+
+    @asyncio.coroutine
+    def test_update_sees_buffered_writes(self):
+        env, db = self.create_db(max_delay=60)
+        yield from db.put('a', 'x')
+        self.assertEqual((yield from db.update('a', lambda v: v + 'y')), 'xy')
+        self.assertEqual((yield from db.get('a')), 'xy')
+
+    @asyncio.coroutine
+    def test_failed_flush_is_retried(self):
+        env, db = self.create_db(max_delay=0.01)
+        run = db.run
+        failures = [lmdb.MapFullError('full')]
+
+        def run_failing(*args, **kwargs):
+            if failures:
+                future = self.loop.create_future()
+                future.set_exception(failures.pop())
+                return future
+            return run(*args, **kwargs)
+        db.run = run_failing
+        yield from db.put('a', 'b')
+        yield from self.assertAsyncRaises(lmdb.MapFullError, db.flush())
+        self.assertEqual(db._write_behind.failures, 1)
+        for _ in range(50):
+            if not len(db._write_behind):
+                break
+            yield from asyncio.sleep(0.01)
+        self.assertEqual((yield from run(lambda txn: txn.get('a'))), 'b')
+        self.assertEqual(db._write_behind.failures, 0)
+
+    def test_close_refuses_buffered_writes(self):
+        env, db = self.create_db(max_delay=60)
+        self.loop.run_until_complete(db.put('a', 'b'))
+        self.assertRaises(RuntimeError, env.close)
+        self.loop.run_until_complete(db.flush())
+        env.close()
+
+        env, db = self.create_db(max_delay=60)
+        self.loop.run_until_complete(db.put('a', 'b'))
+        env.close(discard_buffered=True)
+
+    @asyncio.coroutine
+    def test_unencodable_write_is_not_buffered(self):
+        _, env = self.create_env()
+        db = env.open_db(b'db', key_coder=StringCoder(),
+                         value_coder=UInt64Coder())
+        db.enable_write_behind(max_delay=60)
+        yield from self.assertAsyncRaises(struct.error, db.put('bad', -1))
+        yield from self.assertAsyncRaises(
+            struct.error, db.put_multi([('a', 1), ('bad', -1)]))
+        self.assertIsNone((yield from db.get('a')))
+        yield from db.put('ok', 1)
+        yield from db.flush()
+        self.assertEqual((yield from db.run(lambda txn: txn.get('ok'))), 1)
+        self.assertEqual((yield from db.increment('ok')), 2)
+
+
+class SyncCountingEnv():
+
+    def __init__(self, env):
+        self.env = env
+        self.syncs = 0
+
+    def sync(self, force=False):
+        self.syncs += 1
+        return self.env.sync(force)
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+
+class DurabilityTest(testlib.AiolmdbTestCase):
+
+    def create_env(self, **kwargs):
+        path, env = super(DurabilityTest, self).create_env(sync=False,
+                                                           **kwargs)
+        env.env = SyncCountingEnv(env.env)
+        return path, env
+
+    @asyncio.coroutine
+    def test_durable_writes_share_sync(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from asyncio.gather(*[db.put(b'%d' % i, b'', durable=True)
+                                    for i in range(20)])
+        self.assertGreaterEqual(env.env.syncs, 1)
+        self.assertLess(env.env.syncs, 20)
+        self.assertTrue((yield from db.delete(b'0', durable=True)))
+
+    @asyncio.coroutine
+    def test_non_durable_writes_do_not_sync(self):
+        _, env = self.create_env()
+        yield from env.get_default_db().put(b'a', b'')
+        yield from asyncio.sleep(0)
+        self.assertEqual(env.env.syncs, 0)
+
+    @asyncio.coroutine
+    def test_durable_write_behind(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        db.enable_write_behind(max_delay=60)
+        yield from db.put(b'a', b'b', durable=True)
+        self.assertEqual(env.env.syncs, 1)
+        self.assertEqual((yield from db.run(lambda txn: txn.get(b'a'))),
+                         b'b')
+
+    @asyncio.coroutine
+    def test_scheduler_interval(self):
+        _, env = self.create_env()
+        env.start_sync_scheduler(interval=0.01)
+        yield from asyncio.sleep(0.05)
+        self.assertEqual(env.env.syncs, 0)
+        yield from env.get_default_db().put(b'a', b'')
+        yield from asyncio.sleep(0.05)
+        self.assertEqual(env.env.syncs, 1)
+        env.stop_sync_scheduler()
+
+    @asyncio.coroutine
+    def test_scheduler_dirty_commits(self):
+        _, env = self.create_env()
+        env.start_sync_scheduler(interval=60, max_dirty_commits=3)
+        db = env.get_default_db()
+        for i in range(3):
+            yield from db.put(b'%d' % i, b'')
+        yield from asyncio.sleep(0.05)
+        self.assertEqual(env.env.syncs, 1)
+        env.stop_sync_scheduler()
+
+
+class WatchTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_watch(self):
+        _, env = self.create_env()
+        db = env.open_db(b'db', key_coder=StringCoder(),
+                         value_coder=StringCoder())
+        watcher = db.watch()
+        yield from db.put('a', '1')
+        yield from db.put_multi([('b', '2'), ('c', '3')])
+        yield from db.delete('a')
+        yield from db.delete('missing')
+        yield from db.update('b', lambda value: value * 2)
+        events = []
+        for _ in range(5):
+            events.append((yield from watcher.__anext__()))
+        self.assertEqual([(e.op, e.key, e.value) for e in events],
+                         [('put', 'a', '1'), ('put', 'b', '2'),
+                          ('put', 'c', '3'), ('delete', 'a', None),
+                          ('put', 'b', '22')])
+        self.assertIsNone(events[0].sequence)
+        watcher.close()
+        yield from self.assertAsyncRaises(StopAsyncIteration,
+                                          watcher.__anext__())
+
+    @asyncio.coroutine
+    def test_watch_prefix(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        watcher = db.watch(prefix=b'user:')
+        yield from db.put_multi([(b'user:1', b''), (b'item:1', b''),
+                                 (b'user:2', b'')])
+        self.assertEqual((yield from watcher.__anext__()).key, b'user:1')
+        self.assertEqual((yield from watcher.__anext__()).key, b'user:2')
+
+    @asyncio.coroutine
+    def test_watch_aborted_writes(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        watcher = db.watch()
+
+        def fail(txn):
+            txn.put(b'a', b'')
+            raise ValueError()
+        yield from self.assertAsyncRaises(ValueError,
+                                          db.run(fail, write=True))
+        yield from db.put(b'b', b'')
+        self.assertEqual((yield from watcher.__anext__()).key, b'b')
+
+    @asyncio.coroutine
+    def test_watch_overflow(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        watcher = db.watch(max_queue=2)
+        yield from db.put_multi([(b'%d' % i, b'') for i in range(3)])
+        yield from watcher.__anext__()
+        yield from watcher.__anext__()
+        yield from self.assertAsyncRaises(aiolmdb.WatchOverflowError,
+                                          watcher.__anext__())
+
+    @asyncio.coroutine
+    def test_change_log_resume(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        db.enable_change_log(env.open_db(b'changes'))
+        yield from db.put_multi([(b'a', b'1'), (b'b', b'2')])
+        yield from db.delete(b'a')
+        changes = yield from db.read_changes()
+        self.assertEqual([(e.sequence, e.op, e.key, e.value)
+                          for e in changes],
+                         [(1, 'put', b'a', b'1'), (2, 'put', b'b', b'2'),
+                          (3, 'delete', b'a', None)])
+
+        watcher = db.watch(since=1)
+        yield from db.put(b'c', b'3')
+        events = []
+        for _ in range(3):
+            events.append((yield from watcher.__anext__()))
+        self.assertEqual([e.sequence for e in events], [2, 3, 4])
+        self.assertEqual(events[-1].key, b'c')
+        self.assertRaises(ValueError,
+                          lambda: env.open_db(b'other').watch(since=1))
+
+
+class ReaderMonitorTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_long_reader_reported(self):
+        _, env = self.create_env()
+        db = env.open_db(b'sub')
+        yield from db.put_multi([(b'%d' % i, b'x' * 100) for i in range(100)])
+        self.assertEqual((yield from db.stat())['entries'], 100)
+        txn = env.env.begin()
+        reports = []
+        env.start_reader_monitor(interval=0.01, max_age=0.02,
+                                 callback=reports.append)
+        with self.assertLogs('aiolmdb', 'WARNING'):
+            while not reports or not reports[-1]['long_readers']:
+                yield from asyncio.sleep(0.01)
+        report = env.reader_report
+        self.assertEqual(report['long_readers'][0][:3],
+                         (os.getpid(), report['readers'][0][1], txn.id()))
+        self.assertGreater(report['map_pages'], report['free_pages'])
+        txn.abort()
+        env.close()
+
+    def test_parse_readers(self):
+        readers = ('    pid     thread     txnid\n'
+                   '      8520 7fcb77f5bb80 1\n'
+                   '      8520 7fcb7dbfa700 -\n')
+        self.assertEqual(aiolmdb._parse_readers(readers),
+                         [(8520, '7fcb77f5bb80', 1)])
+        self.assertEqual(aiolmdb._parse_readers(NO_READERS), [])
+
+    @asyncio.coroutine
+    def test_max_read_age(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        yield from db.put_multi([(b'%d' % i, b'') for i in range(1000)])
+        env.max_read_age = 0
+        yield from self.assertAsyncRaises(aiolmdb.TransactionTooOldError,
+                                          db.scan())
+        yield from db.put(b'a', b'')
+        env.max_read_age = None
+        self.assertEqual(len((yield from db.scan())), 1001)
+
+
+class CompactionTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def fragment(self, env, db):
+        yield from db.put_multi([(b'%04d' % i, b'x' * 3000)
+                                 for i in range(500)])
+        yield from db.delete_multi([b'%04d' % i for i in range(480)])
+        # Freed pages only become reusable once no snapshot can see them.
+        yield from db.put(b'a', b'')
+
+    @asyncio.coroutine
+    def test_analyze(self):
+        _, env = self.create_env()
+        db = env.open_db(b'sub')
+        yield from self.fragment(env, db)
+        report = yield from env.analyze()
+        stat = report['databases'][b'sub']
+        self.assertEqual(stat['entries'], 21)
+        self.assertEqual(stat['pages'], stat['branch_pages'] +
+                         stat['leaf_pages'] + stat['overflow_pages'])
+        self.assertGreater(report['overflow_share'], 0.5)
+        self.assertGreater(report['free_pages'], 400)
+        self.assertEqual(report['reclaimable_bytes'],
+                         report['free_pages'] * env.stat()['psize'])
+        self.assertIn(None, report['databases'])
+
+    @asyncio.coroutine
+    def test_compact_and_switch(self):
+        path, env = self.create_env()
+        db = env.open_db(b'sub')
+        yield from self.fragment(env, db)
+        size = os.path.getsize(os.path.join(path, 'data.mdb'))
+        compaction = yield from env.compact(self.create_dir(create=False))
+
+        yield from db.put(b'late', b'write')
+        write = db.put(b'paused', b'write')
+        yield from asyncio.gather(compaction.switch(), write)
+        self.assertFalse(os.path.exists(compaction.path))
+        self.assertLess(os.path.getsize(os.path.join(path, 'data.mdb')),
+                        size)
+        self.assertEqual((yield from db.get(b'late')), b'write')
+        self.assertEqual((yield from db.get(b'paused')), b'write')
+        self.assertEqual((yield from db.stat())['entries'], 23)
+        self.assertEqual((yield from env.analyze())['free_pages'], 0)
+
+    @asyncio.coroutine
+    def test_switch_waits_for_cancelled_write(self):
+        _, env = self.create_env()
+        compaction = yield from env.compact(self.create_dir(create=False))
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow(txn):
+            started.set()
+            release.wait()
+        write = env.get_default_db().run(slow, write=True)
+        yield from self.loop.run_in_executor(None, started.wait)
+        write.cancel()
+        switch = asyncio.ensure_future(compaction.switch())
+        try:
+            yield from asyncio.sleep(0.05)
+            self.assertFalse(switch.done())
+            self.assertEqual(env._active[True], 1)
+        finally:
+            release.set()
+        yield from switch
+        self.assertEqual(env._active[True], 0)
+
+    @asyncio.coroutine
+    def test_discard(self):
+        _, env = self.create_env()
+        compaction = yield from env.compact(self.create_dir(create=False))
+        self.assertTrue(os.path.exists(compaction.path))
+        compaction.discard()
+        self.assertFalse(os.path.exists(compaction.path))
+
+    @asyncio.coroutine
+    def test_open_recovers_interrupted_switch(self):
+        path, env = self.create_env()
+        yield from env.get_default_db().put(b'a', b'b')
+        env.close()
+        # As left by a crash between the two renames of a switch.
+        os.rename(path, path + '.old')
+        _, env = self.create_env(path)
+        self.assertFalse(os.path.exists(path + '.old'))
+        self.assertEqual((yield from env.get_default_db().get(b'a')), b'b')
+
+    @asyncio.coroutine
+    def test_compact_requires_open_args(self):
+        env = aiolmdb.AsyncEnviroment(lmdb.open(self.create_dir()))
+        self.cleanups.append(env.close)
+        yield from self.assertAsyncRaises(ValueError, env.compact())
+
+
+class TracingTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def test_trace_hooks(self):
+        _, env = self.create_env()
+        db = env.open_db(b'sub')
+        started = []
+        ended = []
+        hook = env.add_trace_hook(started.append, ended.append)
+        yield from db.put(b'a', b'123')
+        yield from db.get_multi([b'a', b'b'])
+        yield from self.assertAsyncRaises(
+            ZeroDivisionError, db.run(lambda txn: 1 / 0, op='custom'))
+        self.assertEqual(started, ended)
+        self.assertEqual([(op.database, op.op, op.write, op.count, op.bytes)
+                          for op in ended],
+                         [(b'sub', 'put', True, 1, 4),
+                          (b'sub', 'get_multi', False, 2, 3),
+                          (b'sub', 'custom', False, None, 0)])
+        self.assertIsInstance(ended[2].error, ZeroDivisionError)
+        for op in ended:
+            self.assertGreaterEqual(op.queue_time, 0)
+            self.assertGreaterEqual(op.txn_time, 0)
+            self.assertIsNone(op.stack)
+        env.remove_trace_hook(hook)
+        yield from db.get(b'a')
+        self.assertEqual(len(ended), 3)
+
+    @asyncio.coroutine
+    def test_inline_reads_traced(self):
+        _, env = self.create_env()
+        db = env.open_db(b'sub', inline_threshold=1)
+        ended = []
+        env.add_trace_hook(end=ended.append)
+        yield from db.get(b'a')
+        yield from db.get(b'a')
+        yield from asyncio.sleep(0)
+        self.assertEqual(db.read_stats, {'inline': 1, 'executor': 1})
+        self.assertEqual([op.op for op in ended], ['get', 'get'])
+
+    @asyncio.coroutine
+    def test_flight_recorder(self):
+        _, env = self.create_env()
+        db = env.get_default_db()
+        recorder = env.enable_flight_recorder(threshold=0.05, size=2)
+        yield from db.get(b'fast')
+        for _ in range(3):
+            yield from db.run(lambda txn: time.sleep(0.05), op='slow')
+        records = recorder.dump()
+        self.assertEqual([op.op for op in records], ['slow', 'slow'])
+        self.assertIn('test_flight_recorder', records[0].stack[-1][2])
+        text = recorder.format()
+        self.assertIn('read slow on None', text)
+        self.assertIn("op='slow'", text)
+        env.disable_flight_recorder()
+        self.assertIsNone(env.flight_recorder)
+        self.assertEqual(env._trace_hooks, [])
+
+
 def reader_count(env): return env.readers().count('\n') - 1
 
 
@@ -0,0 +1,31 @@
+from aiolmdb.bloom import BloomFilter
+import unittest
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        keys = [b'key%d' % i for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(b'key%d' % i)
+        false_positives = sum(b'other%d' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_serialization(self):
+        bloom = BloomFilter(100)
+        bloom.add(b'a')
+        copy = BloomFilter.from_bytes(bloom.to_bytes())
+        self.assertIn(b'a', copy)
+        self.assertEqual(copy.hash_count, bloom.hash_count)
+        self.assertEqual(copy.bits, bloom.bits)
+        truncated = bloom.to_bytes()[:-1]
+        self.assertRaises(ValueError,
+                          lambda: BloomFilter.from_bytes(truncated))
+        self.assertRaises(ValueError, lambda: BloomFilter.from_bytes(b''))
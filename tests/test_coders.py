@@ -2,6 +2,14 @@ from aiolmdb.coders import IdentityCoder
 from aiolmdb.coders import StringCoder
 from aiolmdb.coders import UInt16Coder, UInt32Coder, UInt64Coder
 from aiolmdb.coders import JSONCoder, PickleCoder
+from aiolmdb.coders import Int16Coder, Int32Coder, Int64Coder
+from aiolmdb.coders import NativeUInt32Coder, NativeUInt64Coder
+from aiolmdb.coders import Float64Coder, TimestampCoder, TupleCoder
+from aiolmdb.coders import StructCoder
+import collections
+import datetime
+import struct
+import sys
 import unittest
 
 PICKLE_TEST_CASES = [
@@ -163,6 +171,129 @@ class CoderTests(unittest.TestCase):
             with self.subTest(val=val, enc=enc):
                 self.assertEqual(val, PickleCoder().deserialize(enc))
 
+    def test_native_uint(self):
+        for coder, size in ((NativeUInt32Coder(), 4),
+                            (NativeUInt64Coder(), 8)):
+            with self.subTest(coder=coder):
+                enc = coder.serialize(1)
+                self.assertEqual(len(enc), size)
+                self.assertEqual(enc, (1).to_bytes(size, sys.byteorder))
+                self.assertEqual(coder.deserialize(enc), 1)
+                self.assertTrue(coder.native_integer)
+
+    def test_signed_int_order(self):
+        for coder, bits in ((Int16Coder(), 16), (Int32Coder(), 32),
+                            (Int64Coder(), 64)):
+            values = [-2 ** (bits - 1), -256, -1, 0, 1, 255,
+                      2 ** (bits - 1) - 1]
+            with self.subTest(coder=coder):
+                encoded = [coder.serialize(val) for val in values]
+                self.assertEqual(encoded, sorted(encoded))
+                self.assertEqual([coder.deserialize(enc) for enc in encoded],
+                                 values)
+                self.assertRaises(struct.error,
+                                  lambda: coder.serialize(2 ** (bits - 1)))
+
+    def test_float_order(self):
+        values = [float('-inf'), -1e300, -2.5, -1e-300, 0.0, 1e-300, 2.5,
+                  1e300, float('inf')]
+        coder = Float64Coder()
+        encoded = [coder.serialize(val) for val in values]
+        self.assertEqual(encoded, sorted(encoded))
+        self.assertEqual([coder.deserialize(enc) for enc in encoded], values)
+
+    def test_timestamp(self):
+        coder = TimestampCoder()
+        utc = datetime.timezone.utc
+        values = [datetime.datetime(1900, 1, 1, tzinfo=utc),
+                  datetime.datetime(1970, 1, 1, tzinfo=utc),
+                  datetime.datetime(2018, 6, 1, 12, 30, 0, 5, tzinfo=utc)]
+        encoded = [coder.serialize(val) for val in values]
+        self.assertEqual(encoded, sorted(encoded))
+        self.assertEqual([coder.deserialize(enc) for enc in encoded], values)
+        self.assertEqual(coder.serialize(datetime.datetime(1970, 1, 1)),
+                         coder.serialize(values[1]))
+
+    def test_tuple_round_trip(self):
+        coder = TupleCoder()
+        values = [(), (None,), (True, False), (0, 1, -1, 2 ** 64, -2 ** 80),
+                  (1.5, float('-inf')), ('', 'a\x00b'),
+                  (b'', b'\x00\xff', bytearray(b'x')),
+                  ((None, (b'\x00',)), ()), ('tenant', 1528000000, 42)]
+        for value in values:
+            with self.subTest(input=value):
+                self.assertEqual(coder.deserialize(coder.serialize(value)),
+                                 tuple(bytes(item) if isinstance(
+                                     item, bytearray) else item
+                                     for item in value))
+        self.assertEqual(coder.deserialize(coder.serialize([[1], 'a'])),
+                         ((1,), 'a'))
+        self.assertIsNone(coder.deserialize(None))
+        self.assertRaises(TypeError, lambda: coder.serialize((object(),)))
+
+    def test_tuple_order(self):
+        values = [(None,), (b'',), (b'\x00',), (b'\x00', 1), (b'a',),
+                  ('',), ('a',), ('a', None), ('a', 'b'), ('a', (1,)),
+                  ('a', -2 ** 70), ('a', -256), ('a', -1), ('a', 0),
+                  ('a', 255), ('a', 256), ('a', 2 ** 64), ('a', 1.5),
+                  ('a', True), ('a\x00',), ('ab',), ((None,),), ((1,),),
+                  ((1, 2),), (-1,), (1,), (-0.5,), (0.5,), (False,), (True,)]
+        coder = TupleCoder()
+        encoded = [coder.serialize(value) for value in values]
+        self.assertEqual(encoded, sorted(encoded))
+
+    def test_tuple_prefix_range(self):
+        coder = TupleCoder()
+        start, stop = coder.prefix_range(('a', 1))
+        for value in [('a', 1), ('a', 1, None), ('a', 1, 'z', (2,))]:
+            with self.subTest(input=value):
+                self.assertTrue(start <= coder.serialize(value) < stop)
+        for value in [('a',), ('a', 0), ('a', 2), ('a', 1.0), ('ab', 1)]:
+            with self.subTest(input=value):
+                self.assertFalse(start <= coder.serialize(value) < stop)
+
+    def test_many_defaults(self):
+        coder = StringCoder()
+        self.assertEqual(coder.serialize_many(['a', 'bc']), [b'a', b'bc'])
+        self.assertEqual(coder.deserialize_many([b'a', b'bc']), ['a', 'bc'])
+
+    def test_struct(self):
+        coder = StructCoder('>IHd', 'id flags score')
+        record = coder.record_type(7, 2, 0.5)
+        self.assertEqual(coder.serialize(record), struct.pack('>IHd', 7, 2,
+                                                              0.5))
+        self.assertEqual(coder.deserialize(coder.serialize(record)), record)
+        self.assertEqual(coder.deserialize(coder.serialize((7, 2, 0.5))).id,
+                         7)
+        self.assertIsNone(coder.deserialize(None))
+        self.assertEqual(StructCoder('>I').deserialize(b'\x00\x00\x00\x01'),
+                         (1,))
+
+    def test_struct_many(self):
+        Point = collections.namedtuple('Point', ['x', 'y'])
+        coder = StructCoder('>ii', Point)
+        points = [Point(i, -i) for i in range(100)]
+        encoded = coder.serialize_many(points)
+        self.assertEqual([bytes(buf) for buf in encoded],
+                         [coder.serialize(point) for point in points])
+        self.assertEqual(coder.deserialize_many(encoded), points)
+        self.assertEqual(coder.serialize_many([]), [])
+        self.assertEqual(coder.deserialize_many([]), [])
+        self.assertRaises(struct.error,
+                          lambda: coder.deserialize_many([b'\x00' * 7]))
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'requires dataclasses')
+    def test_struct_dataclass(self):
+        import dataclasses
+        Sample = dataclasses.make_dataclass('Sample', [('sensor', int),
+                                                       ('value', float)])
+        coder = StructCoder('<Hf', Sample)
+        samples = [Sample(1, 0.5), Sample(2, -1.0)]
+        self.assertEqual(coder.deserialize(coder.serialize(samples[0])),
+                         samples[0])
+        self.assertEqual(coder.deserialize_many(
+            coder.serialize_many(samples)), samples)
+
 
 if __name__ == '__main__':
     unittest.main()
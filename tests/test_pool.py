@@ -0,0 +1,168 @@
+import aiolmdb
+import asyncio
+import gc
+import threading
+import time
+from aiolmdb import pool as pool_module
+from aiolmdb.pool import WorkerPool
+from tests import testlib
+
+
+class PoolTestCase(testlib.AiolmdbTestCase):
+
+    def create_pool(self, *args, **kwargs):
+        pool = WorkerPool(*args, **kwargs)
+        self.cleanups.append(pool.shutdown)
+        return pool
+
+
+class WorkerPoolTest(PoolTestCase):
+
+    @asyncio.coroutine
+    def test_submit_async(self):
+        pool = self.create_pool(2)
+        self.assertEqual(len(pool._threads), 0)
+        result = yield from pool.submit_async(self.loop, pow, 2, 10)
+        self.assertEqual(result, 1024)
+        yield from self.assertAsyncRaises(
+            ZeroDivisionError, pool.submit_async(self.loop, divmod, 1, 0))
+        self.assertEqual(len(pool._threads), 1)
+
+    def test_submit(self):
+        pool = self.create_pool(2)
+        self.assertEqual(pool.submit(int, 'ff', base=16).result(), 255)
+        self.assertEqual(list(pool.map(abs, [-1, -2])), [1, 2])
+        pool.shutdown()
+        self.assertRaises(RuntimeError, lambda: pool.submit(abs, 1))
+
+    def test_closed_loops_are_released(self):
+        pool = self.create_pool(1)
+        loop = asyncio.new_event_loop()
+        self.assertEqual(
+            loop.run_until_complete(pool.submit_async(loop, abs, -1)), 1)
+        self.assertEqual(len(pool._completions), 1)
+        loop.close()
+        del loop
+        # The worker may still be returning from the job.
+        deadline = time.monotonic() + 1
+        while pool._completions and time.monotonic() < deadline:
+            gc.collect()
+            time.sleep(0.01)
+        self.assertEqual(len(pool._completions), 0)
+
+    @asyncio.coroutine
+    def test_batched_delivery(self):
+        pool = self.create_pool(4)
+        deliveries = []
+        deliver = pool._deliver
+        pool._deliver = lambda completions: (deliveries.append(None),
+                                             deliver(completions))
+        # Block the loop while jobs complete, so their results share
+        # wake-ups.
+        futures = [pool.submit_async(self.loop, time.sleep, 0.001)
+                   for _ in range(100)]
+        time.sleep(0.2)
+        yield from asyncio.gather(*futures)
+        self.assertLess(len(deliveries), 10)
+        self.assertLessEqual(len(pool._threads), 4)
+
+    @asyncio.coroutine
+    def test_cancelled_jobs_are_skipped(self):
+        pool = self.create_pool(1)
+        started = threading.Event()
+        release = threading.Event()
+        ran = []
+        blocker = pool.submit_async(
+            self.loop, lambda: (started.set(), release.wait()))
+        started.wait()
+        future = pool.submit_async(self.loop, ran.append, 1)
+        future.cancel()
+        release.set()
+        yield from blocker
+        yield from pool.submit_async(self.loop, ran.append, 2)
+        self.assertEqual(ran, [2])
+
+    @asyncio.coroutine
+    def test_enviroment(self):
+        pool = self.create_pool(2)
+        env = aiolmdb.open(self.create_dir(), executor=pool)
+        self.cleanups.append(env.close)
+        db = env.get_default_db()
+        yield from asyncio.gather(*[db.put(b'%d' % i, b'%d' % i)
+                                    for i in range(50)])
+        values = yield from asyncio.gather(*[db.get(b'%d' % i)
+                                             for i in range(50)])
+        self.assertEqual(values, [b'%d' % i for i in range(50)])
+
+
+class PoolClientTest(PoolTestCase):
+
+    @asyncio.coroutine
+    def test_clients_take_turns(self):
+        pool = self.create_pool(1, batch_size=1)
+        busy = pool.client()
+        other = pool.client()
+        order = []
+        futures = [busy.submit_async(self.loop, order.append, ('busy', i))
+                   for i in range(10)]
+        futures.append(other.submit_async(self.loop, order.append,
+                                          ('other', 0)))
+        yield from asyncio.gather(*futures)
+        self.assertLess(order.index(('other', 0)), 3)
+
+    @asyncio.coroutine
+    def test_max_concurrency(self):
+        pool = self.create_pool(4)
+        client = pool.client(max_concurrency=2)
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def job():
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.005)
+            with lock:
+                state['running'] -= 1
+        yield from asyncio.gather(*[client.submit_async(self.loop, job)
+                                    for _ in range(20)])
+        self.assertEqual(state['peak'], 2)
+
+    @asyncio.coroutine
+    def test_threads_follow_load(self):
+        pool = self.create_pool(2, idle_timeout=0.05)
+        clients = [pool.client() for _ in range(50)]
+        yield from asyncio.gather(*[client.submit_async(self.loop, abs, -1)
+                                    for client in clients])
+        self.assertLessEqual(len(pool._threads), 2)
+        yield from asyncio.sleep(0.2)
+        self.assertEqual(len(pool._threads), 0)
+        self.assertEqual((yield from clients[0].submit_async(self.loop, abs,
+                                                             -2)), 2)
+
+    def test_client_shutdown(self):
+        pool = self.create_pool(2)
+        client = pool.client()
+        futures = [client.submit(time.sleep, 0.01) for _ in range(4)]
+        client.shutdown()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertRaises(RuntimeError, lambda: client.submit(abs, 1))
+        self.assertEqual(pool.submit(abs, -1).result(), 1)
+
+    def test_shared_pool(self):
+        self.assertIs(pool_module.shared_pool(), pool_module.shared_pool())
+
+    @asyncio.coroutine
+    def test_enviroments_share_pool(self):
+        pool = self.create_pool(2)
+        dbs = []
+        for _ in range(5):
+            env = aiolmdb.open(self.create_dir(),
+                               executor=pool.client(max_concurrency=1))
+            self.cleanups.append(env.close)
+            dbs.append(env.get_default_db())
+        yield from asyncio.gather(*[db.put(b'key', b'%d' % i)
+                                    for i, db in enumerate(dbs)])
+        values = yield from asyncio.gather(*[db.get(b'key') for db in dbs])
+        self.assertEqual(values, [b'%d' % i for i in range(5)])
+        self.assertLessEqual(len(pool._threads), 2)
@@ -0,0 +1,85 @@
+import asyncio
+import functools
+import os
+import sys
+import unittest
+from unittest import mock
+
+from aiolmdb import process
+from aiolmdb.coders import StringCoder
+from aiolmdb.process import AsyncProcessEnviroment
+from tests import testlib
+
+
+def _pid(txn):
+    return os.getpid()
+
+
+def _get_upper(key, txn):
+    return txn.get(key).upper()
+
+
+@unittest.skipIf(sys.version_info < (3, 7),
+                 'workers cannot be started without fork()')
+class AsyncProcessEnviromentTest(testlib.AiolmdbTestCase):
+
+    @asyncio.coroutine
+    def setUp(self):
+        super(AsyncProcessEnviromentTest, self).setUp()
+        self.path, self.env = self.create_env()
+        db = self.env.open_db(b'db', key_coder=StringCoder(),
+                              value_coder=StringCoder())
+        yield from db.put_multi([('%03d' % i, 'v%d' % i)
+                                 for i in range(20)])
+        self.process_env = AsyncProcessEnviroment(self.path, workers=2,
+                                                  max_dbs=10)
+        self.cleanups.append(self.process_env.close)
+        self.db = self.process_env.open_db(b'db', key_coder=StringCoder(),
+                                           value_coder=StringCoder())
+
+    @asyncio.coroutine
+    def test_get(self):
+        self.assertEqual((yield from self.db.get('001')), 'v1')
+        self.assertEqual((yield from self.db.get('nope', 'x')), 'x')
+
+    @asyncio.coroutine
+    def test_get_multi(self):
+        keys = ['%03d' % i for i in range(25)]
+        result = yield from self.db.get_multi(keys, chunk_size=3)
+        self.assertEqual(len(result), 25)
+        self.assertEqual(result['019'], 'v19')
+        self.assertIsNone(result['024'])
+
+    @asyncio.coroutine
+    def test_scan(self):
+        self.assertEqual((yield from self.db.scan('005', '008')),
+                         [('005', 'v5'), ('006', 'v6'), ('007', 'v7')])
+        self.assertEqual((yield from self.db.scan(limit=2, reverse=True)),
+                         [('019', 'v19'), ('018', 'v18')])
+
+    @asyncio.coroutine
+    def test_run(self):
+        self.assertEqual(
+            (yield from self.db.run(functools.partial(_get_upper, '002'))),
+            'V2')
+        pid = yield from self.db.run(_pid)
+        self.assertNotEqual(pid, os.getpid())
+
+    @asyncio.coroutine
+    def test_sees_new_writes(self):
+        yield from self.db.get('000')
+        yield from self.env.get_default_db().put(b'new', b'value')
+        default_db = self.process_env.get_default_db()
+        self.assertEqual((yield from default_db.get(b'new')), b'value')
+
+
+class DefaultExecutorTest(unittest.TestCase):
+
+    def test_requires_start_method(self):
+        with mock.patch.object(process.sys, 'version_info', (3, 6, 0)):
+            self.assertRaises(RuntimeError,
+                              lambda: AsyncProcessEnviroment('unused'))
+
+
+if __name__ == '__main__':
+    unittest.main()
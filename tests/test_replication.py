@@ -0,0 +1,254 @@
+import asyncio
+import os
+import socket
+from aiolmdb import replication
+from tests import testlib
+
+
+class ReplicationTestCase(testlib.AiolmdbTestCase):
+
+    def create_leader(self):
+        _, env = self.create_env()
+        env.enable_replication(env.open_db(b'replication'))
+        return env
+
+    @asyncio.coroutine
+    def bootstrap(self, leader, **kwargs):
+        read_fd, write_fd = os.pipe()
+
+        def copy():
+            try:
+                leader.env.copyfd(write_fd)
+            finally:
+                os.close(write_fd)
+        copy_task = self.loop.run_in_executor(None, copy)
+        try:
+            follower = yield from replication.Follower.bootstrap(
+                read_fd, self.create_dir(), b'replication', max_dbs=10,
+                **kwargs)
+        finally:
+            yield from copy_task
+            os.close(read_fd)
+        self.cleanups.append(follower.async_env.close)
+        return follower
+
+    @asyncio.coroutine
+    def connect(self):
+        leader_sock, follower_sock = socket.socketpair()
+        _, writer = yield from asyncio.open_connection(sock=leader_sock)
+        reader, follower_writer = yield from asyncio.open_connection(
+            sock=follower_sock)
+        self.cleanups.append(follower_writer.close)
+        return reader, writer
+
+
+class ReplicationLogTest(ReplicationTestCase):
+
+    @asyncio.coroutine
+    def test_log_records_transactions(self):
+        env = self.create_leader()
+        db = env.open_db(b'named')
+        yield from env.get_default_db().put(b'a', b'1')
+        yield from db.put_multi([(b'b', b'2'), (b'c', b'3')])
+        yield from db.delete(b'b')
+        records = yield from env.read_replication_log()
+        self.assertEqual([sequence for sequence, _, _ in records], [1, 2, 3])
+        ops = [replication._decode_ops(ops) for _, _, ops in records]
+        self.assertEqual(ops, [
+            [(None, 'put', b'a', b'1')],
+            [(b'named', 'put', b'b', b'2'), (b'named', 'put', b'c', b'3')],
+            [(b'named', 'delete', b'b', None)]])
+
+    @asyncio.coroutine
+    def test_log_records_streams(self):
+        env = self.create_leader()
+        db = env.open_db(b'blobs')
+        yield from db.put_stream(b'blob', [b'x' * 10], chunk_size=4)
+        yield from db.delete_stream(b'blob')
+        records = yield from env.read_replication_log()
+        put_ops, delete_ops = [replication._decode_ops(ops)
+                               for _, _, ops in records]
+        self.assertEqual([(name, op) for name, op, _, _ in put_ops],
+                         [(b'blobs', 'put')] * 4)
+        self.assertEqual(put_ops[3][2], b'blob')
+        self.assertEqual(
+            sorted((op, key) for _, op, key, _ in delete_ops),
+            sorted(('delete', key) for _, _, key, _ in put_ops))
+
+    @asyncio.coroutine
+    def test_read_since(self):
+        env = self.create_leader()
+        for i in range(5):
+            yield from env.get_default_db().put(b'%d' % i, b'x')
+        records = yield from env.read_replication_log(since=2, limit=2)
+        self.assertEqual([sequence for sequence, _, _ in records], [3, 4])
+
+    @asyncio.coroutine
+    def test_trim(self):
+        env = self.create_leader()
+        for i in range(5):
+            yield from env.get_default_db().put(b'%d' % i, b'x')
+        deleted = yield from env.trim_replication_log(4)
+        self.assertEqual(deleted, 3)
+        records = yield from env.read_replication_log()
+        self.assertEqual([sequence for sequence, _, _ in records], [4, 5])
+        yield from env.get_default_db().put(b'5', b'x')
+        records = yield from env.read_replication_log(since=5)
+        self.assertEqual([sequence for sequence, _, _ in records], [6])
+
+
+class FollowerTest(ReplicationTestCase):
+
+    @asyncio.coroutine
+    def test_bootstrap_resumes_from_copy(self):
+        leader = self.create_leader()
+        yield from leader.get_default_db().put(b'a', b'1')
+        yield from leader.get_default_db().put(b'b', b'2')
+        follower = yield from self.bootstrap(leader)
+        self.assertEqual(follower.position, 2)
+        self.assertEqual(follower.lag, 0)
+        value = yield from follower.async_env.get_default_db().get(b'b')
+        self.assertEqual(value, b'2')
+
+    @asyncio.coroutine
+    def test_apply(self):
+        leader = self.create_leader()
+        follower = yield from self.bootstrap(leader)
+        db = leader.open_db(b'named')
+        yield from leader.get_default_db().put(b'a', b'1')
+        yield from db.put(b'b', b'2')
+        yield from leader.get_default_db().delete(b'a')
+        records = yield from leader.read_replication_log()
+        yield from follower.apply(records)
+        self.assertEqual(follower.position, 3)
+        default_db = follower.async_env.get_default_db()
+        self.assertIsNone((yield from default_db.get(b'a')))
+        named = follower.async_env.open_db(b'named')
+        self.assertEqual((yield from named.get(b'b')), b'2')
+
+        # Applied records are skipped, and the position is persisted.
+        yield from follower.apply(records)
+        reopened = replication.Follower(follower.async_env, follower.log_db)
+        self.assertEqual(reopened.position, 3)
+
+    @asyncio.coroutine
+    def test_apply_creates_databases_with_flags(self):
+        leader = self.create_leader()
+        follower = yield from self.bootstrap(leader)
+        db = leader.open_db(b'dups', dupsort=True)
+        yield from db.put(b'k', b'a')
+        yield from db.put(b'k', b'b')
+        yield from follower.apply((yield from leader.read_replication_log()))
+        dups = follower.async_env.open_db(b'dups', dupsort=True)
+        self.assertEqual((yield from dups.get_dups(b'k')), [b'a', b'b'])
+
+    @asyncio.coroutine
+    def test_apply_dupsort_operations(self):
+        leader = self.create_leader()
+        follower = yield from self.bootstrap(leader)
+        db = leader.open_db(b'dups', dupsort=True)
+        yield from db.put_multi([(b'a', b'1'), (b'a', b'2'), (b'a', b'3'),
+                                 (b'b', b'1'), (b'b', b'2'),
+                                 (b'c', b'1'), (b'c', b'2')])
+        yield from db.replace(b'a', b'9')
+        yield from db.pop(b'b')
+        yield from db.delete(b'c', b'2')
+        yield from follower.apply((yield from leader.read_replication_log()))
+        dups = follower.async_env.open_db(b'dups', dupsort=True)
+        expected = [(b'a', b'9'), (b'b', b'2'), (b'c', b'1')]
+        self.assertEqual((yield from db.scan()), expected)
+        self.assertEqual((yield from dups.scan()), expected)
+
+        yield from db.delete(b'a')
+        yield from follower.apply((yield from leader.read_replication_log()))
+        self.assertEqual((yield from dups.scan()), expected[1:])
+
+    @asyncio.coroutine
+    def test_apply_rejects_mismatched_flags(self):
+        leader = self.create_leader()
+        follower = yield from self.bootstrap(leader)
+        follower.async_env.open_db(b'dups')
+        yield from leader.open_db(b'dups', dupsort=True).put(b'k', b'a')
+        records = yield from leader.read_replication_log()
+        yield from self.assertAsyncRaises(replication.ReplicationError,
+                                          follower.apply(records))
+        self.assertEqual(follower.position, 0)
+
+    @asyncio.coroutine
+    def test_apply_streams(self):
+        leader = self.create_leader()
+        follower = yield from self.bootstrap(leader)
+        data = os.urandom(1000)
+        yield from leader.open_db(b'blobs').put_stream(
+            b'blob', [data], chunk_size=64)
+        yield from follower.apply((yield from leader.read_replication_log()))
+        reader = yield from follower.async_env.open_db(b'blobs').open_stream(
+            b'blob')
+        self.assertEqual((yield from reader.read()), data)
+
+    @asyncio.coroutine
+    def test_gap_raises(self):
+        leader = self.create_leader()
+        follower = yield from self.bootstrap(leader)
+        for i in range(3):
+            yield from leader.get_default_db().put(b'%d' % i, b'x')
+        yield from leader.trim_replication_log(2)
+        records = yield from leader.read_replication_log()
+        yield from self.assertAsyncRaises(replication.ReplicationError,
+                                          follower.apply(records))
+        self.assertEqual(follower.position, 0)
+
+    @asyncio.coroutine
+    def test_follow(self):
+        leader = self.create_leader()
+        yield from leader.get_default_db().put(b'a', b'1')
+        follower = yield from self.bootstrap(leader)
+        reader, writer = yield from self.connect()
+        ship_task = asyncio.ensure_future(leader.ship_replication_log(
+            writer, since=follower.position, heartbeat=0.01))
+        follow_task = asyncio.ensure_future(follower.follow(reader))
+        try:
+            for i in range(10):
+                yield from leader.get_default_db().put(b'%d' % i, b'%d' % i)
+            yield from leader.open_db(b'named').put(b'k', b'v')
+            while follower.position < 12:
+                yield from asyncio.sleep(0.01)
+            self.assertEqual(follower.lag, 0)
+            self.assertEqual(follower.lag_seconds, 0.0)
+            values = yield from follower.async_env.get_default_db().get_multi(
+                [b'%d' % i for i in range(10)])
+            self.assertEqual(values, {b'%d' % i: b'%d' % i
+                                      for i in range(10)})
+            named = follower.async_env.open_db(b'named')
+            self.assertEqual((yield from named.get(b'k')), b'v')
+        finally:
+            ship_task.cancel()
+            writer.close()
+        yield from follow_task
+        self.assertEqual(follower.position, 12)
+
+    @asyncio.coroutine
+    def test_idle_shipping_does_not_accumulate_waiters(self):
+        leader = self.create_leader()
+        reader, writer = yield from self.connect()
+        ship_task = asyncio.ensure_future(leader.ship_replication_log(
+            writer, heartbeat=0.01))
+        try:
+            yield from asyncio.sleep(0.1)
+            self.assertLessEqual(len(leader._replication_waiters), 1)
+        finally:
+            ship_task.cancel()
+            writer.close()
+        yield from asyncio.wait([ship_task])
+        self.assertEqual(leader._replication_waiters, [])
+
+    @asyncio.coroutine
+    def test_heartbeat_reports_lag(self):
+        leader = self.create_leader()
+        follower = yield from self.bootstrap(leader)
+        for i in range(3):
+            yield from leader.get_default_db().put(b'%d' % i, b'x')
+        yield from follower.apply([(3, 0.0, b'')])
+        self.assertEqual(follower.leader_position, 3)
+        self.assertEqual(follower.lag, 3)
+        self.assertEqual(follower.position, 0)
@@ -0,0 +1,127 @@
+import asyncio
+import unittest
+
+from aiolmdb import sharding
+from aiolmdb.coders import NativeUInt32Coder, StringCoder, UInt64Coder
+from tests import testlib
+
+
+class ShardingTestCase(testlib.AiolmdbTestCase):
+
+    def create_sharded_env(self, count=3, partitioner=None):
+        env = sharding.open([self.create_dir() for _ in range(count)],
+                            partitioner=partitioner, max_dbs=10)
+        self.cleanups.append(env.close)
+        return env
+
+
+class PartitionerTest(unittest.TestCase):
+
+    def test_hash_stable(self):
+        partitioner = sharding.HashPartitioner()
+        self.assertEqual(partitioner(b'key', 4), partitioner(b'key', 4))
+        self.assertTrue(all(0 <= partitioner(b'%d' % i, 4) < 4
+                            for i in range(100)))
+
+    def test_range(self):
+        partitioner = sharding.RangePartitioner([b'g', b'p'])
+        self.assertEqual(partitioner(b'a', 3), 0)
+        self.assertEqual(partitioner(b'g', 3), 1)
+        self.assertEqual(partitioner(b'o', 3), 1)
+        self.assertEqual(partitioner(b'z', 3), 2)
+
+    def test_range_validated(self):
+        self.assertRaises(ValueError,
+                          lambda: sharding.RangePartitioner([b'p', b'g']))
+        self.assertRaises(ValueError,
+                          lambda: sharding.RangePartitioner([b'g', b'g']))
+        partitioner = sharding.RangePartitioner([b'g', b'p'])
+        partitioner.check(3)
+        self.assertRaises(ValueError, lambda: partitioner.check(2))
+        self.assertRaises(ValueError, lambda: partitioner.check(4))
+
+
+class AsyncShardedDatabaseTest(ShardingTestCase):
+
+    @asyncio.coroutine
+    def test_get_put_delete(self):
+        env = self.create_sharded_env()
+        db = env.open_db(b'db', key_coder=StringCoder(),
+                         value_coder=StringCoder())
+        yield from db.put('a', 'b')
+        self.assertEqual((yield from db.get('a')), 'b')
+        self.assertTrue((yield from db.delete('a')))
+        self.assertIsNone((yield from db.get('a')))
+
+    @asyncio.coroutine
+    def test_multi(self):
+        env = self.create_sharded_env()
+        db = env.get_default_db()
+        items = [(b'%03d' % i, b'v%d' % i) for i in range(30)]
+        self.assertEqual((yield from db.put_multi(items)), (30, 30))
+        counts = [env_.stat()['entries'] for env_ in env.envs]
+        self.assertEqual(sum(counts), 30)
+        self.assertTrue(all(counts))
+        self.assertEqual((yield from db.get_multi([k for k, _ in items])),
+                         dict(items))
+        deleted = yield from db.delete_multi([b'000', b'001', b'999'])
+        self.assertEqual(deleted, {b'000': True, b'001': True,
+                                   b'999': False})
+
+    @asyncio.coroutine
+    def test_scan_merged(self):
+        env = self.create_sharded_env()
+        db = env.get_default_db()
+        items = [(b'%03d' % i, b'') for i in range(30)]
+        yield from db.put_multi(items)
+        self.assertEqual((yield from db.scan()), items)
+        self.assertEqual((yield from db.scan(b'010', b'015')),
+                         items[10:15])
+        self.assertEqual((yield from db.scan(limit=3, reverse=True)),
+                         items[::-1][:3])
+
+    @asyncio.coroutine
+    def test_scan_merged_in_database_order(self):
+        env = self.create_sharded_env()
+        keys = [1, 2, 255, 256, 511, 1000]
+        ints = env.open_db(b'ints', integerkey=True,
+                           key_coder=NativeUInt32Coder())
+        yield from ints.put_multi([(key, b'') for key in keys])
+        self.assertEqual([key for key, _ in (yield from ints.scan())], keys)
+        self.assertEqual(
+            [key for key, _ in (yield from ints.scan(reverse=True))],
+            keys[::-1])
+
+        reversed_db = env.open_db(b'reversed', reverse_key=True)
+        keys = [b'ba', b'ab', b'bb', b'aab']
+        yield from reversed_db.put_multi([(key, b'') for key in keys])
+        self.assertEqual([key for key, _ in (yield from reversed_db.scan())],
+                         sorted(keys, key=lambda key: key[::-1]))
+
+    @asyncio.coroutine
+    def test_range_partitioned(self):
+        env = self.create_sharded_env(
+            2, partitioner=sharding.RangePartitioner([b'm']))
+        db = env.get_default_db()
+        yield from db.put_multi([(b'a', b''), (b'z', b'')])
+        self.assertEqual([env_.stat()['entries'] for env_ in env.envs],
+                         [1, 1])
+        self.assertEqual((yield from db.scan()), [(b'a', b''), (b'z', b'')])
+
+    def test_range_partitioner_shard_count(self):
+        self.assertRaises(ValueError, lambda: self.create_sharded_env(
+            3, partitioner=sharding.RangePartitioner([b'm'])))
+
+    @asyncio.coroutine
+    def test_increment(self):
+        env = self.create_sharded_env()
+        db = env.open_db(b'counters', value_coder=UInt64Coder())
+        yield from asyncio.gather(*[db.increment(b'%d' % (i % 5))
+                                    for i in range(50)])
+        self.assertEqual((yield from db.get_multi([b'%d' % i
+                                                   for i in range(5)])),
+                         {b'%d' % i: 10 for i in range(5)})
+
+
+if __name__ == '__main__':
+    unittest.main()